@@ -0,0 +1,453 @@
+"""API load-test and latency benchmark.
+
+Runs the api ``App`` in-process against an in-memory metadata database stand-in and a fake broker,
+drives a configurable concurrent mix of ``/submit``, ``/status`` and ``/results`` requests and
+reports the throughput together with the p50/p95/p99 latency of each endpoint.
+
+The report is written as JSON tagged with the git commit, so runs can be compared across commits
+and used to gate performance changes:
+
+    uv run python benchmarks/api_load.py --requests 5000 --concurrency 32 --output baseline.json
+    uv run python benchmarks/api_load.py --requests 5000 --concurrency 32 --baseline baseline.json
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import UTC, datetime
+from pathlib import Path
+from typing import Annotated, Any
+
+import httpx
+import typer
+from loguru import logger
+
+from api import App
+from api.handlers.broker import BlockingQueueConnection
+from api.models.fasta_input import FastaBlobModel
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+ENDPOINTS = ("submit", "status", "results")
+
+cli = typer.Typer()
+
+
+class InMemoryMetaDataDb:
+    """Stand-in for the metadata database service, served through the httpx mock transport."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.jobs: dict[str, dict[str, Any]] = {}
+
+    def add_job(self, job_id: str, status: str = "QUEUED") -> None:
+        """Store the job as the metadata database would.
+
+        Args:
+            job_id (str): The job id.
+            status (str): The job status.
+        """
+        self.jobs[job_id] = {"job_id": job_id, "status": status, "submitted_at": datetime.now(UTC).isoformat()}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        """Handle the request sent by the api to the metadata database.
+
+        Args:
+            request (httpx.Request): The request sent by the api.
+
+        Returns:
+            httpx.Response: The response the metadata database would send.
+        """
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        path = request.url.path.rstrip("/")
+        if request.method == "POST" and path == "/job":
+            job_id = json.loads(request.content)["job_id"]
+            if job_id in self.jobs:
+                return httpx.Response(400, json={"detail": "Job ID already exists"})
+            self.add_job(job_id)
+            return httpx.Response(200, json=self.jobs[job_id])
+        if request.method == "GET" and path.startswith("/job/"):
+            job = self.jobs.get(path.removeprefix("/job/"))
+            if job is None:
+                return httpx.Response(404, json={"detail": "Job not found"})
+            return httpx.Response(200, json=job)
+        if request.method == "PUT" and path.startswith("/job/"):
+            job_id = path.removeprefix("/job/")
+            if job_id in self.jobs:
+                return httpx.Response(200, json=self.jobs[job_id])
+            self.add_job(job_id)
+            return httpx.Response(201, json=self.jobs[job_id])
+        if request.method == "PATCH" and path.startswith("/job/"):
+            job = self.jobs.get(path.removeprefix("/job/"))
+            if job is None:
+                return httpx.Response(404, json={"detail": "Job not found"})
+            job.update(json.loads(request.content))
+            return httpx.Response(200, json=job)
+        return httpx.Response(405)
+
+
+class FakeQueueConnection(BlockingQueueConnection):
+    """Broker stand-in keeping the published messages in memory.
+
+    The publish blocks for the configured latency, the same way the blocking pika connection does.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__(queue_name="bench", username="", passwd="", port=0, host="")
+        self.latency = latency
+        self.messages: list[str] = []
+
+    def publish_message(self, message: str) -> None:
+        """Store the message.
+
+        Args:
+            message (str): The message payload.
+        """
+        if self.latency:
+            time.sleep(self.latency)
+        self.messages.append(message)
+
+
+def random_fasta(rng: random.Random, n_sequences: int, min_length: int, max_length: int) -> str:
+    """Generate a random protein fasta blob.
+
+    Args:
+        rng (random.Random): The random generator.
+        n_sequences (int): Number of sequences in the blob.
+        min_length (int): Minimal sequence length.
+        max_length (int): Maximal sequence length.
+
+    Returns:
+        str: The fasta blob.
+    """
+    records = []
+    for i in range(n_sequences):
+        seq = "".join(rng.choices(AMINO_ACIDS, k=rng.randint(min_length, max_length)))
+        records.append(f">seq{i}\n{seq}\n")
+    return "".join(records)
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of the sorted values.
+
+    Args:
+        sorted_values (list[float]): The values sorted ascending.
+        q (float): The percentile in the (0, 100] range.
+
+    Returns:
+        float: The percentile value, 0.0 for no values.
+
+    Examples:
+        >>> percentile([1.0, 2.0, 3.0, 4.0], 50)
+        2.0
+        >>> percentile([1.0, 2.0, 3.0, 4.0], 99)
+        4.0
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(int(-(-q * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict[str, float]:
+    """Summarize the request latencies of a single endpoint.
+
+    Args:
+        latencies (list[float]): The request latencies in seconds.
+        errors (int): Number of requests that ended with an unexpected status code.
+        elapsed (float): Duration of the whole run in seconds.
+
+    Returns:
+        dict[str, float]: The throughput and the latency percentiles (in milliseconds).
+    """
+    values = sorted(latencies)
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput": len(values) / elapsed if elapsed else 0.0,
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+    }
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parse the load mix.
+
+    Args:
+        mix (str): Comma separated endpoint=weight pairs.
+
+    Returns:
+        dict[str, float]: The endpoint weights.
+
+    Raises:
+        typer.BadParameter: If the mix refers to an unknown endpoint.
+
+    Examples:
+        >>> parse_mix("submit=1,status=8,results=1")
+        {'submit': 1.0, 'status': 8.0, 'results': 1.0}
+    """
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise typer.BadParameter(f"Unknown endpoint {name!r}, expected one of {ENDPOINTS}.")
+        weights[name.strip()] = float(weight or 1)
+    return weights
+
+
+def git_commit() -> str:
+    """Get the commit the benchmark runs on.
+
+    Returns:
+        str: The commit hash, "unknown" outside of a git checkout.
+    """
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class LoadRunner:
+    """Drives the concurrent load against the in-process api."""
+
+    def __init__(
+        self,
+        requests: int,
+        concurrency: int,
+        mix: dict[str, float],
+        seed_jobs: int,
+        duplicate_ratio: float,
+        sequences: int,
+        result_size: int,
+        metadb_latency: float,
+        queue_latency: float,
+        seed: int,
+    ) -> None:
+        self.requests = requests
+        self.concurrency = concurrency
+        self.mix = mix
+        self.seed_jobs = seed_jobs
+        self.duplicate_ratio = duplicate_ratio
+        self.sequences = sequences
+        self.result_size = result_size
+        self.rng = random.Random(seed)
+        self.metadb = InMemoryMetaDataDb(latency=metadb_latency)
+        self.queue = FakeQueueConnection(latency=queue_latency)
+        self.latencies: dict[str, list[float]] = {name: [] for name in ENDPOINTS}
+        self.errors = dict.fromkeys(ENDPOINTS, 0)
+        self.seeded_fastas: list[str] = []
+        self.seeded_ids: list[str] = []
+        self._issued = 0
+
+    def seed(self, static_path: Path) -> None:
+        """Store the finished jobs with their results, targeted by the status, results and duplicate submits.
+
+        Args:
+            static_path (Path): The directory the api serves the results from.
+        """
+        line = "query\ttarget\t95.0\t100\t5\t0\t1\t100\t1\t100\t1e-50\t200\n"
+        result = (line * (self.result_size // len(line) + 1))[: self.result_size]
+        for _ in range(self.seed_jobs):
+            fasta = random_fasta(self.rng, self.sequences, 50, 500)
+            job_id = FastaBlobModel(fasta=fasta).job_id
+            self.metadb.add_job(job_id, status="FINISHED")
+            (static_path / f"{job_id}.m8").write_text(result)
+            self.seeded_fastas.append(fasta)
+            self.seeded_ids.append(job_id)
+
+    def next_request(self) -> tuple[str, str, str, dict[str, str] | None]:
+        """Draw the next request from the load mix.
+
+        Returns:
+            tuple[str, str, str, dict[str, str] | None]: The endpoint, method, url and json body.
+        """
+        endpoint = self.rng.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if endpoint == "submit":
+            if self.rng.random() < self.duplicate_ratio:
+                fasta = self.rng.choice(self.seeded_fastas)
+            else:
+                fasta = random_fasta(self.rng, self.sequences, 50, 500)
+            return endpoint, "POST", "/submit", {"fasta": fasta}
+        job_id = self.rng.choice(self.seeded_ids)
+        return endpoint, "GET", f"/{endpoint}/{job_id}", None
+
+    async def worker(self, client: httpx.AsyncClient, measure: bool) -> None:
+        """Send requests until the request budget is spent.
+
+        Args:
+            client (httpx.AsyncClient): Client bound to the in-process api.
+            measure (bool): Whether to record the latencies (False for the warmup).
+        """
+        while self._issued < self.requests:
+            self._issued += 1
+            endpoint, method, url, body = self.next_request()
+            start = time.perf_counter()
+            resp = await client.request(method, url, json=body)
+            elapsed = time.perf_counter() - start
+            if not measure:
+                continue
+            self.latencies[endpoint].append(elapsed)
+            if resp.status_code != 200:
+                self.errors[endpoint] += 1
+
+    async def run(self, app: App, warmup: int) -> float:
+        """Run the warmup and the measured load.
+
+        Args:
+            app (App): The api application.
+            warmup (int): Number of requests sent before measuring.
+
+        Returns:
+            float: Duration of the measured run in seconds.
+        """
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            budget, self.requests, self._issued = self.requests, warmup, 0
+            await asyncio.gather(*(self.worker(client, measure=False) for _ in range(self.concurrency)))
+            self.requests, self._issued = budget, 0
+            start = time.perf_counter()
+            await asyncio.gather(*(self.worker(client, measure=True) for _ in range(self.concurrency)))
+            return time.perf_counter() - start
+
+
+def compare(current: dict[str, Any], baseline: dict[str, Any], max_regression: float) -> list[str]:
+    """Compare the report with the baseline report.
+
+    An endpoint regresses when its throughput drops, or its p95 latency grows, by more than ``max_regression``.
+
+    Args:
+        current (dict[str, Any]): The current report.
+        baseline (dict[str, Any]): The baseline report.
+        max_regression (float): Accepted relative regression, e.g. 0.1 for 10%.
+
+    Returns:
+        list[str]: Description of each regression, empty when there are none.
+    """
+    regressions = []
+    for name, base in baseline["endpoints"].items():
+        cur = current["endpoints"].get(name)
+        if not cur or not base["count"] or not cur["count"]:
+            continue
+        if cur["throughput"] < base["throughput"] * (1 - max_regression):
+            regressions.append(f"{name}: throughput {base['throughput']:.1f} -> {cur['throughput']:.1f} req/s")
+        if cur["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms")
+    return regressions
+
+
+def print_report(report: dict[str, Any]) -> None:
+    """Print the report as a table.
+
+    Args:
+        report (dict[str, Any]): The benchmark report.
+    """
+    header = f"{'endpoint':<10} {'count':>8} {'errors':>7} {'req/s':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}"
+    typer.echo(f"commit {report['commit']} | {report['config']}")
+    typer.echo(header)
+    for name, s in {**report["endpoints"], "total": report["total"]}.items():
+        typer.echo(
+            f"{name:<10} {s['count']:>8} {s['errors']:>7} {s['throughput']:>10.1f} {s['mean_ms']:>9.2f}"
+            f" {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}"
+        )
+
+
+@cli.command()
+def run(
+    requests: Annotated[int, typer.Option(help="Number of measured requests")] = 2000,
+    concurrency: Annotated[int, typer.Option(help="Number of concurrent clients")] = 16,
+    mix: Annotated[str, typer.Option(help="Load mix as endpoint=weight pairs")] = "submit=2,status=7,results=1",
+    warmup: Annotated[int, typer.Option(help="Number of requests sent before measuring")] = 200,
+    seed_jobs: Annotated[int, typer.Option(help="Number of finished jobs stored before the run")] = 100,
+    duplicate_ratio: Annotated[float, typer.Option(help="Fraction of submissions of an already stored job")] = 0.3,
+    sequences: Annotated[int, typer.Option(help="Number of sequences per submitted fasta")] = 1,
+    result_size: Annotated[int, typer.Option(help="Size of the stored result files in bytes")] = 10_000,
+    metadb_latency: Annotated[float, typer.Option(help="Simulated metadata database latency in seconds")] = 0.0,
+    queue_latency: Annotated[float, typer.Option(help="Simulated blocking publish latency in seconds")] = 0.0,
+    seed: Annotated[int, typer.Option(help="Random seed of the workload")] = 42,
+    log_level: Annotated[str, typer.Option(help="Level of the api logs printed during the run")] = "WARNING",
+    output: Annotated[Path | None, typer.Option(help="Path to write the JSON report to")] = None,
+    baseline: Annotated[Path | None, typer.Option(help="JSON report of the baseline run to compare against")] = None,
+    max_regression: Annotated[float, typer.Option(help="Accepted relative regression against the baseline")] = 0.1,
+) -> None:
+    """Benchmark the api endpoints against in-memory stand-ins of the metadata database and the broker."""
+    logger.remove()
+    logger.add(sys.stderr, level=log_level)
+    runner = LoadRunner(
+        requests=requests,
+        concurrency=concurrency,
+        mix=parse_mix(mix),
+        seed_jobs=seed_jobs,
+        duplicate_ratio=duplicate_ratio,
+        sequences=sequences,
+        result_size=result_size,
+        metadb_latency=metadb_latency,
+        queue_latency=queue_latency,
+        seed=seed,
+    )
+    with tempfile.TemporaryDirectory() as static_dir:
+        runner.seed(Path(static_dir))
+        app = App(
+            fasta_output_path=static_dir,
+            db_endpoint="http://metadb",
+            db_port=8085,
+            queue_name="bench",
+            queue_username="",
+            queue_passwd="",
+            queue_port=0,
+            queue_host="",
+            httpx_client=httpx.AsyncClient(transport=httpx.MockTransport(runner.metadb.handle)),
+            queue=runner.queue,
+        )
+        elapsed = asyncio.run(runner.run(app, warmup))
+
+    all_latencies = [latency for values in runner.latencies.values() for latency in values]
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(UTC).isoformat(),
+        "python": platform.python_version(),
+        "config": {
+            "requests": requests,
+            "concurrency": concurrency,
+            "mix": mix,
+            "duplicate_ratio": duplicate_ratio,
+            "sequences": sequences,
+            "result_size": result_size,
+            "metadb_latency": metadb_latency,
+            "queue_latency": queue_latency,
+            "seed": seed,
+        },
+        "elapsed": elapsed,
+        "endpoints": {
+            name: summarize(runner.latencies[name], runner.errors[name], elapsed)
+            for name in ENDPOINTS
+            if name in runner.mix
+        },
+        "total": summarize(all_latencies, sum(runner.errors.values()), elapsed),
+    }
+    print_report(report)
+    if output:
+        output.write_text(json.dumps(report, indent=2))
+        typer.echo(f"Report written to {output}")
+    if baseline:
+        base = json.loads(baseline.read_text())
+        if base["config"] != report["config"]:
+            typer.echo("Warning: the baseline was run with a different configuration.")
+        regressions = compare(report, base, max_regression)
+        for regression in regressions:
+            typer.echo(f"REGRESSION {regression}")
+        if regressions:
+            raise typer.Exit(code=1)
+        typer.echo(f"No regressions against the baseline commit {base['commit']}.")
+
+
+if __name__ == "__main__":
+    cli()
@@ -11,10 +11,16 @@ import typer
 import uvicorn
 from fastapi import FastAPI
 from loguru import logger
+from prometheus_client import make_asgi_app
 
+from api.admission import AdmissionControl
 from api.controllers import router
 from api.handlers.broker import BlockingQueueConnection
 from api.handlers.db import MetaDataDb
+from api.handlers.target_db import TargetDb, TargetDbVersions
+from api.log import configure_logging
+from api.metrics import RequestLatencyMiddleware
+from api.tracing import FileSpanExporter, SpanExporter, tracer
 
 cli = typer.Typer()
 
@@ -30,10 +36,23 @@ class App:
         queue_passwd: str,
         queue_port: int,
         queue_host: str,
+        trace_file: str = "",
+        target_db_path: str = "",
+        target_db_root: str = "",
+        max_queue_depth: int = 0,
+        max_backlog_seconds: float = 0,
+        max_client_in_flight: int = 0,
+        job_seconds: float = 60.0,
+        httpx_client: httpx.AsyncClient | None = None,
+        queue: BlockingQueueConnection | None = None,
     ) -> None:
-        """ASGI application."""
+        """ASGI application.
+
+        The httpx client and the queue connection can be injected to run the application
+        against stand-ins of the metadata database and the broker (benchmarks, tests).
+        """
         self.fasta_output_path = self._verify_static_files_path(fasta_output_path)
-        self.httpx_client = httpx.AsyncClient()
+        self.httpx_client = httpx_client or httpx.AsyncClient()
         self.app = FastAPI()
 
         # db
@@ -52,7 +71,7 @@ class App:
         self.queue_port = queue_port
         self.queue_host = queue_host
         logger.info("Building queue client for host: {}:{}", queue_host, queue_port)
-        self.queue = BlockingQueueConnection(
+        self.queue = queue or BlockingQueueConnection(
             queue_name=self.queue_name,
             username=self.queue_username,
             passwd=self.queue_passwd,
@@ -60,8 +79,42 @@ class App:
             host=self.queue_host,
         )
 
+        # tracing
+        self.trace_file = trace_file
+        tracer.exporter = FileSpanExporter(trace_file) if trace_file else SpanExporter()
+
+        # target database the hit sequences are read from
+        self.target_db_path = target_db_path
+        self.target_db_root = target_db_root
+        self.target_dbs = (
+            TargetDbVersions(
+                Path(target_db_root) if target_db_root else None,
+                Path(target_db_path).name,
+                default=TargetDb(Path(target_db_path)),
+            )
+            if target_db_path
+            else None
+        )
+
+        # admission control of the submissions, backpressure when the queue backs up
+        self.max_queue_depth = max_queue_depth
+        self.max_backlog_seconds = max_backlog_seconds
+        self.max_client_in_flight = max_client_in_flight
+        self.job_seconds = job_seconds
+        self.admission = AdmissionControl(
+            self.queue,
+            max_queue_depth=max_queue_depth,
+            max_backlog_seconds=max_backlog_seconds,
+            max_client_in_flight=max_client_in_flight,
+            job_seconds=job_seconds,
+        )
+
         # router
-        self.app.include_router(router(self.db, self.queue, self.fasta_output_path))
+        self.app.include_router(router(self.db, self.queue, self.fasta_output_path, self.target_dbs, self.admission))
+
+        # metrics
+        self.app.add_middleware(RequestLatencyMiddleware)
+        self.app.mount("/metrics", make_asgi_app())
 
     @staticmethod
     def _verify_static_files_path(p: str) -> Path:
@@ -99,6 +152,13 @@ class App:
         logger.info(f"queue_username: {self.queue_username}")
         logger.info(f"queue_port: {self.queue_port}")
         logger.info(f"queue_host: {self.queue_host}")
+        logger.info(f"trace_file: {self.trace_file}")
+        logger.info(f"target_db_path: {self.target_db_path}")
+        logger.info(f"target_db_root: {self.target_db_root}")
+        logger.info(f"max_queue_depth: {self.max_queue_depth}")
+        logger.info(f"max_backlog_seconds: {self.max_backlog_seconds}")
+        logger.info(f"max_client_in_flight: {self.max_client_in_flight}")
+        logger.info(f"job_seconds: {self.job_seconds}")
         logger.info("Starting API at http://{}:{}", host, port)
         uvicorn.run(self.app, host=host, port=port)
 
@@ -117,8 +177,66 @@ def run(
     queue_passwd: Annotated[str, typer.Option(help="Password for the message queue", envvar="QUEUE_PASSWD")] = "",
     queue_port: Annotated[int, typer.Option(help="Port for the message queue", envvar="QUEUE_PORT")] = 5672,
     queue_host: Annotated[str, typer.Option(help="Host for the message queue", envvar="QUEUE_HOST")] = "127.0.0.1",
+    trace_file: Annotated[
+        str,
+        typer.Option(help="Path to the file the trace spans are appended to, disabled when empty", envvar="TRACE_FILE"),
+    ] = "",
+    target_db_path: Annotated[
+        str,
+        typer.Option(
+            help="Path to the MMseqs2 target database the hit sequences are read from, disabled when empty",
+            envvar="TARGET_DB_PATH",
+        ),
+    ] = "",
+    target_db_root: Annotated[
+        str,
+        typer.Option(
+            help="Directory of the versions of the target database, unversioned when empty",
+            envvar="TARGET_DB_ROOT",
+        ),
+    ] = "",
+    max_queue_depth: Annotated[
+        int,
+        typer.Option(help="Queued jobs above which the submissions get 429, 0 for no limit", envvar="MAX_QUEUE_DEPTH"),
+    ] = 0,
+    max_backlog_seconds: Annotated[
+        float,
+        typer.Option(
+            help="Estimated seconds to drain the queue above which the submissions get 429, 0 for no limit",
+            envvar="MAX_BACKLOG_SECONDS",
+        ),
+    ] = 0,
+    max_client_in_flight: Annotated[
+        int,
+        typer.Option(
+            help="Jobs a client may have in flight, its next submissions get 429, 0 for no limit",
+            envvar="MAX_CLIENT_IN_FLIGHT",
+        ),
+    ] = 0,
+    job_seconds: Annotated[
+        float,
+        typer.Option(help="Estimated seconds a worker takes per job, for the backlog time", envvar="JOB_SECONDS"),
+    ] = 60.0,
+    log_level: Annotated[str, typer.Option(help="Minimum level of the logs", envvar="LOG_LEVEL")] = "INFO",
+    log_queue_size: Annotated[
+        int,
+        typer.Option(
+            help="Log messages waiting for the writer thread, 0 to write them on the request path",
+            envvar="LOG_QUEUE_SIZE",
+        ),
+    ] = 10000,
+    log_sample_burst: Annotated[
+        int, typer.Option(help="INFO logs of a call site written per sampling window", envvar="LOG_SAMPLE_BURST")
+    ] = 20,
+    log_sample_seconds: Annotated[
+        float,
+        typer.Option(
+            help="Seconds of a sampling window of the INFO logs, 0 to log everything", envvar="LOG_SAMPLE_SECONDS"
+        ),
+    ] = 10.0,
 ):
     """CLI command to run the API application."""
+    configure_logging(log_level, log_queue_size, log_sample_burst, log_sample_seconds)
     app = App(
         fasta_output_path=fasta_output_path,
         db_endpoint=db_endpoint,
@@ -128,6 +246,13 @@ def run(
         queue_passwd=queue_passwd,
         queue_port=queue_port,
         queue_host=queue_host,
+        trace_file=trace_file,
+        target_db_path=target_db_path,
+        target_db_root=target_db_root,
+        max_queue_depth=max_queue_depth,
+        max_backlog_seconds=max_backlog_seconds,
+        max_client_in_flight=max_client_in_flight,
+        job_seconds=job_seconds,
     )
 
     app.run(port=app_port, host=app_host)
@@ -0,0 +1,206 @@
+"""Admission control of the submissions, backpressure when the job queue backs up.
+
+A job that is published to the queue is admitted unless one of the limits is exceeded:
+
+* the messages ready in the queue,
+* the estimated time to drain them, ``messages * job_seconds / consumers``,
+* the jobs in flight of the client, admitted and not seen done yet.
+
+A rejected submission gets 429 Too Many Requests with a ``Retry-After`` computed from the excess: the time
+the workers need to drain the messages over the limit, or the backlog of the queue for a client over its limit.
+The depth of the queue is read from the broker at most once per ``depth_refresh_seconds``. Submissions of jobs
+that are already queued, running or finished add no work and are never rejected.
+"""
+
+import asyncio
+import math
+import time
+from collections.abc import Callable
+
+from fastapi import HTTPException, Request
+from loguru import logger
+
+from api.handlers.broker import BlockingQueueConnection
+from api.metrics import ADMISSION_REJECTED, QUEUE_DEPTH
+from api.singleflight import SingleFlight
+
+# upper bound of the Retry-After sent to the clients, in seconds
+MAX_RETRY_AFTER = 3600
+
+
+def client_id(request: Request) -> str:
+    """Identify the client of the request.
+
+    Args:
+        request (Request): The request.
+
+    Returns:
+        str: The first address of ``X-Forwarded-For`` (the api runs behind an ingress), else the peer address.
+    """
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class AdmissionControl:
+    """Admit the jobs to the queue within the limits, each limit is disabled when 0."""
+
+    def __init__(
+        self,
+        queue: BlockingQueueConnection,
+        max_queue_depth: int = 0,
+        max_backlog_seconds: float = 0,
+        max_client_in_flight: int = 0,
+        job_seconds: float = 60.0,
+        depth_refresh_seconds: float = 1.0,
+        in_flight_ttl_seconds: float = 3600.0,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Set the limits of the admission.
+
+        Args:
+            queue (BlockingQueueConnection): The message queue the depth is read from.
+            max_queue_depth (int): Messages ready in the queue above which the submissions are rejected.
+            max_backlog_seconds (float): Estimated seconds to drain the queue above which the submissions are rejected.
+            max_client_in_flight (int): Jobs a client may have in flight, its next submissions are rejected.
+            job_seconds (float): Estimated seconds a worker takes per job.
+            depth_refresh_seconds (float): Seconds the depth read from the broker is reused.
+            in_flight_ttl_seconds (float): Seconds a job counts in flight when its completion is not seen.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+        """
+        self.queue = queue
+        self.max_queue_depth = max_queue_depth
+        self.max_backlog_seconds = max_backlog_seconds
+        self.max_client_in_flight = max_client_in_flight
+        self.job_seconds = job_seconds
+        self.depth_refresh_seconds = depth_refresh_seconds
+        self.in_flight_ttl_seconds = in_flight_ttl_seconds
+        self.clock = clock
+        self._depth: tuple[int, int] = (0, 0)
+        self._depth_read_at: float | None = None
+        self._reads = SingleFlight()
+        # client -> job_id -> admission time
+        self._in_flight: dict[str, dict[str, float]] = {}
+        self._clients: dict[str, str] = {}
+
+    @property
+    def enabled(self) -> bool:
+        """Check if any limit is set.
+
+        Returns:
+            bool: True if a limit is set.
+        """
+        return bool(self.max_queue_depth or self.max_backlog_seconds or self.max_client_in_flight)
+
+    async def _read_depth(self) -> tuple[int, int]:
+        try:
+            self._depth = await asyncio.to_thread(self.queue.queue_depth)
+        except Exception as e:
+            # the depth of the last read is kept, publishing the job reports the broker errors
+            logger.warning("Failed to read the depth of the queue: {}", e)
+        self._depth_read_at = self.clock()
+        QUEUE_DEPTH.set(self._depth[0])
+        return self._depth
+
+    async def depth(self) -> tuple[int, int]:
+        """Get the depth of the queue, read from the broker at most once per refresh interval.
+
+        Returns:
+            tuple[int, int]: The messages ready in the queue and the number of its consumers.
+        """
+        if self._depth_read_at is not None and self.clock() - self._depth_read_at < self.depth_refresh_seconds:
+            return self._depth
+        return await self._reads.do("depth", self._read_depth)
+
+    def in_flight(self, client: str) -> int:
+        """Count the jobs in flight of the client.
+
+        Args:
+            client (str): The client id.
+
+        Returns:
+            int: The jobs admitted for the client and not seen done, within the TTL.
+        """
+        jobs = self._in_flight.get(client)
+        if not jobs:
+            return 0
+        expired_before = self.clock() - self.in_flight_ttl_seconds
+        for job_id in [job_id for job_id, admitted_at in jobs.items() if admitted_at < expired_before]:
+            self.release(job_id)
+        return len(jobs)
+
+    def exceeded(self, messages: int, consumers: int, client: str) -> tuple[str, str, float] | None:
+        """Check the limits against the depth of the queue and the jobs in flight of the client.
+
+        Args:
+            messages (int): The messages ready in the queue.
+            consumers (int): The consumers of the queue.
+            client (str): The client id.
+
+        Returns:
+            tuple[str, str, float] | None: The limit exceeded, the reason and the seconds to wait, None within the limits.
+        """
+        # seconds per message the workers of the queue take, a queue without consumers drains at one worker's pace
+        drain = self.job_seconds / max(consumers, 1)
+        backlog = messages * drain
+        if self.max_queue_depth and messages > self.max_queue_depth:
+            return (
+                "queue_depth",
+                f"{messages} jobs are queued, the limit is {self.max_queue_depth}",
+                (messages - self.max_queue_depth) * drain,
+            )
+        if self.max_backlog_seconds and backlog > self.max_backlog_seconds:
+            return (
+                "backlog",
+                f"The queued jobs take about {backlog:.0f}s, the limit is {self.max_backlog_seconds:g}s",
+                backlog - self.max_backlog_seconds,
+            )
+        in_flight = self.in_flight(client)
+        if self.max_client_in_flight and in_flight >= self.max_client_in_flight:
+            # one of the jobs of the client is done at the latest once the queue ahead of it is drained
+            return (
+                "client_in_flight",
+                f"The client has {in_flight} jobs in flight, the limit is {self.max_client_in_flight}",
+                backlog + self.job_seconds,
+            )
+        return None
+
+    async def admit(self, client: str, job_id: str) -> None:
+        """Admit the job of the client to the queue, counting it in flight.
+
+        Args:
+            client (str): The client id.
+            job_id (str): The job to publish.
+
+        Raises:
+            HTTPException: If a limit is exceeded (429), with the seconds to wait in the ``Retry-After`` header.
+        """
+        if not self.enabled:
+            return
+        exceeded = self.exceeded(*await self.depth(), client)
+        if exceeded is not None:
+            limit, reason, retry_after = exceeded
+            retry_after = min(max(math.ceil(retry_after), 1), MAX_RETRY_AFTER)
+            ADMISSION_REJECTED.labels(limit=limit).inc()
+            logger.warning("Submission of job {} rejected, {}, retry after {}s", job_id, reason, retry_after)
+            raise HTTPException(
+                status_code=429, detail=f"{reason}, retry later.", headers={"Retry-After": str(retry_after)}
+            )
+        if self.max_client_in_flight:
+            self._in_flight.setdefault(client, {})[job_id] = self.clock()
+            self._clients[job_id] = client
+
+    def release(self, job_id: str) -> None:
+        """Stop counting the job in flight, once it is seen done.
+
+        Args:
+            job_id (str): The job.
+        """
+        client = self._clients.pop(job_id, None)
+        if client is None:
+            return
+        jobs = self._in_flight[client]
+        jobs.pop(job_id, None)
+        if not jobs:
+            del self._in_flight[client]
@@ -1,82 +1,147 @@
 """Routers for the API endpoints."""
 
+import asyncio
 from pathlib import Path
+from typing import Annotated
 
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import Response
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from loguru import logger
+from pydantic import ValidationError
 
+from api.admission import AdmissionControl, client_id
 from api.handlers.broker import BlockingQueueConnection
 from api.handlers.db import MetaDataDb
-from api.models.db import MetadataDbGetRequest, MetaDataDbGetResponse, MetadataDbPostRequest, MetaDataDbPostResponse
+from api.handlers.results import (
+    QUERIES_DONE_HEADER,
+    QUERIES_TOTAL_HEADER,
+    RESULT_COMPLETE_HEADER,
+    ResultStore,
+    accepts_encoding,
+    pair_id,
+)
+from api.handlers.target_db import TargetDb, TargetDbVersions
+from api.log import Payload
+from api.models.db import (
+    JobListRequest,
+    JobListResponse,
+    MetadataDbGetRequest,
+    MetaDataDbGetResponse,
+    MetadataDbPostRequest,
+    MetaDataDbPostResponse,
+)
 from api.models.fasta_input import FastaBlobModel
+from api.models.hits import HitSequencesRequest, PairAlignmentRequest
+from api.models.output_format import OutputFormatModel
+from api.singleflight import SingleFlight
+from api.status import TaskStatus
+from api.tracing import tracer
 
 
-def router(db: MetaDataDb, queue: BlockingQueueConnection, static_path: Path) -> APIRouter:
+def router(
+    db: MetaDataDb,
+    queue: BlockingQueueConnection,
+    static_path: Path,
+    target_dbs: TargetDbVersions | None = None,
+    admission: AdmissionControl | None = None,
+) -> APIRouter:
     """Router for the database and queue endpoints.
 
-    This function creates an APIRouter with two endpoints:
+    This function creates an APIRouter with the endpoints, among them:
     - POST /submit: Submits a fasta blob to the service.
     - GET /status/{job_id}: Gets the status of a job by its job_id.
+    - GET /jobs: Lists the jobs, filtered by status and submission time.
 
     Args:
         db (MetaDataDb): The metadata database handler.
         queue (BlockingQueueConnection): The message queue handler.
         static_path (Path): The path to the directory where static files are stored.
+        target_dbs (TargetDbVersions | None): The target databases the hit sequences are read from, None to disable them.
+        admission (AdmissionControl | None): The admission control of the submissions, None to admit them all.
 
     Returns:
         APIRouter: The configured API router.
     """
     router = APIRouter(tags=["status"])
+    admission = admission or AdmissionControl(queue)
+    result_store = ResultStore(static_path)
+    submissions = SingleFlight()
 
     @router.post("/submit", response_model=MetaDataDbPostResponse, status_code=200)
-    async def submit(content: FastaBlobModel) -> MetaDataDbPostResponse:
+    async def submit(content: FastaBlobModel, request: Request) -> MetaDataDbPostResponse:
         """Submit a fasta blob to the service.
 
         This function is handler for the /submit endpoint.
-        It checks if the job already exists in the metadata database.
-        * If it does not exist, it publishes the job to the message queue and adds it to the database.
+        It creates the job in the metadata database unless it exists, in a single atomic request.
+        * If the job was created, it publishes the job to the message queue.
         * If the job already exists, it returns the existing job status.
-        * If there is an unexpected error while fetching the job from the database, it raises a HTTPException with status code 500.
+        * If the job results were evicted (EXPIRED, or FINISHED with the result file missing), or the job was
+          CANCELLED or FAILED (e.g. dead-lettered once its retries ran out), it puts the job back to the QUEUED state in the database, then publishes the job to the
+          message queue again. The job is marked EXPIRED if it cannot be published.
+        * If there is an unexpected error while creating the job in the database, it raises a HTTPException with status code 500.
+
+        Before a job is published, the admission control checks the depth of the queue, the estimated time to drain
+        it and the jobs in flight of the client. Over a limit the submission is rejected with 429 and a
+        ``Retry-After`` header, a created job is marked EXPIRED so the next submission publishes it.
+
+        The job id is keyed by the version of the target database the workers publish on the results volume,
+        the same fasta submitted after a database update is searched again against the new version.
+        Concurrent submissions of the same job are coalesced, only the first one sends the requests.
+        The submission starts a new trace, its context is propagated to the worker with the queued message.
 
         Args:
             content (FastaBlobModel): The fasta blob and job_id to be submitted.
+            request (Request): The request, the client is identified by its address.
 
         Returns:
             MetaDataDbPostResponse: The response object containing job_id and status.
 
-        Raises:
-            HTTPException: If there is an unexpected error while fetching the job from the database (500).
-
         Note:
             When the model fails to validate FastaBlobModel the fastapi will automatically send the response 422 Unprocessable Entity.
         """
-        logger.info("Got POST request")
-        logger.debug(f"Fasta content: {content.fasta[:30]}...")
-        logger.info(f"Job ID: {content.job_id}")
-
-        logger.info(f"Checking if job {content.job_id} exists in database")
-        initial_resp = await db.get_job_response(MetadataDbGetRequest(job_id=content.job_id))
-        match initial_resp.status_code:
-            case 404:
-                logger.info(f"Job {content.job_id} not found in the database, submitting new job.")
-                msg = content.to_message()
-                logger.info(f"Publishing job {content.job_id} to queue.")
-                queue.publish_message(msg)
-                logger.success(f"Successfully published job {content.job_id} to queue.")
-                logger.info(f"Publishing job {content.job_id} to database")
-                resp = await db.post_job(MetadataDbPostRequest(job_id=content.job_id))
-                logger.success(f"Successfully published job {content.job_id} to database.")
-                logger.success(f"Successfully submitted job {content.job_id}")
-                return resp
-            case 200:
-                logger.info(f"Job {content.job_id} found in the database, returning existing status.")
-                resp_obj = MetaDataDbGetResponse(**initial_resp.json())
-                logger.success(f"Job {content.job_id} status: {resp_obj.status}")
-                return MetaDataDbPostResponse(job_id=resp_obj.job_id, status=resp_obj.status)
-            case _:
-                logger.error(f"Unexpected error while fetching job {content.job_id} from database.")
-                raise HTTPException(status_code=500, detail=f"Failed fetching {content.job_id} from database.")
+        content.set_db_version(result_store.db_version())
+        with tracer.start_span("api.submit", job_id=content.job_id, db_version=content.db_version) as span:
+            logger.info("Got POST request")
+            logger.debug("Submission: {}", Payload({"job_id": content.job_id, "fasta": content.fasta}))
+            logger.info("Job ID: {}", content.job_id)
+            span.attributes["coalesced"] = submissions.in_flight(content.job_id)
+            return await submissions.do(content.job_id, lambda: register(content, client_id(request)))
+
+    async def register(content: FastaBlobModel, client: str) -> MetaDataDbPostResponse:
+        logger.info("Creating job {} in database unless it exists", content.job_id)
+        job, created = await db.create_or_get_job(MetadataDbPostRequest(job_id=content.job_id))
+        if created:
+            logger.info("Job {} created in the database, publishing job to queue.", content.job_id)
+            try:
+                await admission.admit(client, content.job_id)
+                queue.publish_message(content.to_message())
+            except Exception:
+                # the next submission of the job publishes it again
+                admission.release(content.job_id)
+                await db.expire_job(content.job_id)
+                raise
+            logger.success("Successfully submitted job {}", content.job_id)
+            return MetaDataDbPostResponse(job_id=job.job_id, status=job.status)
+        if job.status in (TaskStatus.EXPIRED, TaskStatus.CANCELLED, TaskStatus.FAILED) or (
+            job.status == TaskStatus.FINISHED and result_store.find(content.job_id) is None
+        ):
+            logger.info("Job {} is {} without results, requeuing the job.", content.job_id, job.status)
+            await admission.admit(client, content.job_id)
+            # the job is QUEUED before the message is published, the worker does not claim an EXPIRED job and
+            # skips a CANCELLED one
+            try:
+                res = await db.requeue_job(content.job_id)
+                queue.publish_message(content.to_message())
+            except Exception:
+                # the next submission of the job publishes it again
+                admission.release(content.job_id)
+                await db.expire_job(content.job_id)
+                raise
+            logger.success("Successfully published job {} to queue.", content.job_id)
+            return res
+        logger.info("Job {} found in the database, returning existing status.", content.job_id)
+        logger.success("Job {} status: {}", content.job_id, job.status)
+        return MetaDataDbPostResponse(job_id=job.job_id, status=job.status)
 
     @router.get("/status/{job_id}", response_model=MetaDataDbGetResponse, status_code=200)
     async def status(job_id: str) -> MetaDataDbGetResponse:
@@ -84,6 +149,8 @@ def router(db: MetaDataDb, queue: BlockingQueueConnection, static_path: Path) ->
 
         This function is handler for the /status/{job_id} endpoint.
         It fetches the job status from the metadata database using the provided job_id.
+        A FINISHED job comes with the summary of its result (hit counts and best hit per query, e-value and
+        identity distributions), listings do not need to read the result files.
 
         Args:
             job_id (str): The unique identifier for the job.
@@ -94,38 +161,293 @@ def router(db: MetaDataDb, queue: BlockingQueueConnection, static_path: Path) ->
         Raises:
             HTTPException: If the job is not found (404) or if there is an unexpected error (500).
         """
-        logger.info(f"Got GET request with {job_id}")
+        logger.info("Got GET request with {}", job_id)
         res = await db.get_job(data=MetadataDbGetRequest(job_id=job_id))
-        logger.success(f"Successfully fetched job {job_id} status: {res.status}")
+        logger.success("Successfully fetched job {} status: {}", job_id, res.status)
+        if res.status not in (TaskStatus.QUEUED, TaskStatus.RUNNING):
+            admission.release(job_id)
+        return res
+
+    @router.get("/jobs", response_model=JobListResponse, response_model_exclude_none=True, status_code=200)
+    async def list_jobs(filters: Annotated[JobListRequest, Query()]) -> JobListResponse:
+        """List the jobs, newest first, filtered by status and submission time.
+
+        This function is handler for the /jobs endpoint.
+        The jobs are paged with a cursor: the response carries the ``next_cursor`` of the next page, absent on the
+        last page, sent back as the ``cursor`` query parameter. The pages are read from the indexes of the metadata
+        database, listing the jobs stays fast however many jobs it holds.
+
+        Args:
+            filters (JobListRequest): The statuses, the submission time range, the page size and the cursor.
+
+        Returns:
+            JobListResponse: The jobs of the page and the cursor of the next page.
+        """
+        logger.info("Got GET request listing jobs with {}", filters)
+        return await db.list_jobs(filters)
+
+    @router.delete("/jobs/{job_id}", response_model=MetaDataDbPostResponse, status_code=200)
+    async def cancel(job_id: str) -> MetaDataDbPostResponse:
+        """Cancel a queued or running job.
+
+        This function is handler for the /jobs/{job_id} endpoint.
+        It marks the job CANCELLED in the metadata database, the message of a queued job stays in the queue and is
+        skipped by the worker on delivery. The worker searching a running job polls its status, terminates the
+        mmseqs process and removes its workspace. Cancelling a cancelled job returns it as it is, a cancelled job
+        submitted again is searched again.
+
+        Args:
+            job_id (str): The unique identifier for the job.
+
+        Returns:
+            MetaDataDbPostResponse: The response object containing job_id and status.
+
+        Raises:
+            HTTPException: If the job is not found (404), already done (409) or if there is an unexpected error (500).
+        """
+        logger.info("Got DELETE request with {}", job_id)
+        job = await db.get_job(data=MetadataDbGetRequest(job_id=job_id))
+        if job.status == TaskStatus.CANCELLED:
+            return MetaDataDbPostResponse(job_id=job_id, status=job.status)
+        if job.status not in (TaskStatus.QUEUED, TaskStatus.RUNNING):
+            raise HTTPException(
+                status_code=409, detail=f"Job {job_id} is {job.status}, only queued and running jobs can be cancelled."
+            )
+        res = await db.cancel_job(job_id)
+        admission.release(job_id)
+        logger.success("Cancelled job {}, it was {}.", job_id, job.status)
         return res
 
     @router.get("/results/{job_id}", status_code=200)
-    async def results(job_id: str) -> Response:
+    async def results(
+        job_id: str,
+        accept_encoding: Annotated[str | None, Header()] = None,
+        output_format: Annotated[
+            str | None, Query(alias="format", description="Comma separated mmseqs convertalis output columns.")
+        ] = None,
+    ) -> Response:
         """Get the results of a job by its job_id.
 
         This function is handler for the /results/{job_id} endpoint.
-        It fetches the job results from the metadata database using the provided job_id.
+        It serves the result file the worker wrote to the static path for the provided job_id.
+        * The gzip compressed results are sent as they are stored (Content-Encoding: gzip) to the clients accepting gzip.
+        * The other clients get the results decompressed on the fly as a stream.
+        Serving the results refreshes their access time, the worker evicts the least recently used results first.
+
+        While a job searched in steps is RUNNING, the hits of the queries searched so far are served with
+        ``X-Result-Complete: false`` and the progress in ``X-Queries-Done`` and ``X-Queries-Total``.
+        The complete results are served with ``X-Result-Complete: true``.
+
+        With the format query parameter the results are served with the requested convertalis columns.
+        The first request publishes a convertalis task to the message queue and returns 202 Accepted,
+        the worker generates the columns from the alignment DB of the job without searching again.
 
         Args:
             job_id (str): The unique identifier for the job.
+            accept_encoding (str | None): The Accept-Encoding request header.
+            output_format (str | None): The comma separated output columns, the search result columns when None.
 
         Returns:
-            str: content of the .m8 result file.
+            Response: content of the .m8 result file, or 202 Accepted while the output format is generated.
 
         Raises:
-            HTTPException: If the job is not found (404) or if there is an unexpected error (500).
+            HTTPException: If the format is invalid (422), the job is not found (404) or if the alignment DB
+                needed to generate the output format has expired (410).
         """
-        logger.info(f"Got GET request for results with {job_id}.")
-        result_file = static_path / f"{job_id}.m8"
-        logger.info(f"Searching for results in static path, {static_path}.")
-        if not result_file.exists() or not result_file.is_file():
-            logger.error(f"Results for job {job_id} not found.")
+        logger.info("Got GET request for results with {}.", job_id)
+        format_id = None
+        if output_format is not None:
+            try:
+                output = OutputFormatModel(job_id=job_id, format_output=output_format)
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=e.errors()[0]["msg"]) from e
+            format_id = None if output.is_default else output.format_id
+        logger.info("Searching for results in static path, {}.", static_path)
+        path = result_store.find(job_id, format_id)
+        if path is None and format_id is not None and result_store.find(job_id) is not None:
+            if not result_store.has_alignment(job_id):
+                logger.error("Alignment DB of job {} expired.", job_id)
+                raise HTTPException(
+                    status_code=410, detail=f"Alignment of job {job_id} expired, only the default format is available."
+                )
+            # the task is published once, the next polls wait for it
+            if result_store.mark_pending(job_id, format_id):
+                logger.info("Requesting format {} of job {} from the worker.", output.format_output, job_id)
+                try:
+                    queue.publish_message(output.to_message())
+                except Exception:
+                    result_store.clear_pending(job_id, format_id)
+                    raise
+            return JSONResponse(
+                status_code=202,
+                content={"job_id": job_id, "status": TaskStatus.QUEUED},
+                headers={"Retry-After": "5"},
+            )
+        if path is None and format_id is None and (partial := result_store.find_partial(job_id)) is not None:
+            try:
+                chunks = result_store.iter_partial(partial)
+            except FileNotFoundError:
+                # the job finished in the meantime
+                path = result_store.find(job_id)
+            else:
+                logger.info(
+                    "Serving partial results of job {}, {}/{}.", job_id, partial.queries_done, partial.queries_total
+                )
+                return StreamingResponse(
+                    chunks,
+                    media_type="text/plain",
+                    headers={
+                        RESULT_COMPLETE_HEADER: "false",
+                        QUERIES_DONE_HEADER: str(partial.queries_done),
+                        QUERIES_TOTAL_HEADER: str(partial.queries_total),
+                    },
+                )
+        if path is None:
+            logger.error("Results for job {} not found.", job_id)
             raise HTTPException(status_code=404, detail=f"Results for job {job_id} not found.")
-        content = result_file.read_text()
-        if not content:
-            logger.error(f"Results for job {job_id} are empty.")
-        logger.info(f"Successfully fetched results for job {job_id}.")
-        logger.info(f"Results content: {content[:30]}...")
-        return Response(content=content, media_type="text/plain")
+        if format_id is not None:
+            result_store.clear_pending(job_id, format_id)
+        result_store.touch(path)
+        # the job is done, it no longer counts in flight for its client
+        admission.release(job_id)
+        logger.info("Successfully fetched results for job {}.", job_id)
+        if not result_store.is_compressed(path):
+            return FileResponse(path, media_type="text/plain", headers={RESULT_COMPLETE_HEADER: "true"})
+        headers = {"Vary": "Accept-Encoding", RESULT_COMPLETE_HEADER: "true"}
+        if accepts_encoding(accept_encoding, "gzip"):
+            return FileResponse(path, media_type="text/plain", headers=headers | {"Content-Encoding": "gzip"})
+        return StreamingResponse(result_store.iter_decompressed(path), media_type="text/plain", headers=headers)
+
+    async def check_hits_available(job_id: str) -> TargetDb:
+        if target_dbs is None:
+            raise HTTPException(status_code=404, detail="Hit sequences are not served, the api has no target database.")
+        if result_store.find(job_id) is None and result_store.find_partial(job_id) is None:
+            logger.error("Results for job {} not found.", job_id)
+            raise HTTPException(status_code=404, detail=f"Results for job {job_id} not found.")
+        # the version the job was searched against, the current one once its alignment DB expired
+        version = result_store.job_db_version(job_id) or result_store.db_version()
+        # the first request of a version maps it and may build its accession index
+        db = await asyncio.to_thread(target_dbs.get, version)
+        if db is None:
+            logger.error("Version {} of the target database is not available.", version)
+            raise HTTPException(status_code=404, detail=f"Version {version} of the target database is not available.")
+        return db
+
+    @router.get("/results/{job_id}/hits/{target}/sequence", status_code=200)
+    async def hit_sequence(job_id: str, target: str) -> Response:
+        """Get the sequence of a hit of a job in FASTA.
+
+        This function is handler for the /results/{job_id}/hits/{target}/sequence endpoint.
+        The sequence is read from the memory-mapped target database, no external service is queried.
+
+        Args:
+            job_id (str): The unique identifier for the job.
+            target (str): The target of the hit, as in the results or its accession.
+
+        Returns:
+            Response: The FASTA record of the target.
+
+        Raises:
+            HTTPException: If the api serves no target database, the job has no results, the version of the
+                target database of the job is not available or the target is not in it (404).
+        """
+        db = await check_hits_available(job_id)
+        entry = db.get(target)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Target {target} not found in the target database.")
+        header, sequence = entry
+        return Response(f">{header}\n{sequence}\n", media_type="text/plain")
+
+    @router.post("/results/{job_id}/hits/sequences", status_code=200)
+    async def hit_sequences(job_id: str, request: HitSequencesRequest) -> Response:
+        """Get the sequences of many hits of a job in FASTA.
+
+        This function is handler for the /results/{job_id}/hits/sequences endpoint.
+        The records are returned in the requested order, the targets missing from the target database are
+        skipped and counted in the ``X-Targets-Missing`` header.
+
+        Args:
+            job_id (str): The unique identifier for the job.
+            request (HitSequencesRequest): The targets of the hits.
+
+        Returns:
+            Response: The FASTA records of the targets found.
+
+        Raises:
+            HTTPException: If the api serves no target database, the job has no results or the version of the
+                target database of the job is not available (404).
+        """
+        db = await check_hits_available(job_id)
+        records = list(db.iter_fasta(request.targets))
+        logger.info("Serving {} of {} hit sequences of job {}.", len(records), len(request.targets), job_id)
+        return Response(
+            "".join(records),
+            media_type="text/plain",
+            headers={"X-Targets-Missing": str(len(request.targets) - len(records))},
+        )
+
+    @router.post("/results/{job_id}/alignments", status_code=200)
+    async def pair_alignments(job_id: str, request: PairAlignmentRequest) -> JSONResponse:
+        """Get the alignments of selected query/target pairs of a job.
+
+        This function is handler for the /results/{job_id}/alignments endpoint.
+        The alignments are rendered by the worker on request and cached per pair, only the pairs not cached yet
+        are published to the message queue in an align task and 202 Accepted is returned until all are there.
+        The worker extracts the pairs from the alignment DB of the job. Once it has expired, the pairs are aligned
+        by searching their queries again, which needs the fasta submitted for the job in the request.
+
+        Args:
+            job_id (str): The unique identifier for the job.
+            request (PairAlignmentRequest): The pairs, and the fasta of the job to search the queries again.
+
+        Returns:
+            JSONResponse: The alignments of the pairs in the requested order, or 202 Accepted while they are aligned.
+
+        Raises:
+            HTTPException: If the job is not found (404), the alignment DB of the job expired and no fasta is
+                sent (410) or the fasta is not the one of the job (422).
+        """
+        if result_store.find(job_id) is None:
+            logger.error("Results for job {} not found.", job_id)
+            raise HTTPException(status_code=404, detail=f"Results for job {job_id} not found.")
+        alignments = [result_store.find_pair_alignment(job_id, pair.query, pair.target) for pair in request.pairs]
+        missing = [pair for pair, alignment in zip(request.pairs, alignments, strict=True) if alignment is None]
+        if not missing:
+            for pair in request.pairs:
+                result_store.clear_pending(job_id, pair_id(pair.query, pair.target))
+            logger.info("Serving {} cached pair alignments of job {}.", len(alignments), job_id)
+            return JSONResponse(content={"job_id": job_id, "alignments": alignments})
+
+        fasta, db_version = None, None
+        if not result_store.has_alignment(job_id):
+            if request.fasta is None:
+                logger.error("Alignment DB of job {} expired.", job_id)
+                raise HTTPException(
+                    status_code=410,
+                    detail=f"Alignment of job {job_id} expired, send the fasta of the job to align the pairs again.",
+                )
+            try:
+                submitted = FastaBlobModel(fasta=request.fasta)
+            except ValidationError as e:
+                raise HTTPException(status_code=422, detail=e.errors()[0]["msg"]) from e
+            submitted.set_db_version(result_store.db_version())
+            if submitted.job_id != job_id:
+                raise HTTPException(status_code=422, detail=f"The fasta is not the one of job {job_id}.")
+            fasta, db_version = submitted.fasta, submitted.db_version
+        # each pair is published once, the next polls wait for the pairs pending
+        published = [pair for pair in missing if result_store.mark_pending(job_id, pair_id(pair.query, pair.target))]
+        if published:
+            logger.info("Requesting {} pair alignments of job {} from the worker.", len(published), job_id)
+            try:
+                queue.publish_message(request.to_message(job_id, published, fasta, db_version))
+            except Exception:
+                for pair in published:
+                    result_store.clear_pending(job_id, pair_id(pair.query, pair.target))
+                raise
+        return JSONResponse(
+            status_code=202,
+            content={"job_id": job_id, "status": TaskStatus.QUEUED, "pending": len(missing)},
+            headers={"Retry-After": "5"},
+        )
 
     return router
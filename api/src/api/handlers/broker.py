@@ -1,9 +1,14 @@
 """Handlers for broker-related operations."""
 
+from time import perf_counter, time
+
 import pika
 from fastapi import HTTPException
 from pika.exceptions import UnroutableError
 
+from api.metrics import QUEUE_PUBLISH_LATENCY
+from api.tracing import TRACEPARENT_HEADER, tracer
+
 
 class BlockingQueueConnection:
     """Blocking connection to RabbitMQ queue."""
@@ -32,6 +37,32 @@ class BlockingQueueConnection:
         self.passwd = passwd
         self.host = host
 
+    def _parameters(self) -> pika.ConnectionParameters:
+        return pika.ConnectionParameters(
+            host=self.host,
+            port=self.port,
+            credentials=pika.PlainCredentials(
+                username=self.username,
+                password=self.passwd,
+            ),
+        )
+
+    def queue_depth(self) -> tuple[int, int]:
+        """Read the depth of the queue.
+
+        The queue is declared passively, the broker reports the messages ready for delivery (not the messages the
+        workers are processing) and the number of consumers.
+
+        Returns:
+            tuple[int, int]: The number of messages ready in the queue and the number of its consumers.
+        """
+        connection = pika.BlockingConnection(self._parameters())
+        try:
+            frame = connection.channel().queue_declare(queue=self.queue_name, durable=True, passive=True)
+        finally:
+            connection.close()
+        return frame.method.message_count, frame.method.consumer_count
+
     def publish_message(self, message: str) -> None:
         """Publishes a JSON message (string) to the given RabbitMQ queue.
 
@@ -41,6 +72,10 @@ class BlockingQueueConnection:
         * publishes the message with delivery confirmation,
         * closes the connection.
 
+        The message is stamped with the publish time, so the consumer can measure the time the job spent in the queue,
+        and carries the traceparent header, so the consumer can continue the trace of the submission.
+        The time spent on publishing is observed by the queue publish latency histogram.
+
         In the case of failure to route the message, an HTTPException with status code 400 is raised.
 
         Args:
@@ -49,29 +84,28 @@ class BlockingQueueConnection:
         Raises:
             HTTPException: If the message could not be routed to the queue.
         """
-        try:
-            connection = pika.BlockingConnection(
-                pika.ConnectionParameters(
-                    host=self.host,
-                    port=self.port,
-                    credentials=pika.PlainCredentials(
-                        username=self.username,
-                        password=self.passwd,
+        start = perf_counter()
+        with tracer.start_span("queue.publish", queue=self.queue_name) as span:
+            try:
+                connection = pika.BlockingConnection(self._parameters())
+                channel = connection.channel()
+                channel.queue_declare(queue=self.queue_name, durable=True)
+
+                channel.confirm_delivery()
+                channel.basic_publish(
+                    exchange="",
+                    routing_key=self.queue_name,
+                    body=message.encode("utf-8"),  # ensure bytes
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,  # persist message
+                        timestamp=int(time()),
+                        headers={TRACEPARENT_HEADER: span.traceparent},
                     ),
                 )
-            )
-            channel = connection.channel()
-            channel.queue_declare(queue=self.queue_name, durable=True)
-
-            channel.confirm_delivery()
-            channel.basic_publish(
-                exchange="",
-                routing_key=self.queue_name,
-                body=message.encode("utf-8"),  # ensure bytes
-                properties=pika.BasicProperties(delivery_mode=2),  # persist message
-            )
-        except UnroutableError:
-            raise HTTPException(status_code=400, detail="Failed to upload task to the queue")
+            except UnroutableError:
+                raise HTTPException(status_code=400, detail="Failed to upload task to the queue")
+            finally:
+                QUEUE_PUBLISH_LATENCY.observe(perf_counter() - start)
 
         if connection and connection.is_open:
             connection.close()
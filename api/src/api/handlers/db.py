@@ -1,13 +1,32 @@
 """Database handlers."""
 
+from datetime import datetime
 from urllib.parse import urljoin
 
 from fastapi import HTTPException
 from httpx import AsyncClient, Response
 from loguru import logger
 
-from api.models.db import MetadataDbGetRequest, MetaDataDbGetResponse, MetadataDbPostRequest, MetaDataDbPostResponse
+from api.metrics import (
+    METADB_CANCEL_LATENCY,
+    METADB_CREATE_OR_GET_LATENCY,
+    METADB_EXPIRE_LATENCY,
+    METADB_GET_LATENCY,
+    METADB_LIST_LATENCY,
+    METADB_POST_LATENCY,
+    METADB_REQUEUE_LATENCY,
+)
+from api.models.db import (
+    JobListRequest,
+    JobListResponse,
+    MetadataDbGetRequest,
+    MetaDataDbGetResponse,
+    MetadataDbPatchRequest,
+    MetadataDbPostRequest,
+    MetaDataDbPostResponse,
+)
 from api.status import TaskStatus
+from api.tracing import tracer
 
 
 class MetaDataDb:
@@ -23,6 +42,7 @@ class MetaDataDb:
         self.client = client
         self.post_job_url = urljoin(endpoint, "job/")
         self.get_job_status_url = urljoin(endpoint, "job")
+        self.list_jobs_url = urljoin(endpoint, "jobs")
 
     async def post_job(self, data: MetadataDbPostRequest) -> MetaDataDbPostResponse:
         """Post job to the metadata database.
@@ -41,15 +61,125 @@ class MetaDataDb:
             HTTPException: If there is an unexpected error while posting the job (500).
 
         """
-        logger.info(f"Data model dump {data.model_dump()}")
+        logger.info("Data model dump {}", data)
         headers = {"Content-Type": "application/json", "Accept": "application/json"}
-        resp = await self.client.post(url=self.post_job_url, json=data.model_dump(), headers=headers)
+        with METADB_POST_LATENCY.time(), tracer.start_span("metadb.post_job", job_id=data.job_id):
+            resp = await self.client.post(url=self.post_job_url, json=data.model_dump(), headers=headers)
         match resp.status_code:
             case 200:
                 return MetaDataDbPostResponse(job_id=data.job_id, status=TaskStatus.QUEUED)
             case _:
                 raise HTTPException(status_code=500, detail=f"Unexpected error while posting job {data.job_id}.")
 
+    async def create_or_get_job(self, data: MetadataDbPostRequest) -> tuple[MetaDataDbGetResponse, bool]:
+        """Create the job in the metadata database if it does not exist yet, in a single atomic request.
+
+        The expected status codes are:
+           - 201 when the job was created (QUEUED response)
+           - 200 when the job already existed (stored job response)
+           - any other status code will trigger FAILURE response
+
+        Args:
+            data (MetadataDbPostRequest): The job submission data.
+
+        Returns:
+            tuple[MetaDataDbGetResponse, bool]: The stored job and True if this request created it.
+
+        Raises:
+            HTTPException: If there is an unexpected error while creating the job (500).
+        """
+        headers = {"Accept": "application/json"}
+        job_url = f"{self.get_job_status_url}/{data.job_id}"
+        with METADB_CREATE_OR_GET_LATENCY.time(), tracer.start_span("metadb.create_or_get_job", job_id=data.job_id):
+            resp = await self.client.put(url=job_url, headers=headers)
+        match resp.status_code:
+            case 201 | 200:
+                return MetaDataDbGetResponse(**resp.json()), resp.status_code == 201
+            case _:
+                raise HTTPException(status_code=500, detail=f"Unexpected error while creating job {data.job_id}.")
+
+    async def expire_job(self, job_id: str) -> None:
+        """Mark the job EXPIRED, so the next submission of the job publishes it again.
+
+        Used when the job was created but could not be published to the message queue.
+
+        Args:
+            job_id (str): The job id.
+
+        Raises:
+            HTTPException: If there is an unexpected error while updating the job (500).
+        """
+        data = MetadataDbPatchRequest(status=TaskStatus.EXPIRED)
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        job_url = f"{self.get_job_status_url}/{job_id}"
+        with METADB_EXPIRE_LATENCY.time(), tracer.start_span("metadb.expire_job", job_id=job_id):
+            resp = await self.client.patch(
+                url=job_url, json=data.model_dump(mode="json", exclude_unset=True), headers=headers
+            )
+        if resp.status_code != 200:
+            raise HTTPException(status_code=500, detail=f"Unexpected error while expiring job {job_id}.")
+
+    async def cancel_job(self, job_id: str) -> MetaDataDbPostResponse:
+        """Mark the job CANCELLED, the worker skips it on delivery or stops searching it.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            MetaDataDbPostResponse: The job with its new status.
+
+        Raises:
+            HTTPException: If the job is not found (404), is done already (409) or if there is an unexpected error
+                while updating it (500).
+        """
+        data = MetadataDbPatchRequest(status=TaskStatus.CANCELLED)
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        job_url = f"{self.get_job_status_url}/{job_id}"
+        with METADB_CANCEL_LATENCY.time(), tracer.start_span("metadb.cancel_job", job_id=job_id):
+            resp = await self.client.patch(
+                url=job_url, json=data.model_dump(mode="json", exclude_unset=True), headers=headers
+            )
+        match resp.status_code:
+            case 200:
+                return MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.CANCELLED)
+            case 404:
+                raise HTTPException(status_code=404, detail=f"Failed to fetch {job_id} from database.")
+            case 409:
+                # the job finished or failed meanwhile, the metadata db refuses the transition
+                status = resp.json()["detail"]["status"]
+                raise HTTPException(
+                    status_code=409, detail=f"Job {job_id} is {status}, only queued and running jobs can be cancelled."
+                )
+            case _:
+                raise HTTPException(status_code=500, detail=f"Unexpected error while cancelling job {job_id}.")
+
+    async def requeue_job(self, job_id: str) -> MetaDataDbPostResponse:
+        """Put an existing job back to the QUEUED state.
+
+        Used when the job is submitted again after its results were evicted from the results volume, or after
+        it was cancelled.
+        The submission time is reset, the completion time and the result summary are cleared.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            MetaDataDbPostResponse: The job submission response.
+
+        Raises:
+            HTTPException: If there is an unexpected error while updating the job (500).
+        """
+        data = MetadataDbPatchRequest(status=TaskStatus.QUEUED, submitted_at=datetime.now())
+        headers = {"Content-Type": "application/json", "Accept": "application/json"}
+        job_url = f"{self.get_job_status_url}/{job_id}"
+        with METADB_REQUEUE_LATENCY.time(), tracer.start_span("metadb.requeue_job", job_id=job_id):
+            resp = await self.client.patch(url=job_url, json=data.model_dump(mode="json"), headers=headers)
+        match resp.status_code:
+            case 200:
+                return MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.QUEUED)
+            case _:
+                raise HTTPException(status_code=500, detail=f"Unexpected error while requeuing job {job_id}.")
+
     async def get_job_response(self, data: MetadataDbGetRequest) -> Response:
         """Intermediate step reused to run the get request to the metadata db.
 
@@ -63,10 +193,11 @@ class MetaDataDb:
         Returns:
             Response: httpx response object
         """
-        logger.info(f"Fetching job {data.job_id} from database.")
+        logger.info("Fetching job {} from database.", data.job_id)
         job_url = f"{self.get_job_status_url}/{data.job_id}"
-        logger.info(f"Fetching job {job_url} from database.")
-        return await self.client.get(url=job_url)
+        logger.info("Fetching job {} from database.", job_url)
+        with METADB_GET_LATENCY.time(), tracer.start_span("metadb.get_job", job_id=data.job_id):
+            return await self.client.get(url=job_url)
 
     async def get_job(self, data: MetadataDbGetRequest) -> MetaDataDbGetResponse:
         """Get the job status from the metadata database.
@@ -94,3 +225,26 @@ class MetaDataDb:
                 raise HTTPException(
                     status_code=500, detail=f"Unexpected error while fetching job status for {data.job_id}."
                 )
+
+    async def list_jobs(self, data: JobListRequest) -> JobListResponse:
+        """List the jobs of the metadata database, newest first.
+
+        Args:
+            data (JobListRequest): The filters and the page of the listing.
+
+        Returns:
+            JobListResponse: The jobs of the page and the cursor of the next page.
+
+        Raises:
+            HTTPException: If the cursor is invalid (422) or if there is an unexpected error (500).
+        """
+        params = data.model_dump(mode="json", exclude_none=True)
+        with METADB_LIST_LATENCY.time(), tracer.start_span("metadb.list_jobs"):
+            resp = await self.client.get(url=self.list_jobs_url, params=params)
+        match resp.status_code:
+            case 200:
+                return JobListResponse(**resp.json())
+            case 422:
+                raise HTTPException(status_code=422, detail="Invalid job listing cursor.")
+            case _:
+                raise HTTPException(status_code=500, detail="Unexpected error while listing jobs.")
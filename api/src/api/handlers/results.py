@@ -0,0 +1,317 @@
+"""Handlers for the result files on the results volume."""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from pathlib import Path
+
+from loguru import logger
+
+GZIP_SUFFIX = ".m8.gz"
+PLAIN_SUFFIX = ".m8"
+# the worker keeps the query and alignment DBs of the searched jobs there
+ALIGNMENT_DIR_NAME = "alignments"
+# version of the target database new jobs are searched against, published by the worker
+DB_VERSION_FILE_NAME = ".db_version"
+# version of the target database a job was searched against, kept with its alignment DB
+JOB_DB_VERSION_FILE_NAME = "db_version"
+# hits of the steps searched so far of the running jobs, with their progress
+PARTIAL_DIR_NAME = ".partial"
+PARTIAL_HITS_FILE_NAME = "hits.m8"
+PARTIAL_PROGRESS_FILE_NAME = "progress.json"
+# alignments of the query/target pairs rendered by the worker on request, one file per pair
+PAIR_ALIGNMENT_DIR_NAME = ".pair_alignments"
+# markers of the tasks published to the worker and not done yet, one directory per job
+PENDING_DIR_NAME = ".pending"
+# completeness marker of the served results, the partial results of a running job also tell the progress
+RESULT_COMPLETE_HEADER = "X-Result-Complete"
+QUERIES_DONE_HEADER = "X-Queries-Done"
+QUERIES_TOTAL_HEADER = "X-Queries-Total"
+
+
+def accepts_encoding(accept_encoding: str | None, encoding: str) -> bool:
+    """Check if the client accepts the content encoding.
+
+    Args:
+        accept_encoding (str | None): The value of the Accept-Encoding request header.
+        encoding (str): The content encoding, e.g. gzip.
+
+    Returns:
+        bool: True if the encoding (or the ``*`` wildcard) is listed without a zero quality value.
+
+    Examples:
+        >>> accepts_encoding("gzip, deflate, br", "gzip")
+        True
+        >>> accepts_encoding("deflate, gzip;q=0", "gzip")
+        False
+        >>> accepts_encoding("*", "gzip")
+        True
+        >>> accepts_encoding(None, "gzip")
+        False
+    """
+    for item in (accept_encoding or "").split(","):
+        name, _, params = item.partition(";")
+        if name.strip().lower() not in (encoding, "*"):
+            continue
+        quality = params.strip().removeprefix("q=")
+        try:
+            return not params.strip() or float(quality) > 0
+        except ValueError:
+            return True
+    return False
+
+
+def pair_id(query: str, target: str) -> str:
+    """Identifier of a query/target pair, the name of its cached alignment.
+
+    Args:
+        query (str): The query id.
+        target (str): The target id.
+
+    Returns:
+        str: The first 16 characters of the MD5 hash of the tab separated pair, as computed by the worker.
+
+    Examples:
+        >>> pair_id("q1", "sp|P12345|AATM_RABIT")
+        'e868414cfe8f4622'
+    """
+    return hashlib.md5(f"{query}\t{target}".encode()).hexdigest()[:16]
+
+
+@dataclass(frozen=True)
+class PartialResult:
+    """Hits of the queries searched so far of a running job.
+
+    Attributes:
+        path (Path): The hits file, appended to by the worker.
+        size (int): Number of bytes of the hits of the queries done, the rest of the file may be incomplete.
+        queries_done (int): Number of queries searched.
+        queries_total (int): Number of queries of the job.
+    """
+
+    path: Path
+    size: int
+    queries_done: int
+    queries_total: int
+
+
+class ResultStore:
+    """Result files written by the worker to the results volume.
+
+    The worker writes the results gzip compressed (``{job_id}.m8.gz``), the plain ``{job_id}.m8``
+    files written before the compression was introduced are still served. The results in other
+    output formats are written next to them as ``{job_id}.{format_id}.m8.gz``.
+    """
+
+    def __init__(self, path: Path, chunk_size: int = 64 * 1024, pending_ttl_seconds: float = 300.0) -> None:
+        """Initialize the result store.
+
+        Args:
+            path (Path): The directory the worker writes the results to.
+            chunk_size (int): Size of the chunks the decompressed results are streamed in.
+            pending_ttl_seconds (float): Seconds a task published to the worker is pending, it is published
+                again after that (the worker failed it or the message was lost).
+        """
+        self.path = path
+        self.chunk_size = chunk_size
+        self.pending_ttl_seconds = pending_ttl_seconds
+
+    def find(self, job_id: str, format_id: str | None = None) -> Path | None:
+        """Find the result file of the job.
+
+        Args:
+            job_id (str): The job id.
+            format_id (str | None): The output format id, None for the search result.
+
+        Returns:
+            Path | None: The result file, None if the job has no result on the volume.
+        """
+        stem = job_id if format_id is None else f"{job_id}.{format_id}"
+        for suffix in (GZIP_SUFFIX, PLAIN_SUFFIX):
+            path = self.path / f"{stem}{suffix}"
+            if path.is_file():
+                return path
+        return None
+
+    def find_partial(self, job_id: str) -> PartialResult | None:
+        """Find the partial result of a running job searched in steps.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            PartialResult | None: The hits of the steps done, None if the job publishes no partial result.
+        """
+        partial_dir = self.path / PARTIAL_DIR_NAME / job_id
+        try:
+            progress = json.loads((partial_dir / PARTIAL_PROGRESS_FILE_NAME).read_text())
+        except (OSError, ValueError):
+            return None
+        return PartialResult(
+            path=partial_dir / PARTIAL_HITS_FILE_NAME,
+            size=progress["bytes"],
+            queries_done=progress["queries_done"],
+            queries_total=progress["queries_total"],
+        )
+
+    def find_pair_alignment(self, job_id: str, query: str, target: str) -> dict | None:
+        """Find the cached alignment of a query/target pair of the job.
+
+        Args:
+            job_id (str): The job id.
+            query (str): The query id.
+            target (str): The target id.
+
+        Returns:
+            dict | None: The alignment (``found`` is false when the target is not a hit of the query),
+                None if the worker has not aligned the pair yet.
+        """
+        try:
+            return json.loads(
+                (self.path / PAIR_ALIGNMENT_DIR_NAME / job_id / f"{pair_id(query, target)}.json").read_text()
+            )
+        except (OSError, ValueError):
+            return None
+
+    def mark_pending(self, job_id: str, task: str) -> bool:
+        """Mark a task of the job as published to the worker, unless it is pending already.
+
+        The marker is a file on the results volume, created exclusively: of the concurrent requests (of all
+        the api replicas) only one publishes the task.
+
+        Args:
+            job_id (str): The job id.
+            task (str): The task id, e.g. the output format id or the pair id.
+
+        Returns:
+            bool: True if the caller publishes the task, False while it is pending within the TTL.
+        """
+        path = self.path / PENDING_DIR_NAME / job_id / task
+        path.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            pass
+        try:
+            if time.time() - path.stat().st_mtime < self.pending_ttl_seconds:
+                return False
+        except FileNotFoundError:
+            # the task was cleared in the meantime
+            return self.mark_pending(job_id, task)
+        os.utime(path)
+        logger.warning(
+            "Task {} of job {} pending for over {}s, publishing it again.", task, job_id, self.pending_ttl_seconds
+        )
+        return True
+
+    def clear_pending(self, job_id: str, task: str) -> None:
+        """Remove the pending marker of a task of the job, done or failed to publish.
+
+        Args:
+            job_id (str): The job id.
+            task (str): The task id.
+        """
+        (self.path / PENDING_DIR_NAME / job_id / task).unlink(missing_ok=True)
+
+    def has_alignment(self, job_id: str) -> bool:
+        """Check if the alignment DB of the job is still kept by the worker.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            bool: True if other output formats can be generated for the job.
+        """
+        return (self.path / ALIGNMENT_DIR_NAME / job_id).is_dir()
+
+    def db_version(self) -> str | None:
+        """Read the version of the target database the workers search new jobs against.
+
+        Returns:
+            str | None: The version, None when the target database is not versioned.
+        """
+        try:
+            return (self.path / DB_VERSION_FILE_NAME).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def job_db_version(self, job_id: str) -> str | None:
+        """Read the version of the target database the job was searched against.
+
+        Args:
+            job_id (str): The job id.
+
+        Returns:
+            str | None: The version, None once the alignment DB of the job expired or for the jobs without a version.
+        """
+        try:
+            return (self.path / ALIGNMENT_DIR_NAME / job_id / JOB_DB_VERSION_FILE_NAME).read_text().strip() or None
+        except FileNotFoundError:
+            return None
+
+    @staticmethod
+    def is_compressed(path: Path) -> bool:
+        """Check if the result file is gzip compressed.
+
+        Args:
+            path (Path): The result file.
+
+        Returns:
+            bool: True for the gzip compressed results.
+        """
+        return path.name.endswith(GZIP_SUFFIX)
+
+    @staticmethod
+    def touch(path: Path) -> None:
+        """Set the access time of the result file to now, keeping its modification time.
+
+        The worker evicts the least recently used results first, the volume may be mounted with noatime.
+
+        Args:
+            path (Path): The result file.
+        """
+        try:
+            os.utime(path, (time.time(), path.stat().st_mtime))
+        except OSError as e:
+            logger.warning("Failed to record access time of {}: {}", path, e)
+
+    def iter_decompressed(self, path: Path) -> Iterator[bytes]:
+        """Stream the decompressed content of the result file.
+
+        Args:
+            path (Path): The gzip compressed result file.
+
+        Yields:
+            bytes: The next chunk of the decompressed content.
+        """
+        with gzip.open(path, "rb") as f:
+            while chunk := f.read(self.chunk_size):
+                yield chunk
+
+    def iter_partial(self, partial: PartialResult) -> Iterator[bytes]:
+        """Stream the hits of the queries done of a partial result.
+
+        The file is opened right away, the worker removing it once the job finishes does not cut the stream.
+        FileNotFoundError is raised by the call (not the iteration) when the worker removed it already.
+
+        Args:
+            partial (PartialResult): The partial result.
+
+        Returns:
+            Iterator[bytes]: The chunks of the hits.
+        """
+        f = partial.path.open("rb")
+
+        def chunks() -> Iterator[bytes]:
+            with f:
+                remaining = partial.size
+                while remaining > 0 and (chunk := f.read(min(self.chunk_size, remaining))):
+                    remaining -= len(chunk)
+                    yield chunk
+
+        return chunks()
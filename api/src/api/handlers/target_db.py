@@ -0,0 +1,248 @@
+"""Handlers for the sequences of the MMseqs2 target database.
+
+An MMseqs2 database is a data file of null terminated entries and an ``.index`` file of
+``key, offset, length`` lines, the headers are stored the same way in ``<db>_h``, the accessions
+of the keys in ``<db>.lookup``. The data files are memory-mapped, the lookup from the accession to
+the entries goes through an accession index: fixed-width records sorted by accession, built once
+from the ``.lookup`` and ``.index`` files next to the database and memory-mapped too. A lookup is
+a binary search over the mapped records, the memory of the api does not grow with the database.
+
+The jobs are searched against versions of the target database (see the worker's ``db_registry.py``),
+the hit sequences of a job are read from the version it was searched against: the versions are laid
+out as the worker prepares them, ``<root>/<version>/<name>`` with a ``READY`` marker once complete.
+"""
+
+import bisect
+import mmap
+import os
+import struct
+import threading
+from collections import OrderedDict
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+
+from loguru import logger
+
+ACCESSION_INDEX_SUFFIX = ".accessions"
+ACCESSION_INDEX_MAGIC = b"MMACC001"
+# magic, accession width, number of records
+HEADER = struct.Struct("<8sIQ")
+# sequence offset and length, header offset and length, after the padded accession
+ENTRY = struct.Struct("<QIQI")
+# marker of a version directory whose database is complete
+READY_MARKER = "READY"
+
+
+def read_index(path: Path) -> dict[int, tuple[int, int]]:
+    """Read an MMseqs2 ``.index`` file.
+
+    Args:
+        path (Path): The index file.
+
+    Returns:
+        dict[int, tuple[int, int]]: The offset and length of the entry of each key.
+    """
+    entries = {}
+    with path.open() as f:
+        for line in f:
+            key, offset, length = line.split("\t")
+            entries[int(key)] = (int(offset), int(length))
+    return entries
+
+
+def build_accession_index(db_path: Path, index_path: Path) -> int:
+    """Write the accession index of the database, replacing the previous one atomically.
+
+    Args:
+        db_path (Path): The MMseqs2 database, without suffix.
+        index_path (Path): The accession index to write.
+
+    Returns:
+        int: The number of accessions indexed.
+    """
+    sequences = read_index(db_path.with_name(f"{db_path.name}.index"))
+    headers = read_index(db_path.with_name(f"{db_path.name}_h.index"))
+    accessions = []
+    with db_path.with_name(f"{db_path.name}.lookup").open() as f:
+        for line in f:
+            key_field, accession, *_ = line.rstrip("\n").split("\t")
+            key = int(key_field)
+            if key in sequences and key in headers:
+                accessions.append((accession.encode(), *sequences[key], *headers[key]))
+    accessions.sort()
+    width = max((len(entry[0]) for entry in accessions), default=1)
+    partial = index_path.with_name(f"{index_path.name}.{os.getpid()}.partial")
+    with partial.open("wb") as f:
+        f.write(HEADER.pack(ACCESSION_INDEX_MAGIC, width, len(accessions)))
+        for padded, *entry in accessions:
+            f.write(padded.ljust(width, b"\0") + ENTRY.pack(*entry))
+    partial.replace(index_path)
+    return len(accessions)
+
+
+def map_file(path: Path) -> mmap.mmap:
+    """Memory-map the file read-only.
+
+    Args:
+        path (Path): The file.
+
+    Returns:
+        mmap.mmap: The mapping, empty files cannot be mapped and get an anonymous empty mapping.
+    """
+    with path.open("rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return mmap.mmap(-1, 1)
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class _Accessions:
+    """Padded accessions of the mapped accession index, as a sequence for bisect."""
+
+    def __init__(self, index: mmap.mmap, width: int, count: int) -> None:
+        self.index = index
+        self.width = width
+        self.count = count
+        self.record_size = width + ENTRY.size
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = HEADER.size + i * self.record_size
+        return self.index[start : start + self.width]
+
+
+class TargetDb:
+    """Sequences and headers of the target database the workers search against."""
+
+    def __init__(self, path: Path, index_dir: Path | None = None) -> None:
+        """Map the database files, building the accession index if it is missing or older than the database.
+
+        Args:
+            path (Path): The MMseqs2 database, without suffix (e.g. ``/app/mmseqs_db/swissprot``).
+            index_dir (Path | None): Directory of the accession index, next to the database when None.
+
+        Raises:
+            ValueError: If the accession index file is not an accession index.
+        """
+        self.path = path
+        index_path = (index_dir or path.parent) / f"{path.name}{ACCESSION_INDEX_SUFFIX}"
+        lookup_path = path.with_name(f"{path.name}.lookup")
+        if not index_path.exists() or index_path.stat().st_mtime < lookup_path.stat().st_mtime:
+            logger.info("Building the accession index of {} in {}", path, index_path)
+            count = build_accession_index(path, index_path)
+            logger.info("Indexed {} accessions of {}", count, path)
+        self.sequences = map_file(path)
+        self.headers = map_file(path.with_name(f"{path.name}_h"))
+        self.index = map_file(index_path)
+        magic, width, count = HEADER.unpack_from(self.index)
+        if magic != ACCESSION_INDEX_MAGIC:
+            raise ValueError(f"{index_path} is not an accession index")
+        self.accessions = _Accessions(self.index, width, count)
+
+    def _find(self, accession: str) -> tuple[int, int, int, int] | None:
+        key = accession.encode()
+        if len(key) > self.accessions.width:
+            return None
+        key = key.ljust(self.accessions.width, b"\0")
+        i = bisect.bisect_left(self.accessions, key)
+        if i == len(self.accessions) or self.accessions[i] != key:
+            return None
+        return ENTRY.unpack_from(self.index, HEADER.size + i * self.accessions.record_size + self.accessions.width)
+
+    def get(self, target: str) -> tuple[str, str] | None:
+        """Get the header and the sequence of a target.
+
+        Args:
+            target (str): The accession of the target, or its ``db|accession|name`` id as in the results.
+
+        Returns:
+            tuple[str, str] | None: The header and the sequence, None if the target is not in the database.
+        """
+        for accession in self.accession_candidates(target):
+            entry = self._find(accession)
+            if entry is not None:
+                sequence_offset, sequence_length, header_offset, header_length = entry
+                sequence = self.sequences[sequence_offset : sequence_offset + sequence_length]
+                header = self.headers[header_offset : header_offset + header_length]
+                return header.rstrip(b"\n\0").decode(), sequence.rstrip(b"\n\0").decode()
+        return None
+
+    @staticmethod
+    def accession_candidates(target: str) -> list[str]:
+        """List the accessions a target id may be indexed under.
+
+        Args:
+            target (str): The target id.
+
+        Returns:
+            list[str]: The id itself, then the accession of a UniProt style ``db|accession|name`` id.
+
+        Examples:
+            >>> TargetDb.accession_candidates("sp|P12345|AATM_RABIT")
+            ['sp|P12345|AATM_RABIT', 'P12345']
+            >>> TargetDb.accession_candidates("P12345")
+            ['P12345']
+        """
+        parts = target.split("|")
+        return [target, parts[1]] if len(parts) == 3 else [target]
+
+    def iter_fasta(self, targets: Iterable[str]) -> Iterator[str]:
+        """Yield the FASTA records of the targets found in the database, in the given order.
+
+        Args:
+            targets (Iterable[str]): The target ids.
+
+        Yields:
+            str: The FASTA record of the next target found.
+        """
+        for target in targets:
+            entry = self.get(target)
+            if entry is not None:
+                header, sequence = entry
+                yield f">{header}\n{sequence}\n"
+
+
+class TargetDbVersions:
+    """Target databases of the versions the jobs are searched against, mapped on first use."""
+
+    def __init__(self, root: Path | None, name: str, default: TargetDb | None = None, max_open: int = 2) -> None:
+        """Set the directory of the versions.
+
+        Args:
+            root (Path | None): Directory of the versions, None when the target database is not versioned.
+            name (str): Name of the MMseqs2 database in a version directory (e.g. ``swissprot``).
+            default (TargetDb | None): The database of the jobs without a version.
+            max_open (int): Versions kept mapped, the least recently used one is unmapped first.
+        """
+        self.root = root
+        self.name = name
+        self.default = default
+        self.max_open = max_open
+        self._open: OrderedDict[str, TargetDb] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, version: str | None) -> TargetDb | None:
+        """Get the target database of a version, mapping it (and building its accession index) on first use.
+
+        Args:
+            version (str | None): The version, None for the jobs without a version.
+
+        Returns:
+            TargetDb | None: The database, None if the version is not prepared in the directory of the versions.
+        """
+        if version is None or self.root is None:
+            return self.default
+        with self._lock:
+            db = self._open.get(version)
+            if db is not None:
+                self._open.move_to_end(version)
+                return db
+            directory = self.root / version
+            if not (directory / READY_MARKER).exists():
+                return None
+            db = self._open[version] = TargetDb(directory / self.name)
+            # a request still reading the unmapped version keeps its mapping until it is done
+            while len(self._open) > self.max_open:
+                self._open.popitem(last=False)
+            return db
@@ -0,0 +1,193 @@
+"""Logging of the api, cheap on the request path.
+
+The records are written by a background thread: the sink only puts the formatted message in a
+bounded queue, a full queue drops the message (counted in ``api_log_records_dropped``) instead of
+blocking the event loop on stdout. Repetitive ``INFO`` messages are sampled per call site, a
+burst is logged per window and the next one logged carries the number suppressed. Payloads (the
+submitted FASTA, request models) are logged through ``Payload``, summarized and truncated, and
+only formatted when the record is emitted.
+"""
+
+import atexit
+import queue
+import sys
+import threading
+import time
+from collections.abc import Callable, Mapping
+from typing import TYPE_CHECKING, Any, TextIO
+
+from loguru import logger
+
+from api.metrics import LOG_RECORDS_DROPPED
+
+if TYPE_CHECKING:
+    from loguru import Record
+
+FORMAT = "{time:YYYY-MM-DD HH:mm:ss.SSS} | {level: <8} | {name}:{function}:{line} - {message}"
+# characters of a value logged with truncate
+MAX_LENGTH = 200
+INFO = 20
+
+
+def truncate(value: Any, limit: int = MAX_LENGTH) -> str:
+    """Cut the text of a value to the limit.
+
+    Args:
+        value (Any): The value logged.
+        limit (int): The characters kept.
+
+    Returns:
+        str: The text of the value, with the number of characters cut if it was longer.
+
+    Examples:
+        >>> truncate("MKTAYIAKQR", 4)
+        'MKTA...(6 more characters)'
+    """
+    text = str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...({len(text) - limit} more characters)"
+
+
+class Payload:
+    """Payload as logged, formatted only when the record is emitted.
+
+    The FASTA is summarized as its number of queries and bytes, the other fields are truncated.
+    """
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload: Mapping[str, Any]) -> None:
+        self.payload = payload
+
+    def __str__(self) -> str:
+        fields = []
+        for key, value in self.payload.items():
+            if key == "fasta" and isinstance(value, str):
+                fields.append(f"fasta=<{value.count('>')} queries, {len(value.encode())} bytes>")
+            else:
+                fields.append(f"{key}={truncate(value)}")
+        return "{" + ", ".join(fields) + "}"
+
+
+class SamplingFilter:
+    """Log a burst of the records of each call site per interval, the records above ``INFO`` always pass."""
+
+    def __init__(self, burst: int = 20, interval: float = 10.0, clock: Callable[[], float] = time.monotonic) -> None:
+        """Sample the records of the call sites.
+
+        Args:
+            burst (int): Records of a call site logged per interval.
+            interval (float): Seconds of a sampling window, 0 to log everything.
+            clock (Callable[[], float]): Monotonic clock, in seconds.
+        """
+        self.burst = burst
+        self.interval = interval
+        self.clock = clock
+        # (file, line) -> [window start, records logged, records suppressed]
+        self._windows: dict[tuple[str, int], list[Any]] = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record: "Record") -> bool:
+        """Check if the record is logged.
+
+        Args:
+            record (Record): The loguru record, its message gets the number of records suppressed.
+
+        Returns:
+            bool: True if the record is logged.
+        """
+        if not self.interval or record["level"].no > INFO:
+            return True
+        # the call site, not the message: the same message with other arguments is the same message
+        key = (record["file"].path, record["line"])
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record["message"] = f"{record['message']} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class QueueSink:
+    """Loguru sink handing the messages to a writer thread through a bounded queue."""
+
+    def __init__(self, stream: TextIO, maxsize: int = 10000) -> None:
+        """Start the writer thread.
+
+        Args:
+            stream (TextIO): The stream the messages are written to.
+            maxsize (int): Messages waiting for the writer thread, the next ones are dropped.
+        """
+        self.stream = stream
+        self.queue: queue.Queue[str | None] = queue.Queue(maxsize)
+        self.dropped = 0
+        self._writer = threading.Thread(target=self._write, name="log-writer", daemon=True)
+        self._writer.start()
+
+    def __call__(self, message: str) -> None:
+        """Queue the message, dropping it if the queue is full.
+
+        Args:
+            message (str): The formatted message.
+        """
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def _write(self) -> None:
+        while (message := self.queue.get()) is not None:
+            self.stream.write(message)
+            if self.queue.empty():
+                self.stream.flush()
+
+    def stop(self) -> None:
+        """Write the queued messages and stop the writer thread."""
+        self.queue.put(None)
+        self._writer.join()
+
+
+def configure_logging(
+    level: str = "INFO",
+    queue_size: int = 10000,
+    sample_burst: int = 20,
+    sample_seconds: float = 10.0,
+    stream: TextIO | None = None,
+) -> QueueSink | None:
+    """Replace the loguru sinks with the sampled, non-blocking sink.
+
+    Args:
+        level (str): The minimum level logged.
+        queue_size (int): Messages waiting for the writer thread, 0 to write them on the logging thread.
+        sample_burst (int): Records of a call site logged per sampling window.
+        sample_seconds (float): Seconds of a sampling window, 0 to log everything.
+        stream (TextIO | None): The stream the messages are written to, stderr by default.
+
+    Returns:
+        QueueSink | None: The sink of the writer thread, None when the queue is off.
+    """
+    stream = stream or sys.stderr
+    sink = QueueSink(stream, queue_size) if queue_size > 0 else None
+    logger.remove()
+    logger.add(
+        sink or stream,
+        level=level,
+        format=FORMAT,
+        filter=SamplingFilter(sample_burst, sample_seconds),
+        colorize=False,
+    )
+    if sink is not None:
+        # the messages still queued are written on exit
+        atexit.register(sink.stop)
+    return sink
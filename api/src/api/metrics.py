@@ -0,0 +1,81 @@
+"""Prometheus metrics exposed by the api.
+
+The metric objects are created once at import time and registered in the default
+prometheus registry, so the hot path only pays for a ``perf_counter`` call and a
+bucket increment. Label children are bound up-front for the same reason.
+"""
+
+from time import perf_counter
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+REQUEST_LATENCY = Histogram(
+    "api_request_latency_seconds",
+    "Latency of the api endpoints.",
+    labelnames=["endpoint"],
+)
+
+QUEUE_PUBLISH_LATENCY = Histogram(
+    "api_queue_publish_latency_seconds",
+    "Latency of publishing a job to the message queue.",
+)
+
+METADB_REQUEST_LATENCY = Histogram(
+    "api_metadb_request_latency_seconds",
+    "Latency of the requests sent to the metadata database.",
+    labelnames=["operation"],
+)
+METADB_GET_LATENCY = METADB_REQUEST_LATENCY.labels(operation="get_job")
+METADB_POST_LATENCY = METADB_REQUEST_LATENCY.labels(operation="post_job")
+METADB_REQUEUE_LATENCY = METADB_REQUEST_LATENCY.labels(operation="requeue_job")
+METADB_CREATE_OR_GET_LATENCY = METADB_REQUEST_LATENCY.labels(operation="create_or_get_job")
+METADB_EXPIRE_LATENCY = METADB_REQUEST_LATENCY.labels(operation="expire_job")
+METADB_CANCEL_LATENCY = METADB_REQUEST_LATENCY.labels(operation="cancel_job")
+METADB_LIST_LATENCY = METADB_REQUEST_LATENCY.labels(operation="list_jobs")
+
+QUEUE_DEPTH = Gauge("api_queue_depth", "Messages ready in the job queue, as last read by the admission control.")
+ADMISSION_REJECTED = Counter(
+    "api_admission_rejected",
+    "Number of submissions rejected with 429 by the admission control, by the limit they exceeded.",
+    labelnames=["limit"],
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    "api_log_records_dropped",
+    "Number of log records dropped as the queue of the log writer was full.",
+)
+
+
+class RequestLatencyMiddleware:
+    """Pure ASGI middleware observing the latency of the instrumented endpoints.
+
+    The endpoint is resolved from the route that FastAPI stores in the request scope,
+    requests to any other route (docs, metrics, 404s) are not observed.
+    """
+
+    endpoints = ("submit", "status", "results")
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.histograms = {endpoint: REQUEST_LATENCY.labels(endpoint=endpoint) for endpoint in self.endpoints}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Run the wrapped application and observe the request latency.
+
+        Args:
+            scope (Scope): The ASGI connection scope.
+            receive (Receive): The ASGI receive channel.
+            send (Send): The ASGI send channel.
+        """
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            histogram = self.histograms.get(getattr(route, "name", ""))
+            if histogram is not None:
+                histogram.observe(perf_counter() - start)
@@ -2,10 +2,13 @@
 
 from datetime import datetime
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 from api.status import TaskStatus
 
+# jobs of a page of the job listing, the metadata db allows as many
+MAX_PAGE_SIZE = 1000
+
 
 class MetadataDbGetRequest(BaseModel):
     """Object that we send to the metadata db with handlers via GET."""
@@ -19,6 +22,49 @@ class MetadataDbPostRequest(BaseModel):
     job_id: str
 
 
+class BestHit(BaseModel):
+    """Hit of a query with the highest bit score."""
+
+    target: str
+    evalue: float
+    bits: float
+    identity: float
+
+
+class QuerySummary(BaseModel):
+    """Hits of a query."""
+
+    hits: int
+    best: BestHit | None = None
+
+
+class ResultSummary(BaseModel):
+    """Summary of the result of a finished job, computed by the worker.
+
+    The queries are the queries submitted, ``per_query`` lists the queries with hits, only the ones with
+    the best hits when ``per_query_truncated``. The e-value distribution counts the hits per upper bound
+    (``<=1e-50``, ..., ``>1``), the identity distribution per tenth of the fraction of identical residues
+    (``0.9-1.0``).
+    """
+
+    queries: int
+    hits: int
+    per_query: dict[str, QuerySummary]
+    per_query_truncated: bool = False
+    evalue: dict[str, int]
+    identity: dict[str, int]
+
+
+class MetadataDbPatchRequest(BaseModel):
+    """Object that we send to the metadata db with handlers via PATCH."""
+
+    status: TaskStatus
+    submitted_at: datetime | None = None
+    completed_at: datetime | None = None
+    summary: ResultSummary | None = None
+    error: str | None = None
+
+
 class MetaDataDbPostResponse(BaseModel):
     """Object that we receive from the metadata db with handlers via POST."""
 
@@ -33,3 +79,26 @@ class MetaDataDbGetResponse(BaseModel):
     status: TaskStatus
     submitted_at: datetime | None = None
     completed_at: datetime | None = None
+    summary: ResultSummary | None = None
+    error: str | None = None
+
+
+class JobListRequest(BaseModel):
+    """Filters and page of the job listing, sent to the metadata db as query parameters.
+
+    The jobs are listed newest first. The next page starts after the last job of the previous one, given by its
+    ``cursor``, so paging stays as fast on the last page as on the first.
+    """
+
+    status: list[TaskStatus] | None = None
+    submitted_after: datetime | None = None
+    submitted_before: datetime | None = None
+    limit: int = Field(default=100, ge=1, le=MAX_PAGE_SIZE)
+    cursor: str | None = None
+
+
+class JobListResponse(BaseModel):
+    """Page of the job listing that we receive from the metadata db."""
+
+    jobs: list[MetaDataDbGetResponse]
+    next_cursor: str | None = None
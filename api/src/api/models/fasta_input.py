@@ -7,13 +7,15 @@ from io import StringIO
 
 from Bio import SeqIO
 from loguru import logger
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, PrivateAttr, field_validator
 
 
 class FastaBlobModel(BaseModel):
     """Model defining a fasta blob."""
 
     fasta: str
+    # version of the target database the job is searched against, set by the api, not by the client
+    _db_version: str | None = PrivateAttr(default=None)
 
     @field_validator("fasta", mode="after")
     @classmethod
@@ -64,16 +66,36 @@ class FastaBlobModel(BaseModel):
         """
         return set("ABCDEFGHIKLMNOPQRSTUVWXYZ*-X")
 
+    @property
+    def db_version(self) -> str | None:
+        """Version of the target database the job is searched against.
+
+        Returns:
+            str | None: The version, None when the target database is not versioned.
+        """
+        return self._db_version
+
+    def set_db_version(self, db_version: str | None) -> None:
+        """Set the version of the target database, the job id changes with it.
+
+        Args:
+            db_version (str | None): The version, None when the target database is not versioned.
+        """
+        self._db_version = db_version
+        self.__dict__.pop("job_id", None)
+
     @cached_property
     def job_id(self) -> str:
         """Generate a job id for the fasta content based on its contents.
 
-        The job ID is generated by computing the MD5 hash of the fasta string.
+        The job ID is generated by computing the MD5 hash of the fasta string, prefixed with the version of the
+        target database when it is versioned, so the results of different versions are kept apart.
 
         Returns:
             str: The MD5 hash of the fasta string.
         """
-        h = hashlib.md5(self.fasta.encode("utf-8"))
+        key = self.fasta if self._db_version is None else f"{self._db_version}\n{self.fasta}"
+        h = hashlib.md5(key.encode("utf-8"))
         return h.hexdigest()
 
     def to_message(self) -> str:
@@ -82,4 +104,7 @@ class FastaBlobModel(BaseModel):
         Returns:
             str: The message as a JSON string.
         """
-        return json.dumps({"job_id": self.job_id, "fasta": self.fasta})
+        message = {"job_id": self.job_id, "fasta": self.fasta}
+        if self._db_version is not None:
+            message["db_version"] = self._db_version
+        return json.dumps(message)
@@ -0,0 +1,52 @@
+"""Models of the requests for the hits of the results."""
+
+import json
+from typing import Any
+
+from pydantic import BaseModel, Field
+
+# targets of a bulk request, a few thousand sequences are read in milliseconds
+MAX_TARGETS = 10_000
+# pairs of an alignment request, each pair is rendered and cached on its own
+MAX_PAIRS = 100
+
+
+class HitSequencesRequest(BaseModel):
+    """Targets of the hits whose sequences are requested."""
+
+    targets: list[str] = Field(min_length=1, max_length=MAX_TARGETS)
+
+
+class HitPair(BaseModel):
+    """A query of the job and one of its hits."""
+
+    query: str
+    target: str
+
+
+class PairAlignmentRequest(BaseModel):
+    """Pairs of a job whose alignments are requested.
+
+    The fasta submitted for the job is only needed once the worker no longer keeps the alignment DB of the job,
+    the queries of the pairs are then searched again.
+    """
+
+    pairs: list[HitPair] = Field(min_length=1, max_length=MAX_PAIRS)
+    fasta: str | None = None
+
+    def to_message(self, job_id: str, pairs: list[HitPair], fasta: str | None, db_version: str | None) -> str:
+        """Convert to the rabbit mq message asking the worker to align the pairs.
+
+        Args:
+            job_id (str): The job id.
+            pairs (list[HitPair]): The pairs not aligned yet.
+            fasta (str | None): The fasta of the job to search the queries again, None to use the alignment DB.
+            db_version (str | None): The version of the target database the job was searched against.
+
+        Returns:
+            str: The message as a JSON string.
+        """
+        message: dict[str, Any] = {"job_id": job_id, "task": "align", "pairs": [pair.model_dump() for pair in pairs]}
+        if fasta is not None:
+            message |= {"fasta": fasta, "db_version": db_version}
+        return json.dumps(message)
@@ -0,0 +1,114 @@
+"""Output format model of the results."""
+
+import hashlib
+import json
+from functools import cached_property
+
+from pydantic import BaseModel, field_validator
+
+# Columns of the mmseqs convertalis --format-output option.
+FORMAT_OUTPUT_COLUMNS = frozenset({
+    "query",
+    "target",
+    "evalue",
+    "gapopen",
+    "pident",
+    "fident",
+    "nident",
+    "qstart",
+    "qend",
+    "qlen",
+    "tstart",
+    "tend",
+    "tlen",
+    "alnlen",
+    "raw",
+    "bits",
+    "cigar",
+    "qseq",
+    "tseq",
+    "qheader",
+    "theader",
+    "qaln",
+    "taln",
+    "qframe",
+    "tframe",
+    "mismatch",
+    "qcov",
+    "tcov",
+    "qset",
+    "qsetid",
+    "tset",
+    "tsetid",
+    "taxid",
+    "taxname",
+    "taxlineage",
+    "qorfstart",
+    "qorfend",
+    "torfstart",
+    "torfend",
+    "ppos",
+})
+
+# Columns of the result written by the search, the same as the mmseqs easy-search default.
+DEFAULT_FORMAT_OUTPUT = "query,target,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,evalue,bits"
+
+
+class OutputFormatModel(BaseModel):
+    """Model defining the output columns requested for the results of a job."""
+
+    job_id: str
+    format_output: str
+
+    @field_validator("format_output", mode="after")
+    @classmethod
+    def validate_format_output(cls, format_output: str) -> str:
+        """Normalize the comma separated columns and check they are known to convertalis.
+
+        Args:
+            format_output (str): The comma separated columns.
+
+        Returns:
+            str: The columns without whitespace and empty items.
+
+        Raises:
+            ValueError: If no column or an unknown column is requested.
+        """
+        columns = [column.strip() for column in format_output.split(",") if column.strip()]
+        if not columns:
+            raise ValueError("No output column requested.")
+        unknown = sorted(set(columns) - FORMAT_OUTPUT_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown output columns: {', '.join(unknown)}.")
+        return ",".join(columns)
+
+    @property
+    def is_default(self) -> bool:
+        """Check if the columns are the ones of the search result.
+
+        Returns:
+            bool: True when the search result can be served as it is.
+        """
+        return self.format_output == DEFAULT_FORMAT_OUTPUT
+
+    @cached_property
+    def format_id(self) -> str:
+        """Identifier of the output format, used in the result file name.
+
+        Returns:
+            str: The first 12 characters of the MD5 hash of the columns.
+        """
+        return hashlib.md5(self.format_output.encode("utf-8")).hexdigest()[:12]
+
+    def to_message(self) -> str:
+        """Convert to the rabbit mq message asking the worker to run convertalis.
+
+        Returns:
+            str: The message as a JSON string.
+        """
+        return json.dumps({
+            "job_id": self.job_id,
+            "task": "convertalis",
+            "format_output": self.format_output,
+            "format_id": self.format_id,
+        })
@@ -0,0 +1,46 @@
+"""Coalescing of concurrent identical requests."""
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Any, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, concurrent callers with the same key share its result.
+
+    The call runs in its own task, a caller that is cancelled (e.g. the client disconnected) does not
+    cancel the call the other callers are waiting for. Exceptions are raised to every caller.
+    """
+
+    def __init__(self) -> None:
+        self._calls: dict[str, asyncio.Task[Any]] = {}
+
+    def in_flight(self, key: str) -> bool:
+        """Check if a call with the key is running.
+
+        Args:
+            key (str): The call key.
+
+        Returns:
+            bool: True if a call with the key is running.
+        """
+        return key in self._calls
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """Run fn, or wait for the running call with the same key.
+
+        Args:
+            key (str): The call key.
+            fn (Callable[[], Awaitable[T]]): The coroutine function to run.
+
+        Returns:
+            T: The result of the call.
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await asyncio.shield(task)
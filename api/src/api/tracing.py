@@ -0,0 +1,170 @@
+"""Lightweight request tracing.
+
+Spans use the W3C trace context identifiers, so the trace started by the api can be propagated
+to the worker through the ``traceparent`` message header and joined offline by ``trace_id``.
+The current span is kept in a context variable, nested spans are parented automatically.
+"""
+
+from __future__ import annotations
+
+import json
+import secrets
+import threading
+import time
+from collections.abc import Generator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any
+
+TRACEPARENT_HEADER = "traceparent"
+
+_current_span: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+@dataclass
+class Span:
+    """Single timed operation within a trace."""
+
+    name: str
+    service: str
+    trace_id: str
+    span_id: str
+    parent_id: str | None = None
+    start_time: float = field(default_factory=time.time)
+    end_time: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent header value pointing at this span.
+
+        Returns:
+            str: The traceparent header value.
+        """
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict[str, Any]:
+        """Serialize the span.
+
+        Returns:
+            dict[str, Any]: The span fields with the span duration.
+        """
+        span = asdict(self)
+        span["duration"] = None if self.end_time is None else self.end_time - self.start_time
+        return span
+
+
+def parse_traceparent(traceparent: str | None) -> tuple[str, str] | None:
+    """Extract the trace id and the parent span id from the traceparent header.
+
+    Args:
+        traceparent (str | None): The traceparent header value.
+
+    Returns:
+        tuple[str, str] | None: The trace id and the parent span id, None if the header is missing or malformed.
+
+    Examples:
+        >>> parse_traceparent("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01")
+        ('0af7651916cd43dd8448eb211c80319c', 'b7ad6b7169203331')
+        >>> parse_traceparent("garbage") is None
+        True
+    """
+    if not traceparent:
+        return None
+    parts = traceparent.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class SpanExporter:
+    """Base class for the span exporters, the default implementation drops the spans."""
+
+    def export(self, span: Span) -> None:
+        """Export the finished span.
+
+        Args:
+            span (Span): The finished span.
+        """
+
+
+class FileSpanExporter(SpanExporter):
+    """Exporter appending finished spans as JSON lines to a local file for offline analysis."""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+    def export(self, span: Span) -> None:
+        """Append the span to the trace file.
+
+        Args:
+            span (Span): The finished span.
+        """
+        line = json.dumps(span.to_dict()) + "\n"
+        with self._lock, self.path.open("a") as f:
+            f.write(line)
+
+
+class Tracer:
+    """Creates spans and hands the finished ones to the exporter."""
+
+    def __init__(self, service: str, exporter: SpanExporter | None = None) -> None:
+        self.service = service
+        self.exporter = exporter or SpanExporter()
+
+    @contextmanager
+    def start_span(self, name: str, traceparent: str | None = None, **attributes: Any) -> Generator[Span]:
+        """Start a span as a child of the traceparent, the current span or as a new trace.
+
+        Args:
+            name (str): The span name.
+            traceparent (str | None): Remote parent of the span, takes precedence over the current span.
+            **attributes (Any): Attributes attached to the span.
+
+        Yields:
+            Span: The started span, finished and exported when the context exits.
+
+        Raises:
+            Exception: Any exception raised within the span is recorded on the span and re-raised.
+        """
+        parent = _current_span.get()
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id = remote
+        elif parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+        span = Span(
+            name=name,
+            service=self.service,
+            trace_id=trace_id,
+            span_id=secrets.token_hex(8),
+            parent_id=parent_id,
+            attributes=attributes,
+        )
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.attributes["error"] = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_time = time.time()
+            self.exporter.export(span)
+
+
+def current_span() -> Span | None:
+    """Get the span active in the current context.
+
+    Returns:
+        Span | None: The active span, None outside of any span.
+    """
+    return _current_span.get()
+
+
+tracer = Tracer("api")
@@ -2,7 +2,6 @@
 
 from collections.abc import Generator
 from pathlib import Path
-from unittest.mock import MagicMock
 
 import pytest
 from fastapi.testclient import TestClient
@@ -41,13 +40,9 @@ def static_files() -> Path:
     return p
 
 
-@pytest.fixture
-def client(static_files: Path) -> TestClient:
-    # Patch __enter__ to return a mock with publish_message as a MagicMock
-    queue_mock = MagicMock()
-    queue_mock.publish_message = MagicMock()
+def build_client(static_path: Path, target_db_path: str = "", **options: str | float) -> TestClient:
     app = App(
-        fasta_output_path=str(static_files),
+        fasta_output_path=str(static_path),
         db_endpoint="localhost",
         db_port=8085,
         queue_name="test-queue",
@@ -55,10 +50,90 @@ def client(static_files: Path) -> TestClient:
         queue_passwd="pass",  # noqa: S106
         queue_port=5672,
         queue_host="localhost",
+        target_db_path=target_db_path,
+        **options,
     ).app
     return TestClient(app)
 
 
+@pytest.fixture
+def client(static_files: Path) -> TestClient:
+    return build_client(static_files)
+
+
+@pytest.fixture
+def admission_client(static_files: Path) -> TestClient:
+    """Client rejecting the submissions while more than 2 jobs are queued, a job taking a worker 60s."""
+    return build_client(static_files, max_queue_depth=2, job_seconds=60)
+
+
+@pytest.fixture
+def in_flight_client(tmp_path: Path) -> TestClient:
+    """Client serving the results from a temporary directory, a client may have 1 job in flight."""
+    return build_client(tmp_path, max_client_in_flight=1)
+
+
+@pytest.fixture
+def tmp_static_client(tmp_path: Path) -> TestClient:
+    """Client serving the results from an empty temporary directory."""
+    return build_client(tmp_path)
+
+
+def write_mmseqs_db(path: Path, records: list[tuple[str, str, str]]) -> Path:
+    """Write an MMseqs2 database of (accession, header, sequence) records, the keys in reverse order."""
+    sequences, headers, index, header_index, lookup = b"", b"", "", "", ""
+    for key, (accession, header, sequence) in reversed(list(enumerate(records))):
+        sequence_entry, header_entry = f"{sequence}\n\0".encode(), f"{header}\n\0".encode()
+        index += f"{key}\t{len(sequences)}\t{len(sequence_entry)}\n"
+        header_index += f"{key}\t{len(headers)}\t{len(header_entry)}\n"
+        lookup += f"{key}\t{accession}\t0\n"
+        sequences += sequence_entry
+        headers += header_entry
+    path.write_bytes(sequences)
+    path.with_name(f"{path.name}.index").write_text(index)
+    path.with_name(f"{path.name}_h").write_bytes(headers)
+    path.with_name(f"{path.name}_h.index").write_text(header_index)
+    path.with_name(f"{path.name}.lookup").write_text(lookup)
+    return path
+
+
+@pytest.fixture
+def target_db_path(tmp_path: Path) -> Path:
+    """MMseqs2 target database of three UniProt entries."""
+    (tmp_path / "db").mkdir()
+    return write_mmseqs_db(
+        tmp_path / "db" / "swissprot",
+        [
+            ("P12345", "sp|P12345|AATM_RABIT Aspartate aminotransferase", "MALLHSGRVLPG"),
+            ("Q6GZX4", "sp|Q6GZX4|001R_FRG3G Putative transcription factor", "MAFSAEDVLK"),
+            ("A0A000", "tr|A0A000|A0A000_9ACTN MoeA5", "MSKGEELFTG"),
+        ],
+    )
+
+
+@pytest.fixture
+def target_db_root(tmp_path: Path) -> Path:
+    """Versions of the target database as prepared by the worker, 2025_02 is not ready."""
+    root = tmp_path / "versions"
+    for version, header in (("2025_01", "Aspartate aminotransferase"), ("2025_02", "Renamed")):
+        (root / version).mkdir(parents=True)
+        write_mmseqs_db(root / version / "swissprot", [("P12345", f"sp|P12345|AATM_RABIT {header}", "MALLHSGRVLPG")])
+    (root / "2025_01" / "READY").touch()
+    return root
+
+
+@pytest.fixture
+def target_db_client(tmp_path: Path, target_db_path: Path) -> TestClient:
+    """Client serving the results from a temporary directory and the hit sequences from a target database."""
+    return build_client(tmp_path, str(target_db_path))
+
+
+@pytest.fixture
+def versioned_target_db_client(tmp_path: Path, target_db_path: Path, target_db_root: Path) -> TestClient:
+    """Client serving the hit sequences from the version of the target database of the job."""
+    return build_client(tmp_path, str(target_db_path), target_db_root=str(target_db_root))
+
+
 @pytest.fixture
 def valid_fasta():
     return ">seq1\nMKTAYIAKQRQISFVKSHFSRQDILDLWIYHTQGYFPQ\n"
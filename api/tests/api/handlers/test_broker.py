@@ -19,3 +19,34 @@ def test_publish_message_success(mock_blocking_connection):
     mock_channel.confirm_delivery.assert_called_once()
     mock_channel.basic_publish.assert_called_once()
     mock_conn.close.assert_called_once()
+
+
+@patch("api.handlers.broker.pika.BlockingConnection")
+def test_publish_message_sets_timestamp(mock_blocking_connection):
+    mock_conn = MagicMock()
+    mock_channel = MagicMock()
+    mock_blocking_connection.return_value = mock_conn
+    mock_conn.channel.return_value = mock_channel
+
+    broker = BlockingQueueConnection("queue", "user", "pass", 5672, "localhost")
+    broker.publish_message('{"test": 1}')
+
+    properties = mock_channel.basic_publish.call_args.kwargs["properties"]
+    assert properties.delivery_mode == 2
+    assert isinstance(properties.timestamp, int)
+
+
+@patch("api.handlers.broker.pika.BlockingConnection")
+def test_queue_depth(mock_blocking_connection):
+    mock_conn = MagicMock()
+    mock_channel = MagicMock()
+    mock_blocking_connection.return_value = mock_conn
+    mock_conn.channel.return_value = mock_channel
+    mock_channel.queue_declare.return_value.method.message_count = 7
+    mock_channel.queue_declare.return_value.method.consumer_count = 3
+
+    broker = BlockingQueueConnection("queue", "user", "pass", 5672, "localhost")
+    assert broker.queue_depth() == (7, 3)
+
+    mock_channel.queue_declare.assert_called_once_with(queue="queue", durable=True, passive=True)
+    mock_conn.close.assert_called_once()
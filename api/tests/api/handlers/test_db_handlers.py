@@ -4,7 +4,13 @@ import pytest
 from fastapi import HTTPException
 
 from api.handlers.db import MetaDataDb
-from api.models.db import MetadataDbGetRequest, MetaDataDbGetResponse, MetadataDbPostRequest, MetaDataDbPostResponse
+from api.models.db import (
+    JobListRequest,
+    MetadataDbGetRequest,
+    MetaDataDbGetResponse,
+    MetadataDbPostRequest,
+    MetaDataDbPostResponse,
+)
 from api.status import TaskStatus
 
 
@@ -99,3 +105,112 @@ class TestMetaDataDb:
         with pytest.raises(HTTPException) as exc:
             await db.post_job(data)
         self._assert_http_exception(exc, 500, f"Unexpected error while posting job {job_id}.")
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_requeue_job_success(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test requeue method patches the job back to QUEUED and clears the completion time and the summary."""
+        mock_client = self._setup_mock_response(m_async_client, "patch", 200, {})
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        resp = await db.requeue_job(job_id)
+        assert resp == MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.QUEUED)
+        kwargs = mock_client.patch.call_args.kwargs
+        assert kwargs["url"] == f"{endpoint}job/{job_id}"
+        assert kwargs["json"]["status"] == TaskStatus.QUEUED
+        assert kwargs["json"]["submitted_at"] is not None
+        assert kwargs["json"]["completed_at"] is None
+        assert kwargs["json"]["summary"] is None
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_requeue_job_unexpected_error(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test requeue method returns 500 response and proper details."""
+        self._setup_mock_response(m_async_client, "patch", 404)
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        with pytest.raises(HTTPException) as exc:
+            await db.requeue_job(job_id)
+        self._assert_http_exception(exc, 500, f"Unexpected error while requeuing job {job_id}.")
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(("status_code", "created"), [(201, True), (200, False)])
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_create_or_get_job(
+        self, m_async_client: AsyncMock, endpoint: str, job_id: str, status_code: int, created: bool
+    ):
+        """Test create_or_get method returns the stored job and whether it was created."""
+        resp_obj = MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED).model_dump()
+        mock_client = self._setup_mock_response(m_async_client, "put", status_code, resp_obj)
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        job, was_created = await db.create_or_get_job(MetadataDbPostRequest(job_id=job_id))
+        assert job == MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED)
+        assert was_created is created
+        assert mock_client.put.call_args.kwargs["url"] == f"{endpoint}job/{job_id}"
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_create_or_get_job_unexpected_error(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test create_or_get method returns 500 response and proper details."""
+        self._setup_mock_response(m_async_client, "put", 500)
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        with pytest.raises(HTTPException) as exc:
+            await db.create_or_get_job(MetadataDbPostRequest(job_id=job_id))
+        self._assert_http_exception(exc, 500, f"Unexpected error while creating job {job_id}.")
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_expire_job(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test expire method patches only the status of the job."""
+        mock_client = self._setup_mock_response(m_async_client, "patch", 200, {})
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        await db.expire_job(job_id)
+        assert mock_client.patch.call_args.kwargs["json"] == {"status": TaskStatus.EXPIRED}
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_cancel_job(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test cancel method patches only the status of the job and maps the missing job to 404."""
+        mock_client = self._setup_mock_response(m_async_client, "patch", 200, {})
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        res = await db.cancel_job(job_id)
+        assert res.status == TaskStatus.CANCELLED
+        assert mock_client.patch.call_args.kwargs["json"] == {"status": TaskStatus.CANCELLED}
+
+        self._setup_mock_response(m_async_client, "patch", 404)
+        with pytest.raises(HTTPException) as exc:
+            await db.cancel_job(job_id)
+        self._assert_http_exception(exc, 404, f"Failed to fetch {job_id} from database.")
+
+        self._setup_mock_response(m_async_client, "patch", 409, {"detail": {"status": "FINISHED"}})
+        with pytest.raises(HTTPException) as exc:
+            await db.cancel_job(job_id)
+        self._assert_http_exception(exc, 409, f"Job {job_id} is FINISHED")
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_list_jobs(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test list method sends only the filters given and maps the invalid cursor to 422."""
+        page = {"jobs": [{"job_id": job_id, "status": "QUEUED"}], "next_cursor": "next"}
+        mock_client = self._setup_mock_response(m_async_client, "get", 200, page)
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        res = await db.list_jobs(JobListRequest(status=[TaskStatus.QUEUED], limit=10))
+        assert res.jobs[0].job_id == job_id
+        assert res.next_cursor == "next"
+        assert mock_client.get.call_args.kwargs == {
+            "url": f"{endpoint}jobs",
+            "params": {"status": ["QUEUED"], "limit": 10},
+        }
+
+        self._setup_mock_response(m_async_client, "get", 422)
+        with pytest.raises(HTTPException) as exc:
+            await db.list_jobs(JobListRequest(cursor="invalid"))
+        self._assert_http_exception(exc, 422, "Invalid job listing cursor.")
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.AsyncClient", new_callable=AsyncMock)
+    async def test_expire_job_unexpected_error(self, m_async_client: AsyncMock, endpoint: str, job_id: str):
+        """Test expire method returns 500 response and proper details."""
+        self._setup_mock_response(m_async_client, "patch", 404)
+        db = MetaDataDb(endpoint, m_async_client.return_value)
+        with pytest.raises(HTTPException) as exc:
+            await db.expire_job(job_id)
+        self._assert_http_exception(exc, 500, f"Unexpected error while expiring job {job_id}.")
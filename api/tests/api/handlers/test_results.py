@@ -0,0 +1,91 @@
+import gzip
+import json
+import os
+from pathlib import Path
+
+from api.handlers.results import ResultStore
+
+
+def test_find_prefers_compressed_results(tmp_path: Path):
+    """Test find returns the compressed result, falls back to the plain one and None when missing."""
+    store = ResultStore(tmp_path)
+    (tmp_path / "plain.m8").write_text("x")
+    (tmp_path / "both.m8").write_text("x")
+    (tmp_path / "both.m8.gz").write_bytes(gzip.compress(b"x"))
+
+    assert store.find("plain") == tmp_path / "plain.m8"
+    assert store.find("both") == tmp_path / "both.m8.gz"
+    assert store.find("missing") is None
+    assert store.is_compressed(tmp_path / "both.m8.gz")
+    assert not store.is_compressed(tmp_path / "plain.m8")
+
+
+def test_iter_decompressed_streams_in_chunks(tmp_path: Path):
+    """Test the decompressed content is streamed in chunks of the configured size."""
+    path = tmp_path / "job.m8.gz"
+    path.write_bytes(gzip.compress(b"a" * 10))
+    store = ResultStore(tmp_path, chunk_size=4)
+
+    assert list(store.iter_decompressed(path)) == [b"aaaa", b"aaaa", b"aa"]
+
+
+def test_touch_keeps_modification_time(tmp_path: Path):
+    """Test touch refreshes the access time only."""
+    path = tmp_path / "job.m8.gz"
+    path.write_bytes(b"")
+    os.utime(path, (0, 1000))
+
+    ResultStore.touch(path)
+    assert path.stat().st_atime > 1000
+    assert path.stat().st_mtime == 1000
+
+
+def test_find_output_format_and_alignment(tmp_path: Path):
+    """Test find looks up the result in the output format and has_alignment the alignment DB."""
+    store = ResultStore(tmp_path)
+    (tmp_path / "job.abc.m8.gz").write_bytes(gzip.compress(b"x"))
+    (tmp_path / "alignments" / "job").mkdir(parents=True)
+
+    assert store.find("job", "abc") == tmp_path / "job.abc.m8.gz"
+    assert store.find("job") is None
+    assert store.has_alignment("job")
+    assert not store.has_alignment("other")
+
+
+def test_mark_pending_once_within_the_ttl(tmp_path: Path):
+    """A task is marked pending once, again after the TTL or once it is cleared."""
+    store = ResultStore(tmp_path, pending_ttl_seconds=300)
+    assert store.mark_pending("job", "abc")
+    assert not store.mark_pending("job", "abc")
+    assert store.mark_pending("job", "def")
+
+    marker = tmp_path / ".pending" / "job" / "abc"
+    os.utime(marker, (marker.stat().st_atime, marker.stat().st_mtime - 301))
+    assert store.mark_pending("job", "abc")
+    assert not store.mark_pending("job", "abc")
+
+    store.clear_pending("job", "abc")
+    store.clear_pending("job", "abc")
+    assert store.mark_pending("job", "abc")
+
+
+def test_db_version(tmp_path: Path):
+    """The version of the target database is read from the file published by the worker."""
+    store = ResultStore(tmp_path)
+    assert store.db_version() is None
+    (tmp_path / ".db_version").write_text("2025_01\n")
+    assert store.db_version() == "2025_01"
+
+
+def test_find_partial_and_iter_partial(tmp_path: Path):
+    """The partial result is read from the progress file, only the bytes of the queries done are streamed."""
+    store = ResultStore(tmp_path, chunk_size=4)
+    assert store.find_partial("job") is None
+    partial_dir = tmp_path / ".partial" / "job"
+    partial_dir.mkdir(parents=True)
+    (partial_dir / "hits.m8").write_bytes(b"a" * 10)
+    (partial_dir / "progress.json").write_text(json.dumps({"queries_done": 3, "queries_total": 5, "bytes": 6}))
+
+    partial = store.find_partial("job")
+    assert (partial.queries_done, partial.queries_total, partial.size) == (3, 5, 6)
+    assert list(store.iter_partial(partial)) == [b"aaaa", b"aa"]
@@ -0,0 +1,56 @@
+import os
+from pathlib import Path
+
+from api.handlers.target_db import TargetDb, TargetDbVersions
+
+
+def test_get_reads_header_and_sequence(target_db_path: Path):
+    """The entries are found by accession and by UniProt style id, missing ones give None."""
+    db = TargetDb(target_db_path)
+
+    assert db.get("P12345") == ("sp|P12345|AATM_RABIT Aspartate aminotransferase", "MALLHSGRVLPG")
+    assert db.get("sp|Q6GZX4|001R_FRG3G") == ("sp|Q6GZX4|001R_FRG3G Putative transcription factor", "MAFSAEDVLK")
+    assert db.get("A0A000")[1] == "MSKGEELFTG"
+    assert db.get("P99999") is None
+    assert db.get("A_VERY_LONG_ACCESSION_NOT_IN_THE_DB") is None
+
+
+def test_iter_fasta_keeps_order_and_skips_missing(target_db_path: Path):
+    """The FASTA records come in the requested order."""
+    db = TargetDb(target_db_path)
+
+    assert list(db.iter_fasta(["Q6GZX4", "missing", "P12345"])) == [
+        ">sp|Q6GZX4|001R_FRG3G Putative transcription factor\nMAFSAEDVLK\n",
+        ">sp|P12345|AATM_RABIT Aspartate aminotransferase\nMALLHSGRVLPG\n",
+    ]
+
+
+def test_accession_index_is_built_once(target_db_path: Path):
+    """The accession index is written next to the database and reused while it is newer."""
+    TargetDb(target_db_path)
+    index_path = target_db_path.with_name("swissprot.accessions")
+    os.utime(index_path, ns=(2 * 10**18, 2 * 10**18))
+
+    TargetDb(target_db_path)
+    assert index_path.stat().st_mtime_ns == 2 * 10**18
+
+
+def test_versions_are_mapped_once_ready(target_db_path: Path, target_db_root: Path):
+    """A version is mapped on first use once ready, the jobs without a version read the default database."""
+    default = TargetDb(target_db_path)
+    versions = TargetDbVersions(target_db_root, "swissprot", default=default, max_open=1)
+
+    assert versions.get(None) is default
+    assert versions.get("2025_02") is None
+    db = versions.get("2025_01")
+    assert db is not None
+    assert db.get("Q6GZX4") is None
+    assert versions.get("2025_01") is db
+
+    (target_db_root / "2025_02" / "READY").touch()
+    db = versions.get("2025_02")
+    assert db is not None
+    assert db.get("P12345") == ("sp|P12345|AATM_RABIT Renamed", "MALLHSGRVLPG")
+    assert list(versions._open) == ["2025_02"]
+
+    assert TargetDbVersions(None, "swissprot", default=default).get("2025_01") is default
@@ -52,3 +52,19 @@ def test_invalid_fasta_input(invalid_fasta: str, error_msg: str) -> None:
     with pytest.raises(ValueError) as exc_info:
         FastaBlobModel(fasta=invalid_fasta)
     assert error_msg in str(exc_info.value)
+
+
+def test_fasta_input_keyed_by_db_version(valid_fasta: str) -> None:
+    """The job id and the message depend on the version of the target database."""
+    fasta_input = FastaBlobModel(fasta=valid_fasta)
+    unversioned_job_id = fasta_input.job_id
+
+    fasta_input.set_db_version("2025_01")
+    assert fasta_input.job_id != unversioned_job_id
+    assert json.loads(fasta_input.to_message())["db_version"] == "2025_01"
+
+    fasta_input.set_db_version("2025_02")
+    assert fasta_input.job_id not in (unversioned_job_id, FastaBlobModel(fasta=valid_fasta).job_id)
+    fasta_input.set_db_version(None)
+    assert fasta_input.job_id == unversioned_job_id
+    assert "db_version" not in json.loads(fasta_input.to_message())
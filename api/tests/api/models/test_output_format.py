@@ -0,0 +1,45 @@
+"""Test output format model."""
+
+import json
+
+import pytest
+from pydantic import ValidationError
+
+from api.models.output_format import DEFAULT_FORMAT_OUTPUT, OutputFormatModel
+
+
+def test_output_format_normalized():
+    """Test the columns are stripped and empty items dropped."""
+    output = OutputFormatModel(job_id="1234", format_output=" query, target,,qaln ")
+    assert output.format_output == "query,target,qaln"
+    assert not output.is_default
+    assert len(output.format_id) == 12
+
+
+def test_output_format_default():
+    """Test the search result columns are recognized as the default format."""
+    assert OutputFormatModel(job_id="1234", format_output=DEFAULT_FORMAT_OUTPUT).is_default
+
+
+@pytest.mark.parametrize(
+    "format_output",
+    [
+        pytest.param("query,foo", id="unknown"),
+        pytest.param(" , ", id="empty"),
+    ],
+)
+def test_output_format_invalid(format_output: str):
+    """Test unknown or missing columns are rejected."""
+    with pytest.raises(ValidationError):
+        OutputFormatModel(job_id="1234", format_output=format_output)
+
+
+def test_output_format_message():
+    """Test the convertalis task message."""
+    output = OutputFormatModel(job_id="1234", format_output="query,target")
+    assert json.loads(output.to_message()) == {
+        "job_id": "1234",
+        "task": "convertalis",
+        "format_output": "query,target",
+        "format_id": output.format_id,
+    }
@@ -0,0 +1,63 @@
+"""Admission control tests."""
+
+from unittest.mock import MagicMock
+
+import pytest
+from fastapi import HTTPException
+
+from api.admission import AdmissionControl
+
+
+def admission(depth: tuple[int, int], **limits: float) -> tuple[AdmissionControl, MagicMock, list[float]]:
+    now = [0.0]
+    queue = MagicMock(**{"queue_depth.return_value": depth})
+    return AdmissionControl(queue, job_seconds=60, clock=lambda: now[0], **limits), queue, now
+
+
+@pytest.mark.asyncio
+async def test_backlog_over_the_limit_is_rejected_with_the_time_to_drain_it():
+    """The backlog is the queued jobs times the seconds per job, shared by the consumers."""
+    control, _, _ = admission((10, 4), max_backlog_seconds=100)
+
+    with pytest.raises(HTTPException) as excinfo:
+        await control.admit("client", "job1")
+    # 10 jobs of 60s on 4 workers take 150s, 50s over the limit
+    assert excinfo.value.status_code == 429
+    assert excinfo.value.headers == {"Retry-After": "50"}
+
+
+@pytest.mark.asyncio
+async def test_depth_is_read_once_per_refresh_interval():
+    """The depth is reused within the refresh interval, a failed read admits the submissions."""
+    control, queue, now = admission((1, 1), max_queue_depth=5)
+
+    await control.admit("client", "job1")
+    await control.admit("client", "job2")
+    assert queue.queue_depth.call_count == 1
+
+    now[0] = 1
+    queue.queue_depth.side_effect = ConnectionError("broker down")
+    await control.admit("client", "job3")
+    assert queue.queue_depth.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_client_in_flight_limit():
+    """A client gets 429 with the limit of jobs in flight, until one of them is done or expires."""
+    control, _, now = admission((2, 1), max_client_in_flight=2, in_flight_ttl_seconds=600)
+
+    await control.admit("a", "job1")
+    await control.admit("a", "job2")
+    await control.admit("b", "job3")
+    with pytest.raises(HTTPException) as excinfo:
+        await control.admit("a", "job4")
+    # the 2 queued jobs, then one job of the client
+    assert excinfo.value.headers == {"Retry-After": "180"}
+
+    control.release("job1")
+    now[0] = 300
+    await control.admit("a", "job4")
+    assert control.in_flight("a") == 2
+
+    now[0] = 601
+    assert control.in_flight("a") == 1
@@ -1,13 +1,20 @@
 """API endpoint tests."""
 
+import asyncio
+import gzip
 import json
+import os
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 import pytest
-from httpx import Request, Response
+from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient, Request, Response
 
-from api.models.db import MetaDataDbPostResponse
+from api.handlers.results import pair_id
+from api.models.db import JobListResponse, MetaDataDbGetResponse, MetaDataDbPostResponse
+from api.models.fasta_input import FastaBlobModel
+from api.models.output_format import OutputFormatModel
 from api.status import TaskStatus
 
 
@@ -17,25 +24,36 @@ class TestApi:
     Tests include:
     1. Submitting new fasta data (not in database).
     2. Submitting existing fasta data (already in database).
+    2a. Submitting fasta data whose results were evicted or whose job failed (requeued).
     3. Submitting invalid fasta data (empty sequence).
     4. Handling queue UnroutableError during submission. (expected to fail)
-    5. Handling database POST error during submission.
+    4a. Expiring the created or requeued job when publishing it fails.
+    5. Handling database error during submission.
+    5a. Coalescing concurrent identical submissions.
+    5b. Keying the job id by the target database version.
     6. Getting status for non-existent job (404).
     7. Getting status for existing job.
+    7a. Getting the result summary of a finished job.
     8. Handling database error during status check.
     9. Serving static files (non-existent file).
     10. Serving static files (existing file).
+    11. Serving gzip compressed results (passed through or decompressed).
+    12. Serving results in other output formats (generated by the worker on request).
+    13. Serving the partial results of a running job.
+    14. Serving the sequences of the hits from the version of the target database the job was searched against.
+    15. Serving the alignments of selected pairs (rendered by the worker on request).
+    16. Cancelling queued and running jobs.
+    17. Listing the jobs filtered by status and submission time, page by page.
+    18. Rejecting the submissions with 429 and Retry-After when the queue backs up.
     """
 
     @pytest.mark.asyncio
-    @patch("api.handlers.db.MetaDataDb.post_job", new_callable=AsyncMock)
-    @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
     @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
     async def test_submit_new_data(
         self,
         mock_publish: MagicMock,
-        mock_get_job: MagicMock,
-        mock_post_job: MagicMock,
+        mock_create_or_get_job: MagicMock,
         client: AsyncMock,
         valid_fasta: str,
         job_id: str,
@@ -43,37 +61,26 @@ class TestApi:
         """User sends POST:/submit with the fasta blob and the data does not exist in the database.
 
         We expect
-            * that the database returns 404 not found when checking for existing job
-            * that the get_job_response is called once
-            * that a new job is created in the database (post_job is called once)
+            * that the job is created in the database (create_or_get_job is called once and reports created)
             * that a new message is published to the queue (publish_message is called once)
             * that the response contains the job id
         """
-        # Mock the response object to return 404 when running GET request.
-        request = Request("GET", f"http://example.com/{job_id}")
-        response_404 = Response(status_code=404, request=request)
-        mock_get_job.return_value = response_404
-
-        # Mock the post_job object to return the 200 and json object
-        res = MetaDataDbPostResponse(job_id="123", status=TaskStatus.QUEUED)
-        mock_post_job.return_value = res
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED), True)
 
         # Run the test
         response = client.post("/submit", json={"fasta": valid_fasta})
         assert response.status_code == 200
-        mock_get_job.assert_called()
-        mock_post_job.assert_called_once()
+        assert response.json() == {"job_id": job_id, "status": TaskStatus.QUEUED}
+        mock_create_or_get_job.assert_called_once()
         mock_publish.assert_called_once()
 
     @pytest.mark.asyncio
-    @patch("api.handlers.db.MetaDataDb.post_job", new_callable=AsyncMock)
-    @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
     @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
     async def test_submit_existing_data(
         self,
         mock_publish: MagicMock,
-        mock_get_job: MagicMock,
-        mock_post_job: MagicMock,
+        mock_create_or_get_job: MagicMock,
         client: AsyncMock,
         valid_fasta: str,
         job_id: str,
@@ -81,19 +88,12 @@ class TestApi:
         """User sends POST:/submit with the fasta blob that already is in the database.
 
         We expect
-            * that the database returns 200 with the job status
+            * that the database returns the stored job, not created by this request
             * that the response contains the job id and status
-            * that the get_job_response is called once
-            * that no new job is created in the database (post_job is not called)
             * that no new message is published to the queue (publish_message is not called)
 
         """
-        # Mock the response object to return 200 when running GET request.
-        request = Request("GET", f"http://example.com/{job_id}")
-        content = json.dumps({"job_id": job_id, "status": "RUNNING"})
-        encoded = content.encode("utf-8")
-        response_200 = Response(status_code=200, request=request, content=encoded)
-        mock_get_job.return_value = response_200
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.RUNNING), False)
 
         # Run the test
         response = client.post("/submit", json={"fasta": valid_fasta})
@@ -102,10 +102,69 @@ class TestApi:
         data = response.json()
         assert data["job_id"] == job_id
         assert data["status"] == TaskStatus.RUNNING
-        mock_get_job.assert_called_once()
-        mock_post_job.assert_not_called()
+        mock_create_or_get_job.assert_called_once()
         mock_publish.assert_not_called()
 
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(
+        "status", [TaskStatus.EXPIRED, TaskStatus.FINISHED, TaskStatus.CANCELLED, TaskStatus.FAILED]
+    )
+    @patch("api.handlers.db.MetaDataDb.requeue_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    async def test_submit_evicted_data(
+        self,
+        mock_publish: MagicMock,
+        mock_create_or_get_job: MagicMock,
+        mock_requeue_job: MagicMock,
+        status: TaskStatus,
+        client: AsyncMock,
+        valid_fasta: str,
+        job_id: str,
+    ):
+        """User sends POST:/submit with the fasta blob of a job whose results were evicted.
+
+        We expect
+            * that the database returns the stored job with the EXPIRED, CANCELLED or FAILED status, or FINISHED
+              without a result file
+            * that the job is published to the queue again
+            * that the job is requeued in the database (requeue_job is called once), before it is published, the
+              worker does not claim a job that is not QUEUED
+            * that the response contains the QUEUED status
+        """
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=status), False)
+        mock_requeue_job.return_value = MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.QUEUED)
+        mock_publish.side_effect = lambda _: mock_requeue_job.assert_called_once()
+
+        response = client.post("/submit", json={"fasta": valid_fasta})
+        assert response.status_code == 200
+        assert response.json()["status"] == TaskStatus.QUEUED
+        mock_publish.assert_called_once()
+        mock_requeue_job.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.expire_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.requeue_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message")
+    async def test_submit_evicted_data_queue_error_expires_job(
+        self, mock_publish, mock_create_or_get_job, mock_requeue_job, mock_expire_job, client, valid_fasta, job_id
+    ):
+        """User sends POST:/submit of a job whose results were evicted, publishing the requeued job fails.
+
+        We expect
+            * that the error is returned to the user
+            * that the requeued job is marked EXPIRED again, so the next submission publishes it
+        """
+        mock_publish.side_effect = HTTPException(status_code=500, detail="Failed to publish message to queue.")
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.EXPIRED), False)
+        mock_requeue_job.return_value = MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.QUEUED)
+
+        response = client.post("/submit", json={"fasta": valid_fasta})
+        assert response.status_code == 500
+        mock_requeue_job.assert_called_once()
+        mock_expire_job.assert_called_once()
+
     @pytest.mark.asyncio
     async def test_submit_invalid_fasta(self, client, invalid_fasta):
         """User sends POST:/submit with an invalid fasta blob (empty sequence)."""
@@ -117,60 +176,109 @@ class TestApi:
     # 4. User submits the fasta blob and the queue raises UnroutableError
     @pytest.mark.asyncio
     @pytest.mark.xfail(reason="UnroutableError error has to be handled securely, so the connection is closed properly.")
-    @patch("api.handlers.db.MetaDataDb.post_job", new_callable=AsyncMock)
-    @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.expire_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
     @patch("api.handlers.broker.BlockingQueueConnection.publish_message")
     async def test_submit_queue_unroutable(
-        self, mock_publish, mock_get_job, mock_post_job, client, valid_fasta, job_id
+        self, mock_publish, mock_create_or_get_job, mock_expire_job, client, valid_fasta, job_id
     ):
         from api.handlers.broker import UnroutableError
 
         # Raise the UnroutableError when publishing the message to the queue
         mock_publish.side_effect = UnroutableError([])
-
-        # Mock the response object to return 404 when running GET request.
-        request = Request("GET", f"http://example.com/{job_id}")
-        response_404 = Response(status_code=404, request=request)
-        mock_get_job.return_value = response_404
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED), True)
 
         # Run the test
         response = client.post("/submit", json={"fasta": valid_fasta})
         assert response.status_code == 500
         assert "failed to publish message to queue" in response.text
         assert mock_publish.call_count == 1
-        assert mock_get_job.call_count == 1
-        assert mock_post_job.call_count == 0
+        assert mock_create_or_get_job.call_count == 1
+        assert mock_expire_job.call_count == 1
 
     @pytest.mark.asyncio
-    @patch("api.handlers.db.MetaDataDb.post_job", new_callable=AsyncMock)
-    @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.expire_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
     @patch("api.handlers.broker.BlockingQueueConnection.publish_message")
-    async def test_submit_db_post_error(self, mock_publish, mock_get_job, mock_post_job, client, valid_fasta, job_id):
-        """User sends POST:/submit with the fasta blob and the database endpoint fails with error code other than 200.
+    async def test_submit_queue_error_expires_job(
+        self, mock_publish, mock_create_or_get_job, mock_expire_job, client, valid_fasta, job_id
+    ):
+        """User sends POST:/submit, the job is created but publishing it to the queue fails.
 
         We expect
-            * that the database returns 404 not found when checking for existing job
-            * that the get_job_response is called once with 500 error
-            * that no new job is created in the database (post_job is not called)
-            * that no new message is published to the queue (publish_message is not called)
+            * that the error is returned to the user
+            * that the created job is marked EXPIRED, so the next submission publishes it again
         """
-        # Mock the response object to return 404 when running GET request.
-        request = Request("GET", f"http://example.com/{job_id}")
-        response_500 = Response(status_code=500, request=request)
-        mock_get_job.return_value = response_500
+        mock_publish.side_effect = HTTPException(status_code=500, detail="Failed to publish message to queue.")
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED), True)
 
-        # get the job_id
-        import hashlib
+        response = client.post("/submit", json={"fasta": valid_fasta})
+        assert response.status_code == 500
+        mock_expire_job.assert_called_once()
 
-        job_id = hashlib.md5(valid_fasta.encode("utf-8")).hexdigest()
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message")
+    async def test_submit_db_error(self, mock_publish, mock_create_or_get_job, client, valid_fasta, job_id):
+        """User sends POST:/submit with the fasta blob and the database endpoint fails with error code other than 200.
+
+        We expect
+            * that the create_or_get_job is called once and fails with 500
+            * that no new message is published to the queue (publish_message is not called)
+        """
+        mock_create_or_get_job.side_effect = HTTPException(
+            status_code=500, detail=f"Unexpected error while creating job {job_id}."
+        )
 
         # Run the test
         response = client.post("/submit", json={"fasta": valid_fasta})
         assert response.status_code == 500
-        assert f"Failed fetching {job_id} from database." in response.text
+        assert f"Unexpected error while creating job {job_id}." in response.text
         assert mock_publish.call_count == 0
-        assert mock_get_job.call_count == 1
-        assert mock_post_job.call_count == 0
+        assert mock_create_or_get_job.call_count == 1
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    async def test_submit_concurrent_identical_submissions_coalesced(
+        self, mock_publish, mock_create_or_get_job, client, valid_fasta, job_id
+    ):
+        """Concurrent submissions of the same fasta blob send one request to the database and publish once."""
+
+        async def create_or_get_job(data):
+            await asyncio.sleep(0.05)
+            return MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED), True
+
+        mock_create_or_get_job.side_effect = create_or_get_job
+        async with AsyncClient(transport=ASGITransport(app=client.app), base_url="http://test") as async_client:
+            responses = await asyncio.gather(
+                *(async_client.post("/submit", json={"fasta": valid_fasta}) for _ in range(4))
+            )
+
+        assert [r.status_code for r in responses] == [200] * 4
+        assert mock_create_or_get_job.call_count == 1
+        mock_publish.assert_called_once()
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    async def test_submit_keyed_by_db_version(
+        self, mock_publish, mock_create_or_get_job, tmp_static_client, tmp_path, valid_fasta, job_id
+    ):
+        """The job id of a submission depends on the target database version published by the worker."""
+        (tmp_path / ".db_version").write_text("2025_01\n")
+
+        def create_or_get_job(data):
+            return MetaDataDbGetResponse(job_id=data.job_id, status=TaskStatus.QUEUED), True
+
+        mock_create_or_get_job.side_effect = create_or_get_job
+        response = tmp_static_client.post("/submit", json={"fasta": valid_fasta})
+
+        assert response.status_code == 200
+        assert response.json()["job_id"] != job_id
+        message = json.loads(mock_publish.call_args.args[0])
+        assert message["job_id"] == response.json()["job_id"]
+        assert message["db_version"] == "2025_01"
 
     @pytest.mark.asyncio
     @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
@@ -217,6 +325,29 @@ class TestApi:
         assert data["status"] == TaskStatus.RUNNING
         mock_get_job.assert_called_once()
 
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
+    async def test_status_finished_with_summary(self, mock_get_job, client, job_id):
+        """User sends GET:/status/{job_id} for a finished job and gets the summary of its result."""
+        summary = {
+            "queries": 1,
+            "hits": 2,
+            "per_query": {
+                "q1": {"hits": 2, "best": {"target": "P12345", "evalue": 1e-50, "bits": 230.0, "identity": 0.98}}
+            },
+            "evalue": {"<=1e-50": 1, ">1": 1},
+            "identity": {"0.9-1.0": 1, "0.3-0.4": 1},
+        }
+        content = json.dumps({"job_id": job_id, "status": "FINISHED", "summary": summary})
+        mock_get_job.return_value = Response(
+            status_code=200, request=Request("GET", f"http://example.com/{job_id}"), content=content.encode("utf-8")
+        )
+
+        response = client.get(f"/status/{job_id}")
+        assert response.status_code == 200
+        # the summaries stored before per_query was capped are complete
+        assert response.json()["summary"] == summary | {"per_query_truncated": False}
+
     @pytest.mark.asyncio
     @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
     async def test_status_db_error(self, mock_get_job, client, job_id):
@@ -254,3 +385,349 @@ class TestApi:
         assert response.status_code == 200
         assert response.headers["content-type"] == "text/plain; charset=utf-8"
         assert "some content" in response.text
+
+    def test_static_files_serving_touches_access_time(self, client, static_files: Path):
+        """Test /results/{job_id} endpoint refreshes the access time used by the result retention."""
+        static = static_files / "sequence.m8"
+        mtime = static.stat().st_mtime
+        os.utime(static, (0, mtime))
+
+        response = client.get("/results/sequence")
+        assert response.status_code == 200
+        assert static.stat().st_atime > 0
+        assert static.stat().st_mtime == mtime
+
+    def test_compressed_results_passed_through(self, tmp_static_client, tmp_path: Path):
+        """Test /results/{job_id} sends the gzip compressed results as stored to clients accepting gzip."""
+        compressed = gzip.compress(b"q1\tt1\t1.000\n")
+        (tmp_path / "job.m8.gz").write_bytes(compressed)
+
+        with tmp_static_client.stream("GET", "/results/job", headers={"Accept-Encoding": "gzip"}) as response:
+            raw = b"".join(response.iter_raw())
+        assert response.status_code == 200
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert raw == compressed
+
+    def test_compressed_results_decompressed_for_identity(self, tmp_static_client, tmp_path: Path):
+        """Test /results/{job_id} decompresses the results for clients not accepting gzip."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tt1\t1.000\n"))
+
+        response = tmp_static_client.get("/results/job", headers={"Accept-Encoding": "identity"})
+        assert response.status_code == 200
+        assert "content-encoding" not in response.headers
+        assert response.headers["content-type"] == "text/plain; charset=utf-8"
+        assert response.text == "q1\tt1\t1.000\n"
+
+    def test_partial_results_of_running_job(self, tmp_static_client, tmp_path: Path):
+        """Test /results/{job_id} serves the hits of the queries done while the job runs."""
+        partial_dir = tmp_path / ".partial" / "job"
+        partial_dir.mkdir(parents=True)
+        # the hits of the step in progress are not counted in the progress yet
+        (partial_dir / "hits.m8").write_bytes(b"q1\tt1\n" + b"q2\tt")
+        (partial_dir / "progress.json").write_text(json.dumps({"queries_done": 1, "queries_total": 2, "bytes": 6}))
+
+        response = tmp_static_client.get("/results/job")
+        assert response.status_code == 200
+        assert response.text == "q1\tt1\n"
+        assert response.headers["x-result-complete"] == "false"
+        assert response.headers["x-queries-done"] == "1"
+        assert response.headers["x-queries-total"] == "2"
+
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tt1\nq2\tt2\n"))
+        response = tmp_static_client.get("/results/job", headers={"Accept-Encoding": "identity"})
+        assert response.text == "q1\tt1\nq2\tt2\n"
+        assert response.headers["x-result-complete"] == "true"
+
+    def test_results_in_existing_output_format(self, tmp_static_client, tmp_path: Path):
+        """Test /results/{job_id}?format= serves the result already generated in the output format."""
+        output = OutputFormatModel(job_id="job", format_output="query,qaln")
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tt1\n"))
+        (tmp_path / f"job.{output.format_id}.m8.gz").write_bytes(gzip.compress(b"q1\tMKT\n"))
+
+        response = tmp_static_client.get("/results/job", params={"format": "query,qaln"})
+        assert response.status_code == 200
+        assert response.text == "q1\tMKT\n"
+
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    def test_results_output_format_requested(self, mock_publish: MagicMock, tmp_static_client, tmp_path: Path):
+        """Test /results/{job_id}?format= asks the worker for the output format once and returns 202 until it is there."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tt1\n"))
+        (tmp_path / "alignments" / "job").mkdir(parents=True)
+
+        mock_publish.side_effect = HTTPException(status_code=500, detail="Failed to publish message to queue.")
+        response = tmp_static_client.get("/results/job", params={"format": "query,qaln"})
+        assert response.status_code == 500
+        mock_publish.side_effect = None
+
+        for _ in range(2):
+            response = tmp_static_client.get("/results/job", params={"format": "query,qaln"})
+            assert response.status_code == 202
+            assert response.headers["retry-after"] == "5"
+            assert response.json() == {"job_id": "job", "status": TaskStatus.QUEUED}
+        # the failed publish and the first poll, the second poll waits for the pending task
+        assert mock_publish.call_count == 2
+        message = json.loads(mock_publish.call_args.args[0])
+        assert message["task"] == "convertalis"
+        assert message["format_output"] == "query,qaln"
+
+        format_id = OutputFormatModel(job_id="job", format_output="query,qaln").format_id
+        (tmp_path / f"job.{format_id}.m8.gz").write_bytes(gzip.compress(b"q1\tMKT\n"))
+        response = tmp_static_client.get("/results/job", params={"format": "query,qaln"})
+        assert response.status_code == 200
+        assert not (tmp_path / ".pending" / "job" / format_id).exists()
+
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    def test_results_output_format_alignment_expired(self, mock_publish: MagicMock, tmp_static_client, tmp_path):
+        """Test /results/{job_id}?format= returns 410 when the alignment DB is gone."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tt1\n"))
+
+        response = tmp_static_client.get("/results/job", params={"format": "query,qaln"})
+        assert response.status_code == 410
+        mock_publish.assert_not_called()
+
+    def test_results_output_format_invalid(self, tmp_static_client):
+        """Test /results/{job_id}?format= rejects unknown columns."""
+        response = tmp_static_client.get("/results/job", params={"format": "query,foo"})
+        assert response.status_code == 422
+        assert "Unknown output columns: foo." in response.text
+
+    def test_hit_sequence(self, target_db_client, tmp_path: Path):
+        """Test /results/{job_id}/hits/{target}/sequence returns the FASTA record of the target."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tsp|P12345|AATM_RABIT\n"))
+
+        response = target_db_client.get("/results/job/hits/sp|P12345|AATM_RABIT/sequence")
+        assert response.status_code == 200
+        assert response.text == ">sp|P12345|AATM_RABIT Aspartate aminotransferase\nMALLHSGRVLPG\n"
+
+        response = target_db_client.get("/results/job/hits/P99999/sequence")
+        assert response.status_code == 404
+        response = target_db_client.get("/results/other/hits/P12345/sequence")
+        assert response.status_code == 404
+
+    def test_hit_sequences_bulk(self, target_db_client, tmp_path: Path):
+        """Test /results/{job_id}/hits/sequences returns the FASTA records of the targets found."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tP12345\n"))
+
+        response = target_db_client.post("/results/job/hits/sequences", json={"targets": ["A0A000", "X", "P12345"]})
+        assert response.status_code == 200
+        assert response.text.count(">") == 2
+        assert response.text.startswith(">tr|A0A000|")
+        assert response.headers["x-targets-missing"] == "1"
+
+        response = target_db_client.post("/results/job/hits/sequences", json={"targets": []})
+        assert response.status_code == 422
+
+    def test_hit_sequences_without_target_db(self, tmp_static_client, tmp_path: Path):
+        """Test the hit sequences are not served when the api has no target database."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tP12345\n"))
+
+        response = tmp_static_client.get("/results/job/hits/P12345/sequence")
+        assert response.status_code == 404
+        assert "no target database" in response.text
+
+    def test_hit_sequence_from_the_version_of_the_job(self, versioned_target_db_client, tmp_path: Path):
+        """Test the hit sequences are read from the version of the target database the job was searched against."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tP12345\n"))
+        (tmp_path / "alignments" / "job").mkdir(parents=True)
+        (tmp_path / "alignments" / "job" / "db_version").write_text("2025_01")
+        (tmp_path / ".db_version").write_text("2025_02\n")
+
+        response = versioned_target_db_client.get("/results/job/hits/P12345/sequence")
+        assert response.status_code == 200
+        assert response.text == ">sp|P12345|AATM_RABIT Aspartate aminotransferase\nMALLHSGRVLPG\n"
+
+        # the alignment DB expired, the current version is not prepared on the api yet
+        (tmp_path / "alignments" / "job" / "db_version").unlink()
+        response = versioned_target_db_client.post("/results/job/hits/sequences", json={"targets": ["P12345"]})
+        assert response.status_code == 404
+        assert "Version 2025_02 of the target database is not available." in response.text
+
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    def test_pair_alignments(self, mock_publish: MagicMock, tmp_static_client, tmp_path: Path):
+        """Test /results/{job_id}/alignments asks the worker once for the pairs not cached, then serves them."""
+        (tmp_path / "job.m8.gz").write_bytes(gzip.compress(b"q1\tt1\n"))
+        (tmp_path / "alignments" / "job").mkdir(parents=True)
+        cache = tmp_path / ".pair_alignments" / "job"
+        cache.mkdir(parents=True)
+        (cache / f"{pair_id('q1', 't1')}.json").write_text(json.dumps({"query": "q1", "target": "t1", "found": True}))
+        pairs = [{"query": "q1", "target": "t1"}, {"query": "q1", "target": "t2"}]
+
+        response = tmp_static_client.post("/results/job/alignments", json={"pairs": pairs})
+        assert response.status_code == 202
+        assert response.json()["pending"] == 1
+        message = json.loads(mock_publish.call_args.args[0])
+        assert message == {"job_id": "job", "task": "align", "pairs": [{"query": "q1", "target": "t2"}]}
+
+        # the pending pair is not published again, only the new one
+        pairs.append({"query": "q2", "target": "t1"})
+        response = tmp_static_client.post("/results/job/alignments", json={"pairs": pairs})
+        assert response.status_code == 202
+        assert response.json()["pending"] == 2
+        message = json.loads(mock_publish.call_args.args[0])
+        assert message["pairs"] == [{"query": "q2", "target": "t1"}]
+        response = tmp_static_client.post("/results/job/alignments", json={"pairs": pairs})
+        assert response.status_code == 202
+        assert mock_publish.call_count == 2
+
+        (cache / f"{pair_id('q2', 't1')}.json").write_text(json.dumps({"query": "q2", "target": "t1", "found": True}))
+        (cache / f"{pair_id('q1', 't2')}.json").write_text(json.dumps({"query": "q1", "target": "t2", "found": False}))
+        response = tmp_static_client.post("/results/job/alignments", json={"pairs": pairs})
+        assert response.status_code == 200
+        assert [alignment["found"] for alignment in response.json()["alignments"]] == [True, False, True]
+        assert mock_publish.call_count == 2
+        assert not any((tmp_path / ".pending" / "job").iterdir())
+
+        response = tmp_static_client.post("/results/other/alignments", json={"pairs": pairs})
+        assert response.status_code == 404
+
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    def test_pair_alignments_realigned_with_the_fasta(
+        self, mock_publish: MagicMock, tmp_static_client, tmp_path: Path, valid_fasta
+    ):
+        """Test /results/{job_id}/alignments needs the fasta of the job once its alignment DB expired."""
+        job_id = FastaBlobModel(fasta=valid_fasta).job_id
+        (tmp_path / f"{job_id}.m8.gz").write_bytes(gzip.compress(b"q1\tt1\n"))
+        pairs = [{"query": "q1", "target": "t1"}]
+
+        response = tmp_static_client.post(f"/results/{job_id}/alignments", json={"pairs": pairs})
+        assert response.status_code == 410
+        response = tmp_static_client.post(f"/results/{job_id}/alignments", json={"pairs": pairs, "fasta": ">x\nMKV\n"})
+        assert response.status_code == 422
+        mock_publish.assert_not_called()
+
+        response = tmp_static_client.post(f"/results/{job_id}/alignments", json={"pairs": pairs, "fasta": valid_fasta})
+        assert response.status_code == 202
+        message = json.loads(mock_publish.call_args.args[0])
+        assert message["fasta"] == valid_fasta
+        assert message["db_version"] is None
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("status", [TaskStatus.QUEUED, TaskStatus.RUNNING])
+    @patch("api.handlers.db.MetaDataDb.cancel_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.get_job", new_callable=AsyncMock)
+    async def test_cancel_job(self, mock_get_job, mock_cancel_job, status, client, job_id):
+        """User sends DELETE:/jobs/{job_id} for a queued or running job, which is marked CANCELLED."""
+        mock_get_job.return_value = MetaDataDbGetResponse(job_id=job_id, status=status)
+        mock_cancel_job.return_value = MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.CANCELLED)
+
+        response = client.delete(f"/jobs/{job_id}")
+        assert response.status_code == 200
+        assert response.json() == {"job_id": job_id, "status": TaskStatus.CANCELLED}
+        mock_cancel_job.assert_called_once_with(job_id)
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize(("status", "code"), [(TaskStatus.CANCELLED, 200), (TaskStatus.FINISHED, 409)])
+    @patch("api.handlers.db.MetaDataDb.cancel_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.get_job", new_callable=AsyncMock)
+    async def test_cancel_job_not_cancellable(self, mock_get_job, mock_cancel_job, status, code, client, job_id):
+        """User sends DELETE:/jobs/{job_id} for a cancelled or finished job, its status is left as it is."""
+        mock_get_job.return_value = MetaDataDbGetResponse(job_id=job_id, status=status)
+
+        response = client.delete(f"/jobs/{job_id}")
+        assert response.status_code == code
+        mock_cancel_job.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.list_jobs", new_callable=AsyncMock)
+    async def test_list_jobs(self, mock_list_jobs, client, job_id):
+        """User sends GET:/jobs with filters, they are passed to the metadata db with the cursor of the page."""
+        mock_list_jobs.return_value = JobListResponse(
+            jobs=[MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.RUNNING)], next_cursor="next"
+        )
+
+        response = client.get(
+            "/jobs", params={"status": "RUNNING", "submitted_before": "2025-09-16T09:00:00", "cursor": "page2"}
+        )
+        assert response.status_code == 200
+        assert response.json() == {"jobs": [{"job_id": job_id, "status": "RUNNING"}], "next_cursor": "next"}
+        [filters] = mock_list_jobs.call_args.args
+        assert filters.status == [TaskStatus.RUNNING]
+        assert filters.cursor == "page2"
+        assert filters.limit == 100
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("params", [{"status": "UNKNOWN"}, {"limit": 0}, {"limit": 1001}])
+    @patch("api.handlers.db.MetaDataDb.list_jobs", new_callable=AsyncMock)
+    async def test_list_jobs_invalid_filters(self, mock_list_jobs, params, client):
+        """User sends GET:/jobs with an unknown status or a page size out of range, which is rejected."""
+        response = client.get("/jobs", params=params)
+        assert response.status_code == 422
+        mock_list_jobs.assert_not_called()
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.expire_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.queue_depth")
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    async def test_submit_rejected_when_queue_backs_up(
+        self,
+        mock_publish,
+        mock_queue_depth,
+        mock_create_or_get_job,
+        mock_expire_job,
+        admission_client,
+        valid_fasta,
+        job_id,
+    ):
+        """User sends POST:/submit while more jobs are queued than the limit.
+
+        We expect
+            * that the submission is rejected with 429 and the time to drain the excess jobs in Retry-After
+            * that the job is not published and the created job is marked EXPIRED, the next submission publishes it
+            * that the submission of a job already in the database is not rejected
+        """
+        client = admission_client
+        mock_queue_depth.return_value = (5, 2)
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.QUEUED), True)
+
+        response = client.post("/submit", json={"fasta": valid_fasta})
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "90"
+        mock_publish.assert_not_called()
+        mock_expire_job.assert_called_once()
+
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.RUNNING), False)
+        response = client.post("/submit", json={"fasta": valid_fasta})
+        assert response.status_code == 200
+
+    @pytest.mark.asyncio
+    @patch("api.handlers.db.MetaDataDb.expire_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.requeue_job", new_callable=AsyncMock)
+    @patch("api.handlers.db.MetaDataDb.create_or_get_job", new_callable=AsyncMock)
+    @patch("api.handlers.broker.BlockingQueueConnection.queue_depth")
+    @patch("api.handlers.broker.BlockingQueueConnection.publish_message", new_callable=MagicMock)
+    async def test_submit_rejected_over_client_in_flight_limit(
+        self,
+        mock_publish,
+        mock_queue_depth,
+        mock_create_or_get_job,
+        mock_requeue_job,
+        mock_expire_job,
+        in_flight_client,
+        tmp_path,
+        valid_fasta,
+        job_id,
+    ):
+        """User submits a second job while the first one is in flight, the limit of the client being 1.
+
+        We expect
+            * that the second submission is rejected with 429
+            * that a job whose requeue fails to publish no longer counts in flight
+            * that a job whose final results were served no longer counts in flight
+        """
+        client = in_flight_client
+        mock_queue_depth.return_value = (0, 1)
+        mock_create_or_get_job.return_value = (MetaDataDbGetResponse(job_id=job_id, status=TaskStatus.EXPIRED), False)
+        mock_requeue_job.return_value = MetaDataDbPostResponse(job_id=job_id, status=TaskStatus.QUEUED)
+
+        mock_publish.side_effect = HTTPException(status_code=500, detail="Failed to publish message to queue.")
+        assert client.post("/submit", json={"fasta": valid_fasta}).status_code == 500
+        mock_publish.side_effect = None
+        assert client.post("/submit", json={"fasta": valid_fasta}).status_code == 200
+        first_job_id = mock_create_or_get_job.call_args.args[0].job_id
+        assert client.post("/submit", json={"fasta": ">seq2\nMKT\n"}).status_code == 429
+
+        (tmp_path / f"{first_job_id}.m8").write_text("q1\tt1\t1.000\n")
+        assert client.get(f"/results/{first_job_id}").status_code == 200
+        assert client.post("/submit", json={"fasta": ">seq2\nMKT\n"}).status_code == 200
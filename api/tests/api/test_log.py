@@ -0,0 +1,63 @@
+"""Logging tests."""
+
+import io
+import threading
+
+from loguru import logger
+
+from api.log import Payload, QueueSink, configure_logging
+
+
+def test_sampled_logs_are_written_by_the_writer_thread():
+    """A burst of each call site is written, the next record logged carries the number suppressed."""
+    now = [0.0]
+    stream = io.StringIO()
+    sink = configure_logging(queue_size=100, sample_burst=2, sample_seconds=10, stream=stream)
+    assert sink is not None
+    sampling = logger._core.handlers[max(logger._core.handlers)]._filter
+    sampling.clock = lambda: now[0]
+    try:
+        for i in range(7):
+            if i == 5:
+                logger.warning("Job {} failed", i)
+                now[0] = 10
+                continue
+            logger.info("Job {} done", i)
+        logger.info("Received {}", Payload({"job_id": "job1", "fasta": ">q1\nMKT\n>q2\nMKT\n"}))
+    finally:
+        sink.stop()
+        logger.remove()
+
+    lines = stream.getvalue().splitlines()
+    assert [line.split(" - ")[1] for line in lines] == [
+        "Job 0 done",
+        "Job 1 done",
+        "Job 5 failed",
+        "Job 6 done (3 similar messages suppressed)",
+        "Received {job_id=job1, fasta=<2 queries, 16 bytes>}",
+    ]
+
+
+def test_full_queue_drops_the_messages():
+    """The messages that do not fit in the queue are dropped instead of blocking the caller."""
+    written = threading.Event()
+    release = threading.Event()
+
+    class SlowStream(io.StringIO):
+        def write(self, message: str) -> int:
+            written.set()
+            release.wait()
+            return super().write(message)
+
+    stream = SlowStream()
+    sink = QueueSink(stream, maxsize=1)
+    sink("first\n")
+    # the writer thread holds the first message, the second one waits in the queue
+    assert written.wait(5)
+    sink("second\n")
+    sink("third\n")
+    assert sink.dropped == 1
+
+    release.set()
+    sink.stop()
+    assert stream.getvalue() == "first\nsecond\n"
@@ -0,0 +1,43 @@
+"""Test prometheus metrics."""
+
+from unittest.mock import AsyncMock, patch
+
+from fastapi.testclient import TestClient
+from httpx import Request, Response
+from prometheus_client import REGISTRY
+
+
+def _sample(name: str, **labels: str) -> float:
+    """Get the current value of the sample, 0 when it was not observed yet."""
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+class TestMetrics:
+    """Test the /metrics endpoint and the request latency middleware."""
+
+    def test_metrics_endpoint(self, client: TestClient):
+        """The /metrics endpoint serves the prometheus text format."""
+        response = client.get("/metrics/")
+        assert response.status_code == 200
+        assert "api_request_latency_seconds" in response.text
+        assert "api_queue_publish_latency_seconds" in response.text
+        assert "api_metadb_request_latency_seconds" in response.text
+
+    @patch("api.handlers.db.MetaDataDb.get_job_response", new_callable=AsyncMock)
+    def test_status_latency_is_observed(self, mock_get_job: AsyncMock, client: TestClient, job_id: str):
+        """Requests to the /status endpoint are observed, also when the job is not found."""
+        request = Request("GET", f"http://example.com/{job_id}")
+        mock_get_job.return_value = Response(status_code=404, request=request)
+
+        before = _sample("api_request_latency_seconds_count", endpoint="status")
+        response = client.get(f"/status/{job_id}")
+        assert response.status_code == 404
+        assert _sample("api_request_latency_seconds_count", endpoint="status") == before + 1
+
+    def test_unknown_route_is_not_observed(self, client: TestClient):
+        """Requests to the routes outside of the api endpoints are not observed."""
+        before = {e: _sample("api_request_latency_seconds_count", endpoint=e) for e in ("submit", "status", "results")}
+        response = client.get("/non/existing/route")
+        assert response.status_code == 404
+        after = {e: _sample("api_request_latency_seconds_count", endpoint=e) for e in ("submit", "status", "results")}
+        assert before == after
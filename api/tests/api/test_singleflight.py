@@ -0,0 +1,59 @@
+"""Single-flight tests."""
+
+import asyncio
+
+import pytest
+
+from api.singleflight import SingleFlight
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_with_the_same_key_share_the_result():
+    """Concurrent calls with the same key run once, other keys run separately."""
+    flight = SingleFlight()
+    calls = []
+
+    async def fn(key: str) -> str:
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return key.upper()
+
+    results = await asyncio.gather(
+        flight.do("a", lambda: fn("a")), flight.do("a", lambda: fn("a")), flight.do("b", lambda: fn("b"))
+    )
+    assert results == ["A", "A", "B"]
+    assert calls == ["a", "b"]
+    assert not flight.in_flight("a")
+
+    # the key is released once the call is done
+    assert await flight.do("a", lambda: fn("a")) == "A"
+    assert calls == ["a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_exception_raised_to_every_caller():
+    """The exception of the call is raised to all the callers."""
+    flight = SingleFlight()
+
+    async def fn() -> None:
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(flight.do("a", fn), flight.do("a", fn), return_exceptions=True)
+    assert [type(r) for r in results] == [ValueError, ValueError]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_caller_does_not_cancel_the_call():
+    """A cancelled caller leaves the call running for the other callers."""
+    flight = SingleFlight()
+
+    async def fn() -> str:
+        await asyncio.sleep(0.05)
+        return "done"
+
+    first = asyncio.ensure_future(flight.do("a", fn))
+    second = asyncio.ensure_future(flight.do("a", fn))
+    await asyncio.sleep(0.01)
+    first.cancel()
+    assert await second == "done"
@@ -0,0 +1,89 @@
+"""Test request tracing."""
+
+import json
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from api.handlers.broker import BlockingQueueConnection
+from api.tracing import TRACEPARENT_HEADER, FileSpanExporter, Span, SpanExporter, Tracer, current_span
+
+
+class ListSpanExporter(SpanExporter):
+    """Exporter collecting the spans in memory."""
+
+    def __init__(self) -> None:
+        self.spans: list[Span] = []
+
+    def export(self, span: Span) -> None:
+        self.spans.append(span)
+
+
+@pytest.fixture
+def exporter() -> ListSpanExporter:
+    return ListSpanExporter()
+
+
+class TestTracer:
+    """Test span creation and parenting."""
+
+    def test_nested_spans_share_trace(self, exporter: ListSpanExporter):
+        """Nested spans are parented by the enclosing span and exported in the finish order."""
+        tracer = Tracer("test", exporter)
+        with tracer.start_span("outer") as outer:
+            assert current_span() is outer
+            with tracer.start_span("inner", job_id="1") as inner:
+                assert current_span() is inner
+        assert current_span() is None
+
+        assert [s.name for s in exporter.spans] == ["inner", "outer"]
+        assert inner.trace_id == outer.trace_id
+        assert inner.parent_id == outer.span_id
+        assert outer.parent_id is None
+        assert inner.attributes == {"job_id": "1"}
+        assert outer.end_time is not None
+        assert outer.end_time >= outer.start_time
+
+    def test_remote_parent(self, exporter: ListSpanExporter):
+        """The traceparent header takes precedence over the current span."""
+        tracer = Tracer("test", exporter)
+        traceparent = "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01"
+        with tracer.start_span("local"), tracer.start_span("remote", traceparent=traceparent) as span:
+            pass
+        assert span.trace_id == "0af7651916cd43dd8448eb211c80319c"
+        assert span.parent_id == "b7ad6b7169203331"
+        assert span.traceparent == f"00-{span.trace_id}-{span.span_id}-01"
+
+    def test_error_is_recorded(self, exporter: ListSpanExporter):
+        """The exception raised within the span is recorded and re-raised."""
+        tracer = Tracer("test", exporter)
+        with pytest.raises(ValueError), tracer.start_span("failing"):
+            raise ValueError("boom")
+        assert exporter.spans[0].attributes["error"] == "ValueError('boom')"
+
+    def test_file_exporter(self, tmp_path: Path):
+        """The file exporter appends the spans as JSON lines."""
+        trace_file = tmp_path / "trace.jsonl"
+        tracer = Tracer("test", FileSpanExporter(trace_file))
+        with tracer.start_span("first"), tracer.start_span("second"):
+            pass
+        spans = [json.loads(line) for line in trace_file.read_text().splitlines()]
+        assert [s["name"] for s in spans] == ["second", "first"]
+        assert all(s["service"] == "test" for s in spans)
+        assert all(s["duration"] >= 0 for s in spans)
+
+
+@patch("api.handlers.broker.pika.BlockingConnection")
+def test_publish_propagates_traceparent(mock_blocking_connection):
+    """The published message carries the traceparent of the publish span."""
+    mock_channel = MagicMock()
+    mock_blocking_connection.return_value.channel.return_value = mock_channel
+
+    broker = BlockingQueueConnection("queue", "user", "pass", 5672, "localhost")
+    broker.publish_message('{"test": 1}')
+
+    properties = mock_channel.basic_publish.call_args.kwargs["properties"]
+    traceparent = properties.headers[TRACEPARENT_HEADER]
+    assert traceparent.startswith("00-")
+    assert len(traceparent.split("-")[1]) == 32
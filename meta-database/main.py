@@ -1,10 +1,18 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
 from contextlib import asynccontextmanager
 import datetime
+import json
+import os
+import threading
+from time import perf_counter, sleep
 from typing import Union, Annotated
 
-from fastapi import Depends, FastAPI, HTTPException
-from sqlmodel import Field, Session, SQLModel, create_engine
-from pydantic import BaseModel
+from fastapi import Depends, FastAPI, HTTPException, Query, Response
+from prometheus_client import Histogram, make_asgi_app
+from sqlalchemy import JSON, Column, ColumnElement, Engine, and_, event, inspect, or_, text, tuple_, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import Field, Session, SQLModel, create_engine, select
+from pydantic import BaseModel, PositiveFloat
 
 
 class Job(SQLModel, table=True):
@@ -12,6 +20,15 @@ class Job(SQLModel, table=True):
     status: str
     submitted_at: Union[str, None] = None
     completed_at: Union[str, None] = None
+    # job split into chunks by the worker, set on its chunks
+    parent_id: Union[str, None] = Field(default=None, index=True)
+    # hit counts, best hits and distributions of the result, set by the worker on FINISHED
+    summary: Union[dict, None] = Field(default=None, sa_column=Column(JSON))
+    # reason of a FAILED job (e.g. a limit it exceeded), set by the worker
+    error: Union[str, None] = None
+    # worker searching the RUNNING job, until its lease expires unless renewed
+    owner: Union[str, None] = None
+    lease_expires_at: Union[str, None] = None
     # data: Union[object, None] = Field(default=None)
 
 
@@ -22,9 +39,61 @@ connect_args = {"check_same_thread": False}
 engine = create_engine(sqlite_url, connect_args=connect_args)
 
 
+QUERY_LATENCY = Histogram(
+    "metadb_query_latency_seconds",
+    "Latency of the SQLite queries.",
+    labelnames=["statement"],
+)
+GROUP_COMMIT_SIZE = Histogram(
+    "metadb_group_commit_size",
+    "Number of job updates committed in one transaction.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+
+# seconds the first of concurrent job updates waits for the others before committing them together, with 0
+# the updates arriving while a commit runs are still committed together by the next one
+GROUP_COMMIT_WINDOW_SECONDS = float(os.getenv("GROUP_COMMIT_WINDOW_SECONDS", "0"))
+# job updates committed in one transaction at most
+GROUP_COMMIT_MAX_SIZE = int(os.getenv("GROUP_COMMIT_MAX_SIZE", "256"))
+
+
+# Registered on the Engine class, so every engine (including the test ones) is instrumented.
+@event.listens_for(Engine, "before_cursor_execute")
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def observe_query_latency(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_start"].pop()
+    QUERY_LATENCY.labels(statement=statement.split(None, 1)[0].upper()).observe(elapsed)
+
+
 def create_db_and_tables():
     print("Creating database and tables...")
     SQLModel.metadata.create_all(engine)
+    migrate(engine)
+
+
+def migrate(engine: Engine):
+    # create_all does not add the columns added to an existing table
+    columns = {column["name"] for column in inspect(engine).get_columns("job")}
+    with engine.begin() as connection:
+        if "parent_id" not in columns:
+            connection.execute(text("ALTER TABLE job ADD COLUMN parent_id VARCHAR"))
+            connection.execute(text("CREATE INDEX IF NOT EXISTS ix_job_parent_id ON job (parent_id)"))
+        if "summary" not in columns:
+            connection.execute(text("ALTER TABLE job ADD COLUMN summary JSON"))
+        if "error" not in columns:
+            connection.execute(text("ALTER TABLE job ADD COLUMN error VARCHAR"))
+        if "owner" not in columns:
+            connection.execute(text("ALTER TABLE job ADD COLUMN owner VARCHAR"))
+            connection.execute(text("ALTER TABLE job ADD COLUMN lease_expires_at VARCHAR"))
+        # keyset pagination of the listings, newest first, with and without a status filter
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_job_submitted ON job (submitted_at, job_id)"))
+        connection.execute(
+            text("CREATE INDEX IF NOT EXISTS ix_job_status_submitted ON job (status, submitted_at, job_id)")
+        )
 
 
 def get_session():
@@ -35,6 +104,115 @@ def get_session():
 SessionDep = Annotated[Session, Depends(get_session)]
 
 
+# statuses a job may be updated to, with the statuses it may be in then. The updates are conditional, the job is
+# updated only if its status is still one of those when the update is applied
+TRANSITIONS = {
+    # submitted again, or requeued by an operator
+    "QUEUED": ("QUEUED", "EXPIRED", "CANCELLED", "FINISHED", "FAILED"),
+    # claimed by a worker (see claim_job), or a job split into chunks or shards
+    "RUNNING": ("QUEUED", "RUNNING"),
+    "FINISHED": ("RUNNING", "FINISHED"),
+    "FAILED": ("QUEUED", "RUNNING", "FAILED"),
+    "CANCELLED": ("QUEUED", "RUNNING", "CANCELLED"),
+    # not published by the api, or its result evicted by the worker
+    "EXPIRED": ("QUEUED", "FINISHED", "EXPIRED"),
+}
+
+
+class PendingUpdate:
+    def __init__(self, job_id: str, data: dict, condition: Union[ColumnElement, None] = None):
+        self.job_id = job_id
+        self.data = data
+        self.condition = condition
+        self.done = threading.Event()
+        # set when the update is to commit the pending updates itself
+        self.lead = False
+        self.result: Union[Job, None] = None
+        self.error: Union[Exception, None] = None
+
+
+class GroupCommit:
+    """Commits the concurrent job updates together, in one transaction and one fsync.
+
+    The first update to arrive leads: it waits for the window, then applies the pending updates in its own
+    session and commits them. The updates arriving meanwhile wait for that commit, each request is answered only
+    once its update is durable. Updates left pending hand the lead to the first of them.
+
+    Each update is a compare-and-set: an UPDATE of the job conditioned on its current state, a job whose state
+    changed meanwhile is left as it is and the request gets 409 with the status the job is in.
+    """
+
+    def __init__(self, window_seconds: float = GROUP_COMMIT_WINDOW_SECONDS, max_size: int = GROUP_COMMIT_MAX_SIZE):
+        self.window_seconds = window_seconds
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.pending: list[PendingUpdate] = []
+        self.leading = False
+
+    def update(self, session: Session, job_id: str, data: dict, condition: Union[ColumnElement, None] = None) -> Job:
+        pending_update = PendingUpdate(job_id, data, condition)
+        with self.lock:
+            self.pending.append(pending_update)
+            pending_update.lead = not self.leading
+            self.leading = True
+        if pending_update.lead:
+            if self.window_seconds:
+                sleep(self.window_seconds)
+        else:
+            pending_update.done.wait()
+        if pending_update.lead:
+            self.commit_pending(session)
+        if pending_update.error is not None:
+            raise pending_update.error
+        return pending_update.result
+
+    def commit_pending(self, session: Session):
+        with self.lock:
+            batch, self.pending = self.pending[: self.max_size], self.pending[self.max_size :]
+        try:
+            self.apply(session, batch)
+        finally:
+            with self.lock:
+                if self.pending:
+                    self.pending[0].lead = True
+                    self.pending[0].done.set()
+                else:
+                    self.leading = False
+            for pending_update in batch:
+                pending_update.done.set()
+
+    @staticmethod
+    def apply(session: Session, batch: list[PendingUpdate]):
+        GROUP_COMMIT_SIZE.observe(len(batch))
+        try:
+            # the updates of the same job are applied in the order they arrived
+            for pending_update in batch:
+                statement = update(Job).where(Job.job_id == pending_update.job_id)
+                if pending_update.condition is not None:
+                    statement = statement.where(pending_update.condition)
+                row = session.execute(
+                    statement.values(**pending_update.data).returning(*Job.__table__.columns)
+                ).mappings().one_or_none()
+                if row is not None:
+                    pending_update.result = Job.model_validate(dict(row))
+                    continue
+                status = session.execute(select(Job.status).where(Job.job_id == pending_update.job_id)).scalar_one_or_none()
+                if status is None:
+                    pending_update.error = HTTPException(status_code=404, detail="Job not found")
+                else:
+                    pending_update.error = HTTPException(
+                        status_code=409, detail={"message": f"Job is {status}", "status": status}
+                    )
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            for pending_update in batch:
+                pending_update.error, pending_update.result = e, None
+
+
+status_updates = GroupCommit()
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     create_db_and_tables()
@@ -42,12 +220,49 @@ async def lifespan(app: FastAPI):
 
 
 app = FastAPI(lifespan=lifespan)
+app.mount("/metrics", make_asgi_app())
 
 
 class JobCreate(BaseModel):
     job_id: str
 
 
+class JobRegister(BaseModel):
+    parent_id: Union[str, None] = None
+
+
+class JobPage(BaseModel):
+    jobs: list[Job]
+    # cursor of the next page, None on the last page
+    next_cursor: Union[str, None] = None
+
+
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(job: Job) -> str:
+    return urlsafe_b64encode(json.dumps([job.submitted_at, job.job_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        submitted_at, job_id = json.loads(urlsafe_b64decode(cursor.encode()))
+        return str(submitted_at), str(job_id)
+    except (TypeError, ValueError):
+        # not base64, not JSON or not a pair, e.g. a JSON number
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+def timestamp(value: Union[str, datetime.datetime]) -> str:
+    # stored as str(datetime), the listings compare and sort the timestamps as text
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        # the jobs are stamped in the local time of the services
+        value = value.astimezone().replace(tzinfo=None)
+    return str(value)
+
+
 @app.post("/job/", response_model_exclude_none=True)
 async def create_job(job: JobCreate, session: SessionDep) -> Job:
     job_id = job.job_id
@@ -61,22 +276,73 @@ async def create_job(job: JobCreate, session: SessionDep) -> Job:
     return job
 
 
+@app.put("/job/{job_id}", response_model_exclude_none=True)
+def create_or_get_job(
+    job_id: str, session: SessionDep, response: Response, job: Union[JobRegister, None] = None
+) -> Job:
+    # single INSERT ... ON CONFLICT DO NOTHING, concurrent submissions of the same job create it once
+    parent_id = job.parent_id if job else None
+    statement = (
+        insert(Job)
+        .values(job_id=job_id, status="QUEUED", submitted_at=str(datetime.datetime.now()), parent_id=parent_id)
+        .on_conflict_do_nothing(index_elements=["job_id"])
+    )
+    created = session.execute(statement).rowcount == 1
+    session.commit()
+    # 201 when the job was created, 200 when it already existed
+    response.status_code = 201 if created else 200
+    return session.get(Job, job_id)
+
+
 @app.patch("/job/{job_id}", response_model_exclude_none=True)
 def update_job(job_id: str, job: Job, session: SessionDep) -> Job:
-    stored_job = session.get(Job, job_id)
-    if not stored_job:
-        raise HTTPException(status_code=404, detail="Job not found")
-    # TODO: enforce only change queued --> running|failed
-    # TODO: enforce only change running --> failed|finished
-
     job_data = job.model_dump(exclude_unset=True)
-    stored_job.sqlmodel_update(job_data)
-    # if stored_job.status == "FINISHED":
-    #     stored_job.submitted_at = None
-    session.add(stored_job)
-    session.commit()
-    session.refresh(stored_job)
-    return stored_job
+    if job_data.get("submitted_at"):
+        job_data["submitted_at"] = timestamp(job_data["submitted_at"])
+    condition = None
+    if "status" in job_data:
+        if job_data["status"] not in TRANSITIONS:
+            raise HTTPException(status_code=422, detail=f"Unknown status {job_data['status']}")
+        # e.g. a cancelled job is not set RUNNING again by a worker picking it up meanwhile
+        condition = Job.status.in_(TRANSITIONS[job_data["status"]])
+        if job_data["status"] != "RUNNING":
+            job_data.update(owner=None, lease_expires_at=None)
+    if not job_data:
+        return retrieve_job(job_id, session)
+    # committed with the concurrent updates, answered once durable
+    return status_updates.update(session, job_id, job_data, condition)
+
+
+class JobClaim(BaseModel):
+    owner: str
+    lease_seconds: PositiveFloat
+
+
+@app.post("/job/{job_id}/claim", response_model_exclude_none=True)
+def claim_job(job_id: str, claim: JobClaim, session: SessionDep) -> Job:
+    # a worker sets the job RUNNING before searching it, renewing the claim extends its lease. Of two workers
+    # picking up the same job (a redelivered message), only one gets it, the other gets 409 with the status
+    now = datetime.datetime.now()
+    condition = or_(
+        Job.status == "QUEUED",
+        and_(
+            Job.status == "RUNNING",
+            # released for a retry, renewed by its owner, or left by an owner that stopped renewing its lease
+            or_(Job.owner.is_(None), Job.owner == claim.owner, Job.lease_expires_at < str(now)),
+        ),
+    )
+    data = {
+        "status": "RUNNING",
+        "owner": claim.owner,
+        "lease_expires_at": str(now + datetime.timedelta(seconds=claim.lease_seconds)),
+    }
+    return status_updates.update(session, job_id, data, condition)
+
+
+@app.delete("/job/{job_id}/claim", response_model_exclude_none=True)
+def release_job(job_id: str, owner: str, session: SessionDep) -> Job:
+    # the job stays RUNNING, any worker may claim it, e.g. when its message is retried
+    return status_updates.update(session, job_id, {"owner": None, "lease_expires_at": None}, Job.owner == owner)
 
 
 @app.get("/job/{job_id}", response_model_exclude_none=True)
@@ -85,3 +351,29 @@ def retrieve_job(job_id: str, session: SessionDep) -> Job:
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return job
+
+
+@app.get("/jobs", response_model_exclude_none=True)
+def list_jobs(
+    session: SessionDep,
+    status: Annotated[Union[list[str], None], Query()] = None,
+    submitted_after: Union[datetime.datetime, None] = None,
+    submitted_before: Union[datetime.datetime, None] = None,
+    limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = 100,
+    cursor: Union[str, None] = None,
+) -> JobPage:
+    # newest first, a page starts after the (submitted_at, job_id) of the last job of the previous page, so
+    # the listing reads only the rows of the page from the index, however deep the page
+    statement = select(Job).where(Job.submitted_at.is_not(None))
+    if status:
+        statement = statement.where(Job.status.in_(status))
+    if submitted_after:
+        statement = statement.where(Job.submitted_at >= timestamp(submitted_after))
+    if submitted_before:
+        statement = statement.where(Job.submitted_at < timestamp(submitted_before))
+    if cursor:
+        statement = statement.where(tuple_(Job.submitted_at, Job.job_id) < tuple_(*decode_cursor(cursor)))
+    statement = statement.order_by(Job.submitted_at.desc(), Job.job_id.desc()).limit(limit + 1)
+    jobs = session.exec(statement).all()
+    next_cursor = encode_cursor(jobs[limit - 1]) if len(jobs) > limit else None
+    return JobPage(jobs=jobs[:limit], next_cursor=next_cursor)
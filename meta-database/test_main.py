@@ -1,14 +1,18 @@
 import pytest
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, Session, create_engine
+from sqlmodel import SQLModel, Session, create_engine, select
 from sqlmodel.pool import StaticPool
+from fastapi import HTTPException
+from sqlalchemy import event, inspect, text
 from freezegun import freeze_time
 
 # Import the FastAPI app and dependency from the module where the code is defined
-from main import app, get_session
+from main import GroupCommit, Job, app, get_session, migrate
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
+from base64 import urlsafe_b64encode
 
 mock_dir = Path("../mocks")
 with open(mock_dir / "worker_send_job_finished_to_db.json") as f:
@@ -100,15 +104,209 @@ def test_create_job(client):
     assert response.status_code == 200
     assert response.json() == db_get_failed_job
 
-    # worker sends finished job
+    # worker sends finished job, a failed job does not finish
     response = client.patch(
         f"/job/{worker_send_job_finished_to_db['job_id']}",
         json=worker_send_job_finished_to_db,
     )
+    assert response.status_code == 409
+    assert response.json()["detail"]["status"] == "FAILED"
+
+    # check failed job in db
+    response = client.get(f"/job/{db_get_failed_job['job_id']}")
+    assert response.status_code == 200
+    assert response.json() == db_get_failed_job
+
+
+@freeze_time(db_get_queued_job["submitted_at"])
+def test_create_or_get_job(client):
+    job_id = api_send_job_to_db["job_id"]
+    response = client.put(f"/job/{job_id}")
+    assert response.status_code == 201
+    assert response.json() == db_get_queued_job
+
+    client.patch(f"/job/{job_id}", json={"status": "RUNNING"})
+
+    # the second submission gets the stored job, no new job is created
+    response = client.put(f"/job/{job_id}")
+    assert response.status_code == 200
+    assert response.json() == db_get_running_job
+
+
+def test_create_chunk_job_with_parent(client):
+    response = client.put("/job/job1-0", json={"parent_id": "job1"})
+    assert response.status_code == 201
+    assert response.json()["parent_id"] == "job1"
+
+    response = client.get("/job/job1-0")
+    assert response.json()["parent_id"] == "job1"
+
+
+def test_migrate_adds_parent_id_column():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    with engine.begin() as connection:
+        connection.execute(
+            text("CREATE TABLE job (job_id VARCHAR PRIMARY KEY, status VARCHAR, submitted_at VARCHAR, completed_at VARCHAR)")
+        )
+
+    migrate(engine)
+    migrate(engine)
+
+    assert {"parent_id", "summary", "error"} <= {column["name"] for column in inspect(engine).get_columns("job")}
+    assert {"ix_job_submitted", "ix_job_status_submitted"} <= {index["name"] for index in inspect(engine).get_indexes("job")}
+
+
+def test_finished_job_keeps_its_summary(client):
+    summary = {"queries": 1, "hits": 2, "per_query": {"q1": {"hits": 2, "best": {"target": "t1"}}}}
+    client.put("/job/job1")
+    client.patch("/job/job1", json={"status": "RUNNING"})
+    response = client.patch("/job/job1", json={"status": "FINISHED", "summary": summary})
     assert response.status_code == 200
-    assert response.json() == worker_send_job_finished_to_db
 
-    # check finished job in db
-    response = client.get(f"/job/{worker_send_job_finished_to_db['job_id']}")
+    response = client.get("/job/job1")
+    assert response.json()["summary"] == summary
+
+
+def test_failed_job_keeps_its_error(client):
+    client.put("/job/job1")
+    client.patch("/job/job1", json={"status": "FAILED", "error": "Job exceeded the wall time limit of 60s"})
+    assert client.get("/job/job1").json()["error"] == "Job exceeded the wall time limit of 60s"
+
+    # requeued, the error of the previous run is cleared
+    client.patch("/job/job1", json={"status": "QUEUED", "error": None})
+    assert "error" not in client.get("/job/job1").json()
+
+
+def create_jobs(client, jobs):
+    for job_id, status, submitted_at in jobs:
+        client.put(f"/job/{job_id}")
+        client.patch(f"/job/{job_id}", json={"status": status, "submitted_at": submitted_at})
+
+
+def test_list_jobs_pages_newest_first(client):
+    create_jobs(client, [(f"job{i}", "QUEUED", f"2025-09-16 10:0{i}:00") for i in range(5)])
+
+    response = client.get("/jobs", params={"limit": 2})
+    assert [job["job_id"] for job in response.json()["jobs"]] == ["job4", "job3"]
+    response = client.get("/jobs", params={"limit": 2, "cursor": response.json()["next_cursor"]})
+    assert [job["job_id"] for job in response.json()["jobs"]] == ["job2", "job1"]
+    response = client.get("/jobs", params={"limit": 2, "cursor": response.json()["next_cursor"]})
+    assert [job["job_id"] for job in response.json()["jobs"]] == ["job0"]
+    assert "next_cursor" not in response.json()
+
+
+def test_list_jobs_filters_by_status_and_time(client):
+    create_jobs(
+        client,
+        [
+            ("old-running", "RUNNING", "2025-09-16T08:00:00"),
+            ("new-running", "RUNNING", "2025-09-16T10:00:00"),
+            ("old-queued", "QUEUED", "2025-09-16T08:00:00"),
+        ],
+    )
+
+    response = client.get("/jobs", params={"status": "RUNNING", "submitted_before": "2025-09-16T09:00:00"})
+    assert [job["job_id"] for job in response.json()["jobs"]] == ["old-running"]
+    response = client.get("/jobs", params={"status": ["RUNNING", "QUEUED"], "submitted_after": "2025-09-16T07:00:00"})
+    assert [job["job_id"] for job in response.json()["jobs"]] == ["new-running", "old-running", "old-queued"]
+    assert client.get("/jobs", params={"cursor": "not a cursor"}).status_code == 422
+    for value in (1, [1, 2, 3], None):
+        cursor = urlsafe_b64encode(json.dumps(value).encode()).decode()
+        assert client.get("/jobs", params={"cursor": cursor}).status_code == 422
+
+
+def test_list_jobs_reads_the_index():
+    engine = create_engine("sqlite://", poolclass=StaticPool)
+    SQLModel.metadata.create_all(engine)
+    migrate(engine)
+
+    with engine.connect() as connection:
+        plan = connection.execute(
+            text(
+                "EXPLAIN QUERY PLAN SELECT * FROM job WHERE status = 'RUNNING' AND (submitted_at, job_id) < ('x', 'y') "
+                "ORDER BY submitted_at DESC, job_id DESC LIMIT 10"
+            )
+        ).all()
+    assert "USING INDEX ix_job_status_submitted" in " ".join(row[-1] for row in plan)
+    assert "TEMP B-TREE" not in " ".join(row[-1] for row in plan)
+
+
+def test_concurrent_updates_are_committed_together(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        session.add_all(Job(job_id=f"job{i}", status="QUEUED") for i in range(20))
+        session.commit()
+    commits = []
+    event.listen(engine, "commit", lambda connection: commits.append(connection))
+    group_commit = GroupCommit(window_seconds=0.05)
+
+    def update(job_id):
+        with Session(engine) as session:
+            return group_commit.update(session, job_id, {"status": "RUNNING"})
+
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        jobs = list(executor.map(update, [f"job{i}" for i in range(20)]))
+
+    assert [job.status for job in jobs] == ["RUNNING"] * 20
+    assert len(commits) < 20
+    with Session(engine) as session:
+        assert {job.status for job in session.exec(select(Job))} == {"RUNNING"}
+        with pytest.raises(HTTPException):
+            GroupCommit(window_seconds=0).update(session, "missing", {"status": "RUNNING"})
+
+
+def test_cancelled_job_is_not_set_running(client):
+    client.put("/job/job1")
+    client.patch("/job/job1", json={"status": "CANCELLED"})
+
+    response = client.patch("/job/job1", json={"status": "RUNNING"})
+    assert response.status_code == 409
+    assert response.json()["detail"]["status"] == "CANCELLED"
+    assert client.patch("/job/job1", json={"status": "DONE"}).status_code == 422
+    assert client.patch("/job/missing", json={"status": "RUNNING"}).status_code == 404
+
+
+def test_one_of_two_workers_claims_the_job(client):
+    client.put("/job/job1")
+    claim = {"owner": "worker-1", "lease_seconds": 60}
+
+    response = client.post("/job/job1/claim", json=claim)
+    assert response.status_code == 200
+    assert response.json()["status"] == "RUNNING"
+    assert response.json()["owner"] == "worker-1"
+    # renewed by its owner, refused to another worker
+    assert client.post("/job/job1/claim", json=claim).status_code == 200
+    response = client.post("/job/job1/claim", json={**claim, "owner": "worker-2"})
+    assert response.status_code == 409
+    assert response.json()["detail"]["status"] == "RUNNING"
+
+    # released for a retry, the next worker claims it
+    assert client.delete("/job/job1/claim", params={"owner": "worker-2"}).status_code == 409
+    assert client.delete("/job/job1/claim", params={"owner": "worker-1"}).status_code == 200
+    assert client.post("/job/job1/claim", json={**claim, "owner": "worker-2"}).status_code == 200
+
+    # the job finished, nobody claims it again
+    client.patch("/job/job1", json={"status": "FINISHED"})
+    assert "owner" not in client.get("/job/job1").json()
+    assert client.post("/job/job1/claim", json=claim).json()["detail"]["status"] == "FINISHED"
+
+
+def test_expired_lease_is_claimed_by_another_worker(client):
+    client.put("/job/job1")
+    with freeze_time("2025-09-16 10:00:00"):
+        client.post("/job/job1/claim", json={"owner": "worker-1", "lease_seconds": 60})
+    with freeze_time("2025-09-16 10:00:30"):
+        assert client.post("/job/job1/claim", json={"owner": "worker-2", "lease_seconds": 60}).status_code == 409
+    with freeze_time("2025-09-16 10:01:01"):
+        assert client.post("/job/job1/claim", json={"owner": "worker-2", "lease_seconds": 60}).status_code == 200
+
+
+def test_metrics(client):
+    client.post("/job/", json={"job_id": api_send_job_to_db["job_id"]})
+    client.get(f"/job/{api_send_job_to_db['job_id']}")
+
+    response = client.get("/metrics/")
     assert response.status_code == 200
-    assert response.json() == worker_send_job_finished_to_db
+    assert 'metadb_query_latency_seconds_count{statement="SELECT"}' in response.text
+    assert 'metadb_query_latency_seconds_count{statement="INSERT"}' in response.text
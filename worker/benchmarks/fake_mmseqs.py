@@ -0,0 +1,184 @@
+"""Deterministic stand-in for the mmseqs binary used by the worker benchmarks.
+
+Supports the subcommands the worker runs with the same positional arguments as mmseqs:
+
+    fake_mmseqs.py easy-search <query.fasta> <target db> <result.m8> <tmp dir>
+    fake_mmseqs.py createdb <query.fasta> <query db>
+    fake_mmseqs.py search <query db> <target db> <alignment db> <tmp dir>
+    fake_mmseqs.py convertalis <query db> <target db> <alignment db> <result.m8> [--format-output <columns>]
+    fake_mmseqs.py createsubdb <key list> <db> <sub db>
+    fake_mmseqs.py databases <name> <target db> <tmp dir>   (the release in FAKE_MMSEQS_RELEASE)
+    fake_mmseqs.py touchdb <target db>
+
+The query db is a copy of the FASTA file and the alignment db holds the hits in the default
+m8 columns, convertalis picks the requested columns from them (unknown columns are reported as NA).
+The aligned target residues (taln) are the query residues with every fifth one replaced by X.
+createsubdb keeps all the entries, the keys of the query db are listed in its .lookup file.
+
+The run time and the result size are driven by environment variables:
+
+    FAKE_MMSEQS_BASE_LATENCY     fixed start-up time in seconds (default 0.05)
+    FAKE_MMSEQS_RESIDUE_LATENCY  additional seconds per query residue (default 0.00001)
+    FAKE_MMSEQS_HITS             hits reported per query sequence (default 50)
+    FAKE_MMSEQS_FAIL_RATE        fraction of queries failing with exit code 1 (default 0)
+
+Hits are derived from the query hash, so the same query always gives the same result.
+"""
+
+import hashlib
+import os
+import sys
+import time
+
+
+def read_fasta(path):
+    """Return (header, sequence) pairs of the fasta file."""
+    records = []
+    header, seq = None, []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if header is not None:
+                    records.append((header, "".join(seq)))
+                header, seq = (line[1:].split() or [""])[0], []
+            elif line:
+                seq.append(line)
+    if header is not None:
+        records.append((header, "".join(seq)))
+    return records
+
+
+def m8_lines(query_id, sequence, hits):
+    """Deterministic m8 hits of the query, ordered by decreasing bit score."""
+    digest = hashlib.md5(sequence.encode()).hexdigest()
+    length = len(sequence)
+    for i in range(hits):
+        rank = int(digest[i % 32], 16) + i
+        identity = max(1.0 - rank / (hits + 16), 0.2)
+        alnlen = max(int(length * (1.0 - i / (2 * hits))), 1)
+        evalue = 10 ** (-max(180 - 3 * i, 1))
+        bits = max(1000 - 15 * i, 20)
+        target = f"sp|FAKE{digest[:6].upper()}{i:04d}|FAKE_{i}"
+        yield (
+            f"{query_id}\t{target}\t{identity:.3f}\t{alnlen}\t{int(alnlen * (1 - identity))}\t0"
+            f"\t1\t{alnlen}\t1\t{alnlen}\t{evalue:.2E}\t{bits}\n"
+        )
+
+
+DEFAULT_COLUMNS = "query,target,fident,alnlen,mismatch,gapopen,qstart,qend,tstart,tend,evalue,bits".split(",")
+
+
+def simulate_search(records, tmp_dir):
+    """Sleep for the simulated search time, return the exit code of the search."""
+    base_latency = float(os.getenv("FAKE_MMSEQS_BASE_LATENCY", "0.05"))
+    residue_latency = float(os.getenv("FAKE_MMSEQS_RESIDUE_LATENCY", "0.00001"))
+    fail_rate = float(os.getenv("FAKE_MMSEQS_FAIL_RATE", "0"))
+
+    residues = sum(len(seq) for _, seq in records)
+    os.makedirs(tmp_dir, exist_ok=True)
+    time.sleep(base_latency + residue_latency * residues)
+
+    if fail_rate and records:
+        # deterministic per query: the same submission always fails or always succeeds
+        bucket = int(hashlib.md5(records[0][1].encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+        if bucket < fail_rate:
+            sys.stderr.write("fake mmseqs: simulated failure\n")
+            return 1
+    return 0
+
+
+def write_hits(records, path):
+    hits = int(os.getenv("FAKE_MMSEQS_HITS", "50"))
+    with open(path, "w") as out:
+        for query_id, seq in records:
+            out.writelines(m8_lines(query_id, seq, hits))
+
+
+def easy_search(query_file, target_db, result_file, tmp_dir):
+    records = read_fasta(query_file)
+    code = simulate_search(records, tmp_dir)
+    if code == 0:
+        write_hits(records, result_file)
+    return code
+
+
+def createdb(query_file, query_db, *options):
+    with open(query_file) as f, open(query_db, "w") as out:
+        out.write(f.read())
+    with open(f"{query_db}.dbtype", "w") as out:
+        out.write("0")
+    with open(f"{query_db}.lookup", "w") as out:
+        out.writelines(f"{key}\t{query_id}\t0\n" for key, (query_id, _) in enumerate(read_fasta(query_file)))
+    return 0
+
+
+def createsubdb(key_list, db, sub_db, *options):
+    if not os.path.exists(key_list):
+        return 1
+    with open(db) as f, open(sub_db, "w") as out:
+        out.write(f.read())
+    return 0
+
+
+def search(query_db, target_db, alignment_db, tmp_dir, *options):
+    records = read_fasta(query_db)
+    code = simulate_search(records, tmp_dir)
+    if code == 0:
+        write_hits(records, alignment_db)
+    return code
+
+
+def convertalis(query_db, target_db, alignment_db, result_file, *options):
+    columns = DEFAULT_COLUMNS
+    if "--format-output" in options:
+        columns = options[options.index("--format-output") + 1].split(",")
+    query_sequences = dict(read_fasta(query_db))
+    with open(alignment_db) as f, open(result_file, "w") as out:
+        for line in f:
+            hit = dict(zip(DEFAULT_COLUMNS, line.rstrip("\n").split("\t")))
+            sequence = query_sequences.get(hit["query"], "")
+            hit["qlen"] = str(len(sequence))
+            hit["qaln"] = sequence[int(hit["qstart"]) - 1 : int(hit["qend"])]
+            hit["taln"] = "".join("X" if i % 5 == 4 else residue for i, residue in enumerate(hit["qaln"]))
+            out.write("\t".join(hit.get(column, "NA") for column in columns) + "\n")
+    return 0
+
+
+def databases(name, target_db, tmp_dir, *options):
+    os.makedirs(tmp_dir, exist_ok=True)
+    with open(target_db, "w") as out:
+        out.write(f"{name}\n")
+    with open(f"{target_db}.dbtype", "w") as out:
+        out.write("0")
+    release = os.getenv("FAKE_MMSEQS_RELEASE")
+    if release:
+        with open(f"{target_db}.version", "w") as out:
+            out.write(f"UniProtKB/Swiss-Prot Release {release} of 05-Feb-2025\n")
+    return 0
+
+
+def touchdb(target_db, *options):
+    return 0 if os.path.exists(target_db) else 1
+
+
+COMMANDS = {
+    "easy-search": easy_search,
+    "createdb": createdb,
+    "search": search,
+    "convertalis": convertalis,
+    "createsubdb": createsubdb,
+    "databases": databases,
+    "touchdb": touchdb,
+}
+
+
+def main(argv):
+    if not argv or argv[0] not in COMMANDS:
+        sys.stderr.write(f"fake mmseqs: unsupported command {argv[:1]}, expected one of {sorted(COMMANDS)}\n")
+        return 1
+    return COMMANDS[argv[0]](*argv[1:])
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,376 @@
+"""End-to-end worker pipeline throughput benchmark with a simulated mmseqs.
+
+Runs ``consumer.handle_message`` behind an in-memory broker stand-in, with ``MMSeqsService`` calling
+the deterministic ``fake_mmseqs.py`` and ``JobStatusUpdater`` talking to a local metadb stand-in over
+HTTP. Submissions come from a synthetic workload generator with realistic FASTA size distributions.
+
+The report gives jobs/sec, the queue wait and the per-stage timing collected from the worker trace
+spans, so batching and concurrency changes can be evaluated offline:
+
+    python benchmarks/pipeline.py --jobs 200 --workers 4 --output baseline.json
+    python benchmarks/pipeline.py --jobs 200 --workers 4 --baseline baseline.json
+"""
+
+import argparse
+import http.server
+import json
+import logging
+import math
+import os
+import platform
+import queue
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+WORKER_DIR = Path(__file__).resolve().parent.parent
+FAKE_MMSEQS = Path(__file__).resolve().parent / "fake_mmseqs.py"
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+class WorkloadGenerator(object):
+    """Synthetic submissions with UniProt-like sequence lengths.
+
+    Most submissions carry a single sequence, the rest a heavy-tailed number of sequences.
+    Sequence lengths are log-normal with the median of a typical SwissProt entry.
+    """
+
+    def __init__(self, seed, single_ratio=0.7, mean_sequences=20, max_sequences=2000,
+                 median_length=350, length_sigma=0.6, max_length=5000):
+        self.rng = random.Random(seed)
+        self.single_ratio = single_ratio
+        self.mean_sequences = mean_sequences
+        self.max_sequences = max_sequences
+        self.median_length = median_length
+        self.length_sigma = length_sigma
+        self.max_length = max_length
+        self.count = 0
+
+    def n_sequences(self):
+        if self.rng.random() < self.single_ratio:
+            return 1
+        n = int(self.rng.paretovariate(1.5) * self.mean_sequences / 3)
+        return min(max(n, 2), self.max_sequences)
+
+    def sequence_length(self):
+        length = int(self.rng.lognormvariate(math.log(self.median_length), self.length_sigma))
+        return min(max(length, 30), self.max_length)
+
+    def job(self):
+        self.count += 1
+        records = []
+        for i in range(self.n_sequences()):
+            seq = "".join(self.rng.choices(AMINO_ACIDS, k=self.sequence_length()))
+            records.append(f">job{self.count}_seq{i}\n{seq}\n")
+        return {"job_id": f"bench-{self.count:06d}", "fasta": "".join(records)}
+
+
+class FakeChannel(object):
+    """Records the acks, nacks and publishes (retries, dead letters) sent by the consumer."""
+
+    def __init__(self):
+        self.acked = []
+        self.nacked = []
+        self.published = []
+        self._lock = threading.Lock()
+
+    def basic_ack(self, delivery_tag):
+        with self._lock:
+            self.acked.append(delivery_tag)
+
+    def basic_nack(self, delivery_tag, requeue=False):
+        with self._lock:
+            self.nacked.append(delivery_tag)
+
+    def basic_publish(self, exchange, routing_key, body, properties):
+        with self._lock:
+            self.published.append(routing_key)
+
+
+class InMemoryBroker(object):
+    """Broker stand-in delivering published jobs to the consumer callback from worker threads."""
+
+    def __init__(self, callback, workers):
+        self.callback = callback
+        self.workers = workers
+        self.channel = FakeChannel()
+        self.queue = queue.Queue()
+        self.queue_waits = []
+        self._tag = 0
+        self._lock = threading.Lock()
+
+    def publish(self, job, headers=None):
+        with self._lock:
+            self._tag += 1
+            tag = self._tag
+        properties = SimpleNamespace(timestamp=time.time(), headers=headers or {}, delivery_mode=2)
+        self.queue.put((tag, properties, json.dumps(job).encode()))
+
+    def _consume(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            tag, properties, body = item
+            self.queue_waits.append(time.time() - properties.timestamp)
+            self.callback(self.channel, SimpleNamespace(delivery_tag=tag), properties, body)
+
+    def start(self):
+        self.threads = [threading.Thread(target=self._consume, daemon=True) for _ in range(self.workers)]
+        for t in self.threads:
+            t.start()
+
+    def join(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+
+
+class MetaDbStandIn(http.server.ThreadingHTTPServer):
+    """Local HTTP stand-in of the metadata database accepting the job status PATCHes and claims."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.updates = 0
+        # last status of each job, the workers poll it for cancellations
+        self.statuses = {}
+        super().__init__(("127.0.0.1", 0), MetaDbHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class MetaDbHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PATCH(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.updates += 1
+        payload = {"job_id": self.path.rsplit("/", 1)[-1], **json.loads(body or b"{}")}
+        self.server.statuses[payload["job_id"]] = payload.get("status")
+        self.send_json(200, payload)
+
+    def do_POST(self):
+        # claim of the job by a worker, always granted, the benchmark delivers each job once
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        self.server.updates += 1
+        job_id = self.path.rsplit("/", 2)[-2]
+        self.server.statuses[job_id] = "RUNNING"
+        self.send_json(200, {"job_id": job_id, "status": "RUNNING"})
+
+    def do_GET(self):
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        job_id = self.path.rsplit("/", 1)[-1]
+        if job_id not in self.server.statuses:
+            self.send_json(404, {"detail": "Job not found"})
+            return
+        self.send_json(200, {"job_id": job_id, "status": self.server.statuses[job_id]})
+
+    def send_json(self, code, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class CollectingExporter(object):
+    """Span exporter keeping the finished worker spans in memory."""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of the sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(q * len(sorted_values) / 100), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(values):
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "total_s": sum(values),
+        "mean_ms": 1000 * sum(values) / len(values) if values else 0.0,
+        "p50_ms": 1000 * percentile(values, 50),
+        "p95_ms": 1000 * percentile(values, 95),
+        "p99_ms": 1000 * percentile(values, 99),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True, cwd=WORKER_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(current, baseline, max_regression):
+    """Return the regressions of jobs/sec and of the per-stage p95 against the baseline report."""
+    regressions = []
+    if current["jobs_per_sec"] < baseline["jobs_per_sec"] * (1 - max_regression):
+        regressions.append(f"jobs/sec {baseline['jobs_per_sec']:.2f} -> {current['jobs_per_sec']:.2f}")
+    for name, base in baseline["stages"].items():
+        cur = current["stages"].get(name)
+        if cur and base["count"] and cur["p95_ms"] > base["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f} -> {cur['p95_ms']:.2f} ms")
+    return regressions
+
+
+def print_report(report):
+    print(f"commit {report['commit']} | {report['config']}")
+    print(
+        f"jobs {report['jobs']} (acked {report['acked']}, nacked {report['nacked']}, dead-lettered {report['dead_lettered']})"
+        f" in {report['elapsed']:.2f}s"
+        f" -> {report['jobs_per_sec']:.2f} jobs/sec, {report['residues_per_sec']:.0f} residues/sec"
+    )
+    print(f"{'stage':<28} {'count':>7} {'total s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, s in {"queue.wait": report["queue_wait"], **report["stages"]}.items():
+        print(
+            f"{name:<28} {s['count']:>7} {s['total_s']:>9.2f} {s['mean_ms']:>9.2f}"
+            f" {s['p50_ms']:>9.2f} {s['p95_ms']:>9.2f} {s['p99_ms']:>9.2f}"
+        )
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", type=int, default=100, help="number of submitted jobs")
+    parser.add_argument("--workers", type=int, default=1, help="number of concurrent consumers")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="poisson arrival rate in jobs/sec, 0 publishes the whole backlog upfront")
+    parser.add_argument("--seed", type=int, default=42, help="random seed of the workload")
+    parser.add_argument("--single-ratio", type=float, default=0.7, help="fraction of single sequence submissions")
+    parser.add_argument("--mean-sequences", type=int, default=20, help="scale of the multi sequence submissions")
+    parser.add_argument("--max-sequences", type=int, default=2000, help="maximal number of sequences per job")
+    parser.add_argument("--median-length", type=int, default=350, help="median sequence length")
+    parser.add_argument("--mmseqs-base-latency", type=float, default=0.05, help="simulated mmseqs start-up seconds")
+    parser.add_argument("--mmseqs-residue-latency", type=float, default=0.00001,
+                        help="simulated mmseqs seconds per query residue")
+    parser.add_argument("--mmseqs-hits", type=int, default=50, help="simulated hits per query sequence")
+    parser.add_argument("--mmseqs-fail-rate", type=float, default=0.0, help="fraction of failing searches")
+    parser.add_argument("--metadb-latency", type=float, default=0.0, help="simulated metadb latency in seconds")
+    parser.add_argument("--log-level", default="WARNING", help="level of the worker logs printed during the run")
+    parser.add_argument("--output", type=Path, help="path to write the JSON report to")
+    parser.add_argument("--baseline", type=Path, help="JSON report of the baseline run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.1, help="accepted relative regression")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    metadb = MetaDbStandIn(args.metadb_latency)
+    threading.Thread(target=metadb.serve_forever, daemon=True).start()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        (tmp / "workspace").mkdir()
+        (tmp / "results").mkdir()
+        # consumer reads its configuration at import time
+        os.environ.update(
+            DB_DIR=str(tmp / "db"),
+            WORKSPACE_DIR=str(tmp / "workspace"),
+            RESULT_DIR=str(tmp / "results"),
+            MMSEQS_BIN=f"{sys.executable} {FAKE_MMSEQS}",
+            DB_API_BASE_URL=metadb.url,
+            FAKE_MMSEQS_BASE_LATENCY=str(args.mmseqs_base_latency),
+            FAKE_MMSEQS_RESIDUE_LATENCY=str(args.mmseqs_residue_latency),
+            FAKE_MMSEQS_HITS=str(args.mmseqs_hits),
+            FAKE_MMSEQS_FAIL_RATE=str(args.mmseqs_fail_rate),
+        )
+        sys.path.insert(0, str(WORKER_DIR))
+        import consumer
+        from tracing import tracer
+
+        logging.getLogger().setLevel(args.log_level)
+        exporter = CollectingExporter()
+        tracer.exporter = exporter
+
+        generator = WorkloadGenerator(
+            args.seed,
+            single_ratio=args.single_ratio,
+            mean_sequences=args.mean_sequences,
+            max_sequences=args.max_sequences,
+            median_length=args.median_length,
+        )
+        jobs = [generator.job() for _ in range(args.jobs)]
+        residues = sum(
+            len(line) for job in jobs for line in job["fasta"].splitlines() if not line.startswith(">")
+        )
+
+        broker = InMemoryBroker(consumer.handle_message, args.workers)
+        start = time.perf_counter()
+        broker.start()
+        arrivals = random.Random(args.seed)
+        for job in jobs:
+            broker.publish(job)
+            if args.rate:
+                time.sleep(arrivals.expovariate(args.rate))
+        broker.join()
+        elapsed = time.perf_counter() - start
+    metadb.shutdown()
+
+    stages = {}
+    for span in exporter.spans:
+        stages.setdefault(span.name, []).append(span.end_time - span.start_time)
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "log_level", "max_regression")},
+        "jobs": len(jobs),
+        "acked": len(broker.channel.acked),
+        "nacked": len(broker.channel.nacked),
+        "dead_lettered": sum(key.endswith(".dead") for key in broker.channel.published),
+        "metadb_updates": metadb.updates,
+        "elapsed": elapsed,
+        "jobs_per_sec": len(jobs) / elapsed,
+        "residues_per_sec": residues / elapsed,
+        "queue_wait": summarize(broker.queue_waits),
+        "stages": {name: summarize(values) for name, values in sorted(stages.items())},
+    }
+    print_report(report)
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"Report written to {args.output}")
+    if args.baseline:
+        base = json.loads(args.baseline.read_text())
+        if base["config"] != report["config"]:
+            print("Warning: the baseline was run with a different configuration.")
+        regressions = compare(report, base, args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No regressions against the baseline commit {base['commit']}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
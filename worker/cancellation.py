@@ -0,0 +1,72 @@
+"""Cancellation of the jobs requested through the api.
+
+The api marks the job CANCELLED in the metadata database, its message stays in the queue. The
+worker asks for the status of each job on delivery and skips the cancelled ones (a chunk is
+skipped when its parent job is cancelled). While a job is searched the status is polled every
+CANCEL_POLL_SECONDS, the mmseqs process is terminated once the job is cancelled and the workspace
+of the search is removed as the JobCancelled exception unwinds.
+"""
+
+import logging
+import threading
+import time
+
+CANCELLED = "CANCELLED"
+
+
+class JobCancelled(Exception):
+    """The job was cancelled while the worker searched it."""
+
+    def __init__(self, job_id):
+        super().__init__(f"Job {job_id} was cancelled")
+        self.job_id = job_id
+
+
+class CancellationWatch(object):
+    """Polls the status of the job being searched, for the mmseqs runs to stop early."""
+
+    def __init__(self, job_status_updater, interval=5.0, clock=time.monotonic):
+        """
+        Args:
+            job_status_updater (JobStatusUpdater): Client of the metadata database.
+            interval (float): Seconds between two polls of the status of the watched jobs.
+            clock (callable): Monotonic clock, in seconds.
+        """
+        self.job_status_updater = job_status_updater
+        self.interval = interval
+        self.clock = clock
+        # the jobs searched by the thread, the benchmarks run several consumers in threads
+        self._local = threading.local()
+
+    def cancelled(self, *job_ids):
+        """Return the first of the jobs marked CANCELLED, None if none is.
+
+        The metadata database being unreachable does not cancel anything, the search goes on.
+        """
+        for job_id in job_ids:
+            if not job_id:
+                continue
+            try:
+                status = self.job_status_updater.get_job_status(job_id)
+            except Exception as e:
+                logging.warning("Failed to read the status of job %s: %s", job_id, e)
+                continue
+            if status == CANCELLED:
+                return job_id
+        return None
+
+    def start(self, *job_ids):
+        """Watch the jobs (a job and the job it is a chunk of) until stop is called."""
+        self._local.job_ids = tuple(job_id for job_id in job_ids if job_id)
+        self._local.next_poll = self.clock() + self.interval
+
+    def stop(self):
+        self._local.job_ids = ()
+
+    def requested(self):
+        """Return the watched job that was cancelled, polling at most once per interval."""
+        job_ids = getattr(self._local, "job_ids", ())
+        if not job_ids or self.clock() < self._local.next_poll:
+            return None
+        self._local.next_poll = self.clock() + self.interval
+        return self.cancelled(*job_ids)
@@ -0,0 +1,173 @@
+"""Query-side splitting of large submissions into chunks searched in parallel.
+
+A job with more query residues than the chunk size is not searched by the worker picking it up.
+The worker splits the queries into chunks of at most CHUNK_MAX_RESIDUES residues (a longer query
+makes a chunk of its own), registers each chunk in the metadata database as a job with the job as
+its parent and publishes the chunks to the job queue, where any worker picks them up. The job is
+marked RUNNING.
+
+The chunks are searched as regular jobs (with the exact-match fast path, the sharded search and
+the result reuse on redelivery) and saved as <RESULT_DIR>/<job_id>-<i>.m8.gz. The worker finishing
+the last chunk concatenates the chunk results in order into the result of the job and marks it
+FINISHED. The concatenation is idempotent, two workers finishing the last chunks at the same time
+write the same result.
+
+The alignment DBs of the chunks are kept, the alignment directory of the job only lists them, the
+other output formats of the job are converted chunk by chunk.
+"""
+
+import gzip
+import json
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+import pika
+
+from metrics import JOBS_CHUNKED
+from mmseqs_service import checksum_marker
+from summary import count_queries
+from tracing import TRACEPARENT_HEADER, tracer
+
+
+def chunk_id(job_id, index):
+    # no "." in the chunk id, it separates the job id from the format id in the result names
+    return f"{job_id}-{index}"
+
+
+def split_records(fasta, max_residues):
+    """Return the FASTA of the chunks, consecutive records of at most max_residues residues in total.
+
+    The records are kept as they are (header and line breaks), a record longer than max_residues
+    makes a chunk of its own.
+    """
+    chunks, chunk, chunk_residues = [], [], 0
+    record, record_residues = [], 0
+
+    def add_record():
+        nonlocal chunk, chunk_residues
+        if chunk and chunk_residues + record_residues > max_residues:
+            chunks.append("".join(chunk))
+            chunk, chunk_residues = [], 0
+        chunk.extend(record)
+        chunk_residues += record_residues
+
+    for line in fasta.splitlines(keepends=True):
+        if line.startswith(">") and record:
+            add_record()
+            record, record_residues = [], 0
+        record.append(line if line.endswith("\n") else f"{line}\n")
+        if not line.startswith(">"):
+            record_residues += len(line.strip())
+    if record:
+        add_record()
+    if chunk:
+        chunks.append("".join(chunk))
+    return chunks
+
+
+def count_residues(fasta):
+    return sum(len(line.strip()) for line in fasta.splitlines() if not line.startswith(">"))
+
+
+class ChunkedSearch(object):
+    """Splits the large jobs into chunk jobs and concatenates the chunk results."""
+
+    def __init__(self, mmseqs_service, job_status_updater, queue_name, max_residues):
+        """
+        Args:
+            mmseqs_service (MMSeqsService): Service saving the results.
+            job_status_updater (JobStatusUpdater): Client of the metadata database the chunks are registered in.
+            queue_name (str): Name of the job queue the chunks are published to.
+            max_residues (int): Maximum number of query residues of a chunk.
+        """
+        self.mmseqs_service = mmseqs_service
+        self.job_status_updater = job_status_updater
+        self.queue_name = queue_name
+        self.max_residues = max_residues
+
+    def should_split(self, job):
+        """Tell whether the job is too large to be searched as a single job, chunks are never split again."""
+        return "parent_id" not in job and count_residues(job.get("fasta") or "") > self.max_residues
+
+    def split(self, channel, job, properties):
+        """Register the chunks of the job and publish them to the job queue, return the number of chunks.
+
+        A redelivered job is split the same way, the chunks already registered are kept and the
+        chunks searched twice reuse their result.
+        """
+        job_id = job["job_id"]
+        chunks = split_records(job["fasta"], self.max_residues)
+        parent_queries = count_queries(job["fasta"])
+        with tracer.start_span("worker.split", job_id=job_id, chunks=len(chunks)) as span:
+            for index, fasta in enumerate(chunks):
+                self.job_status_updater.create_job(chunk_id(job_id, index), parent_id=job_id)
+                channel.basic_publish(
+                    exchange="",
+                    routing_key=self.queue_name,
+                    body=json.dumps(
+                        {
+                            **job,
+                            "job_id": chunk_id(job_id, index),
+                            "fasta": fasta,
+                            "parent_id": job_id,
+                            "chunks": len(chunks),
+                            # the summary of the parent counts its queries
+                            "parent_queries": parent_queries,
+                        }
+                    ).encode(),
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,
+                        timestamp=properties.timestamp,
+                        headers={TRACEPARENT_HEADER: span.traceparent},
+                    ),
+                )
+        JOBS_CHUNKED.inc()
+        logging.info("Job %s split into %s chunks", job_id, len(chunks))
+        return len(chunks)
+
+    def complete(self, job):
+        """Concatenate the chunk results once all the chunks of the parent are done, return None before."""
+        parent_id = job["parent_id"]
+        chunk_ids = [chunk_id(parent_id, index) for index in range(job["chunks"])]
+        result_path = self.mmseqs_service.result_path
+        if checksum_marker(result_path / self.mmseqs_service.result_name(parent_id)).exists():
+            # chunk delivered again after the concatenation, its result is not needed any more
+            self.remove_chunk_results([job["job_id"]])
+            return self.mmseqs_service.find_result(parent_id)
+        # only the markers are checked here, the results are verified before the concatenation
+        if not all(checksum_marker(result_path / self.mmseqs_service.result_name(c)).exists() for c in chunk_ids):
+            logging.info("Chunk %s done, waiting for the other chunks of job %s", job["job_id"], parent_id)
+            return None
+        try:
+            result_file = self.gather(parent_id, chunk_ids)
+        except FileNotFoundError:
+            # another worker concatenated the chunks and removed them in the meantime
+            result_file = self.mmseqs_service.find_result(parent_id)
+            if result_file is None:
+                raise
+            return result_file
+        self.mmseqs_service.link_alignments(parent_id, chunk_ids)
+        self.remove_chunk_results(chunk_ids)
+        return result_file
+
+    def remove_chunk_results(self, chunk_ids):
+        for c in chunk_ids:
+            chunk_file = self.mmseqs_service.result_path / self.mmseqs_service.result_name(c)
+            checksum_marker(chunk_file).unlink(missing_ok=True)
+            chunk_file.unlink(missing_ok=True)
+
+    def gather(self, parent_id, chunk_ids):
+        """Concatenate the chunk results in order into the result of the parent job."""
+        with tracer.start_span("worker.gather_chunks", job_id=parent_id, chunks=len(chunk_ids)):
+            with tempfile.TemporaryDirectory(dir=self.mmseqs_service.workspace_path) as tmpdirname:
+                result_file = Path(tmpdirname) / f"{parent_id}.m8"
+                with open(result_file, "wb") as out:
+                    for c in chunk_ids:
+                        chunk_file = self.mmseqs_service.find_result(c)
+                        if chunk_file is None:
+                            raise FileNotFoundError(f"Result of chunk {c} is missing or incomplete")
+                        with (gzip.open if chunk_file.suffix == ".gz" else open)(chunk_file, "rb") as f:
+                            shutil.copyfileobj(f, out)
+                return self.mmseqs_service.save_result(parent_id, result_file)
@@ -0,0 +1,88 @@
+"""Claim of the jobs before they are searched.
+
+A message is delivered again when the connection of the worker consuming it is lost, e.g. when a long
+search kept it from answering the heartbeats of the broker, while that worker may still be searching.
+Before searching a job the worker claims it in the metadata database: the job is set RUNNING for the
+worker until a lease expires, and the worker renews the lease between waits on the mmseqs process.
+Of two workers picking up the same job, only one gets it:
+
+- a job RUNNING for another worker is deferred for a lease period, if that worker dies its lease
+  expires and the job is claimed again, otherwise the job has finished by then or is deferred again;
+- a finished, failed, cancelled or expired job is skipped.
+
+A job retried after a transient failure is released first, so any worker can claim it.
+"""
+
+import logging
+import os
+import socket
+import threading
+import time
+
+from job_status_updater import StatusConflict
+
+RUNNING = "RUNNING"
+
+
+class ClaimLost(StatusConflict):
+    """The lease of the job expired and another worker claimed it, the search is stopped."""
+
+
+class JobClaim(object):
+    """Claims the jobs of the worker and renews the lease of the job being searched."""
+
+    def __init__(self, job_status_updater, lease_seconds=120.0, owner=None, clock=time.monotonic):
+        """
+        Args:
+            job_status_updater (JobStatusUpdater): Client of the metadata database.
+            lease_seconds (float): Time a claim holds without renewal, renewed every third of it.
+            owner (str): Name of the worker in the claims, the host name and the pid by default.
+            clock (callable): Monotonic clock, in seconds.
+        """
+        self.job_status_updater = job_status_updater
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+        self.clock = clock
+        # the job claimed by the thread, the benchmarks run several consumers in threads
+        self._local = threading.local()
+
+    def claim(self, job_id):
+        """Claim the job, return None once claimed, the status the job is in otherwise."""
+        try:
+            self.job_status_updater.claim_job(job_id, self.owner, self.lease_seconds)
+        except StatusConflict as e:
+            return e.status
+        self._local.job_id = job_id
+        self._local.next_renewal = self.clock() + self.lease_seconds / 3
+        return None
+
+    def renew(self):
+        """Renew the lease of the claimed job, at most once per third of the lease.
+
+        The metadata database being unreachable does not stop the search, the renewal is tried again.
+        """
+        job_id = getattr(self._local, "job_id", None)
+        if job_id is None or self.clock() < self._local.next_renewal:
+            return
+        self._local.next_renewal = self.clock() + self.lease_seconds / 3
+        try:
+            self.job_status_updater.claim_job(job_id, self.owner, self.lease_seconds)
+        except StatusConflict as e:
+            if e.status == RUNNING:
+                raise ClaimLost(job_id, e.status)
+            # cancelled meanwhile, the cancellation watch stops the search
+        except Exception as e:
+            logging.warning("Failed to renew the claim of job %s: %s", job_id, e)
+
+    def release(self, job_id):
+        """Release the job if the thread claimed it, for the retry of its message."""
+        if getattr(self._local, "job_id", None) != job_id:
+            return
+        try:
+            self.job_status_updater.release_job(job_id, self.owner)
+        except Exception as e:
+            # the lease expires anyway
+            logging.warning("Failed to release job %s: %s", job_id, e)
+
+    def stop(self):
+        self._local.job_id = None
@@ -2,11 +2,38 @@ import pika
 import json
 from queue_config import *
 import logging
-import sys
 import os
+import time
 from mmseqs_service import MMSeqsService
+from exact_match import ExactMatchIndex
+from db_registry import DbRegistry
 from datetime import datetime
-from job_status_updater import JobStatusUpdater
+from job_status_updater import JobStatusUpdater, StatusConflict
+from cancellation import CANCELLED, CancellationWatch, JobCancelled
+from claim import RUNNING, JobClaim
+from limits import JobLimits, LimitExceeded
+from retention import ResultRetentionManager
+from retry import RetryPolicy
+from sharding import ShardedSearch, shard_queue
+from chunking import ChunkedSearch
+from incremental import IncrementalSearch
+from pair_alignment import PairAligner
+from summary import count_queries, summarize
+from metrics import (
+    JOB_QUEUE_WAIT,
+    JOBS_CANCELLED,
+    JOBS_CLAIM_CONFLICTS,
+    JOBS_FAILED,
+    JOBS_FINISHED,
+    JOBS_LIMIT_EXCEEDED,
+    JOBS_RETRIED,
+    MMSEQS_DURATION,
+    RESULT_SIZE,
+    RESULTS_REUSED,
+    start_metrics_server,
+)
+from tracing import TRACEPARENT_HEADER, FileSpanExporter, tracer
+from logs import REDACTED, Payload, setup_logging
 
 # Rabbit related configuration with environment variable overrides
 RABBITMQ_PORT = int(os.getenv("RABBITMQ_PORT", RABBITMQ_PORT))
@@ -15,42 +42,330 @@ QUEUE_NAME = os.getenv("QUEUE_NAME", QUEUE_NAME)
 USER_NAME = os.getenv("USER_NAME", USER_NAME)
 PASSWORD = os.getenv("PASSWORD", PASSWORD)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s %(levelname)s %(message)s",
-    stream=sys.stdout,
-)
+# Logging through a bounded queue written by a background thread, repetitive messages are sampled
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_SAMPLE_BURST = int(os.getenv("LOG_SAMPLE_BURST", "20"))
+LOG_SAMPLE_SECONDS = float(os.getenv("LOG_SAMPLE_SECONDS", "10"))
+setup_logging(LOG_LEVEL, LOG_QUEUE_SIZE, LOG_SAMPLE_BURST, LOG_SAMPLE_SECONDS)
 
-DB_DIR = "/app/mmseqs_db/swissprot"
-WORKSPACE_DIR = "/workspace"
-RESULT_DIR = "/results"
+DB_DIR = os.getenv("DB_DIR", "/app/mmseqs_db/swissprot")
+WORKSPACE_DIR = os.getenv("WORKSPACE_DIR", "/workspace")
+RESULT_DIR = os.getenv("RESULT_DIR", "/results")
+MMSEQS_BIN = os.getenv("MMSEQS_BIN", "mmseqs")
+RESULT_COMPRESSION = os.getenv("RESULT_COMPRESSION", "gzip")
+RESULT_COMPRESSION_LEVEL = int(os.getenv("RESULT_COMPRESSION_LEVEL", "6"))
+RESULT_CHUNK_SIZE = int(os.getenv("RESULT_CHUNK_SIZE", "0"))
+# built at DB preparation time with exact_match.py, the fast path is off when empty
+EXACT_MATCH_INDEX = os.getenv("EXACT_MATCH_INDEX", "")
 DB_API_BASE_URL = os.getenv("DB_API_BASE_URL", "http://meta-database:8000")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+TRACE_FILE = os.getenv("TRACE_FILE", "")
+# Result retention, disabled unless a size budget or a TTL is set, the alignment DBs are kept for a day
+RETENTION_MAX_BYTES = int(os.getenv("RETENTION_MAX_BYTES", "0"))
+RETENTION_TTL_SECONDS = float(os.getenv("RETENTION_TTL_SECONDS", "0"))
+RETENTION_INTERVAL_SECONDS = float(os.getenv("RETENTION_INTERVAL_SECONDS", "60"))
+RETENTION_LOW_WATERMARK = float(os.getenv("RETENTION_LOW_WATERMARK", "0.9"))
+ALIGNMENT_TTL_SECONDS = float(os.getenv("ALIGNMENT_TTL_SECONDS", "86400"))
+# Target DB versions, the registry is off unless the DB the pod starts with is labelled with a version
+DB_VERSION = os.getenv("DB_VERSION", "")
+DB_ROOT = os.getenv("DB_ROOT", "/app/mmseqs_db/versions")
+DB_SOURCE = os.getenv("DB_SOURCE", "UniProtKB/Swiss-Prot")
+DB_SYNC_INTERVAL_SECONDS = float(os.getenv("DB_SYNC_INTERVAL_SECONDS", "30"))
+DB_RETIRE_GRACE_SECONDS = float(os.getenv("DB_RETIRE_GRACE_SECONDS", "300"))
+# Sharded target DB: with SHARD_COUNT > 1 the workers of the job queue fan the jobs out to the shard
+# queues, a worker with SHARD_INDEX consumes the queue of its shard (DB_DIR is then the shard DB)
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_INDEX = int(os.getenv("SHARD_INDEX", "-1"))
+CONSUME_QUEUE = shard_queue(QUEUE_NAME, SHARD_INDEX) if SHARD_INDEX >= 0 else QUEUE_NAME
+# Query-side chunking: jobs with more query residues are split into chunk jobs searched in parallel, 0 disables it
+CHUNK_MAX_RESIDUES = int(os.getenv("CHUNK_MAX_RESIDUES", "0"))
+# Incremental results: jobs with more query residues are searched in steps of that many residues, the hits
+# of each step are served by the api while the job runs, 0 disables it
+PARTIAL_RESULT_RESIDUES = int(os.getenv("PARTIAL_RESULT_RESIDUES", "0"))
+# Retries of the transient failures through delay queues, exponential backoff capped at the max delay
+MAX_RETRIES = int(os.getenv("MAX_RETRIES", "5"))
+RETRY_BASE_DELAY_SECONDS = int(os.getenv("RETRY_BASE_DELAY_SECONDS", "5"))
+RETRY_MAX_DELAY_SECONDS = int(os.getenv("RETRY_MAX_DELAY_SECONDS", "600"))
+# Seconds between two polls of the status of the job being searched, a cancelled job is stopped within that time
+CANCEL_POLL_SECONDS = float(os.getenv("CANCEL_POLL_SECONDS", "5"))
+# Seconds a worker holds the claim of a job without renewing it, a job left by a dead worker is claimed again after
+# that time, the job redelivered while another worker searches it is deferred for that time
+CLAIM_LEASE_SECONDS = int(os.getenv("CLAIM_LEASE_SECONDS", "120"))
+# Per-job limits, a job exceeding one is killed and marked FAILED with the reason, 0 disables a limit
+JOB_WALL_TIME_SECONDS = float(os.getenv("JOB_WALL_TIME_SECONDS", "0"))
+JOB_SCRATCH_BYTES = int(os.getenv("JOB_SCRATCH_BYTES", "0"))
+# memory the mmseqs search may use (e.g. 8G), the target DB is searched in splits that fit, empty for the mmseqs default
+SEARCH_SPLIT_MEMORY_LIMIT = os.getenv("SEARCH_SPLIT_MEMORY_LIMIT", "")
+# characters of the error stored with a FAILED job
+MAX_ERROR_LENGTH = 1000
+
+if TRACE_FILE:
+    tracer.exporter = FileSpanExporter(TRACE_FILE)
+
 
+exact_match_index = ExactMatchIndex(EXACT_MATCH_INDEX) if EXACT_MATCH_INDEX else None
+db_registry = None
+if DB_VERSION:
+    db_registry = DbRegistry(
+        DB_ROOT,
+        os.path.basename(DB_DIR),
+        RESULT_DIR,
+        source=DB_SOURCE,
+        mmseqs_bin=MMSEQS_BIN,
+        exact_match=bool(EXACT_MATCH_INDEX),
+        retire_grace_seconds=DB_RETIRE_GRACE_SECONDS,
+        # a worker missing a few reports is dead
+        worker_ttl_seconds=4 * DB_SYNC_INTERVAL_SECONDS,
+    )
+    db_registry.register(DB_VERSION, DB_DIR, exact_match_index)
 
-mmseqs_service = MMSeqsService(DB_DIR, WORKSPACE_DIR, RESULT_DIR)
 job_status_updater = JobStatusUpdater(DB_API_BASE_URL)
+cancellation = CancellationWatch(job_status_updater, CANCEL_POLL_SECONDS)
+job_limits = JobLimits(JOB_WALL_TIME_SECONDS, JOB_SCRATCH_BYTES)
+job_claim = JobClaim(job_status_updater, CLAIM_LEASE_SECONDS)
+mmseqs_service = MMSeqsService(
+    DB_DIR,
+    WORKSPACE_DIR,
+    RESULT_DIR,
+    MMSEQS_BIN,
+    compression=RESULT_COMPRESSION,
+    compression_level=RESULT_COMPRESSION_LEVEL,
+    compression_chunk_size=RESULT_CHUNK_SIZE,
+    exact_match_index=exact_match_index,
+    db_registry=db_registry,
+    cancellation=cancellation,
+    limits=job_limits,
+    split_memory_limit=SEARCH_SPLIT_MEMORY_LIMIT,
+    claim=job_claim,
+)
+result_retention = ResultRetentionManager(
+    RESULT_DIR,
+    job_status_updater,
+    max_bytes=RETENTION_MAX_BYTES,
+    ttl_seconds=RETENTION_TTL_SECONDS,
+    low_watermark=RETENTION_LOW_WATERMARK,
+    alignment_dir=mmseqs_service.alignment_path,
+    alignment_ttl_seconds=ALIGNMENT_TTL_SECONDS,
+)
+sharded_search = ShardedSearch(mmseqs_service, QUEUE_NAME, SHARD_COUNT) if SHARD_COUNT > 1 else None
+chunked_search = (
+    ChunkedSearch(mmseqs_service, job_status_updater, QUEUE_NAME, CHUNK_MAX_RESIDUES) if CHUNK_MAX_RESIDUES > 0 else None
+)
+incremental_search = (
+    IncrementalSearch(mmseqs_service, PARTIAL_RESULT_RESIDUES) if PARTIAL_RESULT_RESIDUES > 0 else None
+)
+pair_aligner = PairAligner(mmseqs_service)
+retry_policy = RetryPolicy(
+    CONSUME_QUEUE,
+    max_retries=MAX_RETRIES,
+    base_delay=RETRY_BASE_DELAY_SECONDS,
+    max_delay=RETRY_MAX_DELAY_SECONDS,
+    defer_delay=CLAIM_LEASE_SECONDS,
+)
 
 
 def handle_message(ch, method, properties, body):
     """Callback for each RabbitMQ message."""
+    # the api stamps the message with the publish time (in seconds)
+    queue_wait = None
+    if properties.timestamp:
+        queue_wait = max(time.time() - properties.timestamp, 0)
+        JOB_QUEUE_WAIT.observe(queue_wait)
+    # continue the trace started by the api submission
+    traceparent = (properties.headers or {}).get(TRACEPARENT_HEADER)
+    with tracer.start_span("worker.handle_message", traceparent=traceparent, queue_wait=queue_wait) as span:
+        try:
+            job = json.loads(body)
+            span.attributes["job_id"] = job.get("job_id")
+            if job.get("task") == "convertalis":
+                # other output columns of a finished job, requested by the api, the job status stays as is
+                logging.info("Received convertalis task: %s", Payload(job))
+                with tracer.start_span("worker.convert_format", format_output=job.get("format_output")):
+                    mmseqs_service.convert_format(job)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            if job.get("task") == "align":
+                # alignments of selected hits of a finished job, requested by the api, the job status stays as is
+                logging.info("Received align task of job %s for %d pairs", job.get("job_id"), len(job.get("pairs") or []))
+                with tracer.start_span("worker.align_pairs", pairs=len(job.get("pairs") or [])):
+                    pair_aligner.align(job)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            logging.info("Received job: %s", Payload(job))
+            # the job (or the job it is a chunk of) was cancelled while it waited in the queue
+            cancelled_id = cancellation.cancelled(job["job_id"], job.get("parent_id"))
+            if cancelled_id is not None:
+                logging.info("Job %s was cancelled, skipping job %s", cancelled_id, job["job_id"])
+                JOBS_CANCELLED.inc()
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            # only one of the workers a redelivered job reaches searches it, the shard sub-tasks share the job
+            # claimed by the worker fanning it out
+            if "shard" not in job:
+                claimed_status = job_claim.claim(job["job_id"])
+                if claimed_status is not None:
+                    skip_claimed(ch, method, properties, body, job["job_id"], claimed_status)
+                    return
+            # the search polls the status of the job and stops once it is cancelled
+            cancellation.start(job["job_id"], job.get("parent_id"))
+            job_limits.start()
+            # a redelivered job may have been searched before the worker died, before the ack
+            result_file = mmseqs_service.find_result(job["job_id"])
+            span.attributes["result_reused"] = result_file is not None
+            if result_file is not None:
+                logging.info("Result of job %s already written, skipping the search", job["job_id"])
+                RESULTS_REUSED.inc()
+            elif "shard" in job:
+                # sub-task of a sharded job, the worker searches its shard, the last one merges the hits
+                if sharded_search is None:
+                    raise ValueError("Shard sub-task received by a worker without SHARD_COUNT")
+                with MMSEQS_DURATION.time(), tracer.start_span("worker.shard_search", shard=job["shard"]):
+                    result_file = sharded_search.search(job)
+                if result_file is None:
+                    ch.basic_ack(delivery_tag=method.delivery_tag)
+                    return
+                RESULT_SIZE.observe(result_file.stat().st_size)
+            elif chunked_search is not None and chunked_search.should_split(job):
+                # a large job is searched in chunks by the workers of the job queue
+                chunked_search.split(ch, job, properties)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            elif sharded_search is not None:
+                # the target DB is sharded, the job is searched by the shard workers
+                sharded_search.scatter(ch, job, properties)
+                ch.basic_ack(delivery_tag=method.delivery_tag)
+                return
+            else:
+                # step 1 the job was set RUNNING by its claim
+                # step 2 search in mmseq2
+                with MMSEQS_DURATION.time(), tracer.start_span("worker.mmseqs2_search"):
+                    if incremental_search is not None and incremental_search.applies(job):
+                        result_file = incremental_search.search(job)
+                    else:
+                        result_file = mmseqs_service.mmseqs2_search(job)
+                RESULT_SIZE.observe(result_file.stat().st_size)
+            # step 3 call the db api to save the result with status finished
+            now = datetime.now()
+            time_str = now.strftime("%Y-%m-%d %H:%M:%S.%f")
+            job_status_updater.update_job_status(
+                job["job_id"],
+                "FINISHED",
+                timestamp=time_str,
+                summary=summarize_result(result_file, count_queries(job.get("fasta") or "")),
+            )
+            if "parent_id" in job:
+                # the worker finishing the last chunk of a job writes the result of the job
+                if chunked_search is None:
+                    raise ValueError("Chunk of a job received by a worker without CHUNK_MAX_RESIDUES")
+                parent_result_file = chunked_search.complete(job)
+                if parent_result_file is not None:
+                    job_status_updater.update_job_status(
+                        job["parent_id"],
+                        "FINISHED",
+                        timestamp=time_str,
+                        summary=summarize_result(parent_result_file, job.get("parent_queries")),
+                    )
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            JOBS_FINISHED.inc()
+        except JobCancelled as e:
+            logging.info("%s, stopped searching job %s", e, job["job_id"])
+            span.attributes["cancelled"] = e.job_id
+            if e.job_id != job["job_id"]:
+                # a chunk of a cancelled job
+                mark_cancelled(job["job_id"])
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+            JOBS_CANCELLED.inc()
+        except StatusConflict as e:
+            # cancelled while its result was written, or taken over by another worker after its lease expired
+            logging.info("%s, leaving job %s as it is", e, job["job_id"])
+            span.attributes["conflict"] = e.status
+            JOBS_CLAIM_CONFLICTS.labels(status=e.status).inc()
+            ch.basic_ack(delivery_tag=method.delivery_tag)
+        except LimitExceeded as e:
+            # the same query would exceed the limit again, the job is failed right away
+            logging.error("%s, job %s is killed", e, job["job_id"])
+            span.attributes["error"] = repr(e)
+            JOBS_LIMIT_EXCEEDED.labels(limit=e.limit).inc()
+            handle_failure(ch, method, properties, body, e)
+        except Exception as e:
+            logging.error("Failed to process job: %s", e, exc_info=True)
+            span.attributes["error"] = repr(e)
+            handle_failure(ch, method, properties, body, e)
+        finally:
+            cancellation.stop()
+            job_limits.stop()
+            job_claim.stop()
+
+
+def summarize_result(result_file, queries):
+    """Return the summary of the result of a job of the given number of queries, None if the result cannot be summarized."""
     try:
-        job = json.loads(body)
-        # step 1 set the status to Running
-        logging.info(f"Received job: {job}")
-        job_status_updater.update_job_status(job["job_id"], "RUNNING")
-        # step 2 search in mmseq2
-        mmseqs_service.mmseqs2_search(job)
-        # step 3 call the db api to save the result with status finished
-        now = datetime.now()
-        time_str = now.strftime("%Y-%m-%d %H:%M:%S.%f")
-        job_status_updater.update_job_status(
-            job["job_id"], "FINISHED", timestamp=time_str
-        )
+        with tracer.start_span("worker.summarize"):
+            return summarize(result_file, queries)
+    except Exception as e:
+        # the result is served anyway, the listings fall back to reading it
+        logging.error("Failed to summarize the result %s: %s", result_file, e)
+        return None
+
+
+def handle_failure(ch, method, properties, body, error):
+    """Send the failed message to a delay queue if the failure is transient, dead-letter it otherwise.
+
+    The retried message goes through the whole handling again, the search is skipped when its
+    result was already written (e.g. only the FINISHED update failed). A dead-lettered job is
+    marked FAILED, so the clients stop polling it.
+    """
+    try:
+        if retry_policy.should_retry(properties, error):
+            # any worker may pick the retried job up
+            job_claim.release(json.loads(body).get("job_id"))
+            delay = retry_policy.retry(ch, body, properties)
+            logging.warning("Retrying message in %ss after a transient failure: %s", delay, error)
+            JOBS_RETRIED.inc()
+        else:
+            mark_failed(body, error)
+            retry_policy.dead_letter(ch, body, properties, error)
+            JOBS_FAILED.inc()
         ch.basic_ack(delivery_tag=method.delivery_tag)
     except Exception as e:
-        logging.error("Failed to process job: %s", e, exc_info=True)
-        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=False)
+        # the broker is not reachable either, let it deliver the message again
+        logging.error("Failed to retry or dead-letter the message: %s", e, exc_info=True)
+        ch.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+
+
+def skip_claimed(ch, method, properties, body, job_id, status):
+    """Skip the job claimed by another worker, deferred while it runs in case that worker dies."""
+    JOBS_CLAIM_CONFLICTS.labels(status=status).inc()
+    if status == RUNNING:
+        delay = retry_policy.defer(ch, body, properties)
+        logging.info("Job %s is searched by another worker, deferred for %ss", job_id, delay)
+    else:
+        logging.info("Job %s is %s, skipping it", job_id, status)
+    ch.basic_ack(delivery_tag=method.delivery_tag)
+
+
+def mark_cancelled(job_id):
+    try:
+        job_status_updater.update_job_status(job_id, CANCELLED)
+    except Exception as e:
+        logging.error("Failed to mark job %s as cancelled: %s", job_id, e)
+
+
+def mark_failed(body, error=None):
+    """Mark the job of the message (and its parent) FAILED with the error, the convertalis and align tasks leave the job status as it is."""
+    try:
+        job = json.loads(body)
+        if job.get("task") in ("convertalis", "align") or not job.get("job_id"):
+            return
+        reason = str(error)[:MAX_ERROR_LENGTH] if error is not None else None
+        job_status_updater.update_job_status(job["job_id"], "FAILED", error=reason)
+        if job.get("parent_id"):
+            # the result of a job split into chunks misses the hits of the failed chunk
+            parent_reason = f"Chunk {job['job_id']} failed: {reason}" if reason else None
+            job_status_updater.update_job_status(job["parent_id"], "FAILED", error=parent_reason)
+    except Exception as e:
+        logging.error("Failed to mark the job of the message as failed: %s", e)
 
 
 def start_consumer():
@@ -59,8 +374,34 @@ def start_consumer():
     logging.info(f"RABBITMQ_PORT: {RABBITMQ_PORT}")
     logging.info(f"RABBITMQ_HOST: {RABBITMQ_HOST}")
     logging.info(f"QUEUE_NAME: {QUEUE_NAME}")
+    logging.info(f"SHARD_COUNT: {SHARD_COUNT}")
+    logging.info(f"SHARD_INDEX: {SHARD_INDEX}")
     logging.info(f"USER_NAME: {USER_NAME}")
-    logging.info(f"PASSWORD: {PASSWORD}")
+    logging.info(f"PASSWORD: {REDACTED if PASSWORD else ''}")
+    logging.info(f"METRICS_PORT: {METRICS_PORT}")
+    logging.info(f"TRACE_FILE: {TRACE_FILE}")
+    logging.info(f"EXACT_MATCH_INDEX: {EXACT_MATCH_INDEX}")
+    logging.info(f"RETENTION_MAX_BYTES: {RETENTION_MAX_BYTES}")
+    logging.info(f"RETENTION_TTL_SECONDS: {RETENTION_TTL_SECONDS}")
+    logging.info(f"ALIGNMENT_TTL_SECONDS: {ALIGNMENT_TTL_SECONDS}")
+    logging.info(f"CHUNK_MAX_RESIDUES: {CHUNK_MAX_RESIDUES}")
+    logging.info(f"PARTIAL_RESULT_RESIDUES: {PARTIAL_RESULT_RESIDUES}")
+    logging.info(f"MAX_RETRIES: {MAX_RETRIES}")
+    logging.info(f"CANCEL_POLL_SECONDS: {CANCEL_POLL_SECONDS}")
+    logging.info(f"CLAIM_LEASE_SECONDS: {CLAIM_LEASE_SECONDS}")
+    logging.info(f"JOB_WALL_TIME_SECONDS: {JOB_WALL_TIME_SECONDS}")
+    logging.info(f"JOB_SCRATCH_BYTES: {JOB_SCRATCH_BYTES}")
+    logging.info(f"SEARCH_SPLIT_MEMORY_LIMIT: {SEARCH_SPLIT_MEMORY_LIMIT}")
+    logging.info(f"DB_VERSION: {DB_VERSION}")
+    logging.info(f"LOG_QUEUE_SIZE: {LOG_QUEUE_SIZE}")
+    logging.info(f"LOG_SAMPLE_BURST: {LOG_SAMPLE_BURST}")
+    logging.info(f"LOG_SAMPLE_SECONDS: {LOG_SAMPLE_SECONDS}")
+
+    start_metrics_server(METRICS_PORT)
+    if result_retention.enabled:
+        result_retention.start(RETENTION_INTERVAL_SECONDS)
+    if db_registry is not None:
+        db_registry.start(DB_SYNC_INTERVAL_SECONDS)
 
     credentials = pika.PlainCredentials(USER_NAME, PASSWORD)
     connection = pika.BlockingConnection(
@@ -71,8 +412,11 @@ def start_consumer():
     channel = connection.channel()
     # Ensure queue exists
     channel.queue_declare(queue=QUEUE_NAME, durable=True)
+    if sharded_search is not None:
+        sharded_search.declare(channel)
+    retry_policy.declare(channel)
     channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue=QUEUE_NAME, on_message_callback=handle_message)
+    channel.basic_consume(queue=CONSUME_QUEUE, on_message_callback=handle_message)
     logging.info("Waiting for jobs. To exit press CTRL+C")
     try:
         channel.start_consuming()
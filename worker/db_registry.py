@@ -0,0 +1,363 @@
+"""Versions of the target DB served by the worker.
+
+Each worker keeps its copy of the target DB on its own volume. A version prepared by the
+registry lives in <root>/<version>/ with the mmseqs DB files and a READY marker, the version
+the pod was started with is registered as it is.
+
+The versions are switched through files on the results volume, shared by the api and the workers:
+
+    .db_target             the version the workers should serve, written with `db_registry.py release`
+    .db_version            the version new jobs are keyed by, the api reads it on submission
+    .db_workers/<worker>   the versions a worker serves, rewritten as its heartbeat
+
+A worker seeing a new target prepares it in a background thread (download, exact-match index,
+preload into the page cache with touchdb) and reports it. The first worker seeing every live worker
+serve the target publishes it as the current version, the workers then switch the jobs without a
+version to it: no job is keyed by a version some worker cannot search yet. A worker whose report is
+older than the worker TTL is dead, it does not hold the switch back. The previous version keeps
+serving the jobs submitted for it, it is removed once it is not used by any in-flight job for the
+grace period. Jobs for a version the worker does not serve fail with a transient error, they are
+retried (possibly by another worker) until the retries are exhausted.
+
+`mmseqs databases` downloads the latest release of the source, the release it reports (the
+<db>.version file) must be the version label: a target that is not the release the source serves
+is not prepared, the download is tried again an hour later.
+
+    python db_registry.py release 2025_01 --control-dir /results
+    python db_registry.py status --control-dir /results
+"""
+
+import argparse
+import logging
+import math
+import os
+import re
+import shlex
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from pathlib import Path
+
+from exact_match import ExactMatchIndex
+from exact_match import build as build_exact_match_index
+from metrics import DB_VERSION_ACTIVE, DB_VERSION_IN_FLIGHT
+from retry import TransientError
+
+READY_MARKER = "READY"
+TARGET_FILE = ".db_target"
+CURRENT_FILE = ".db_version"
+WORKERS_DIR = ".db_workers"
+# release label in the version file `mmseqs databases` writes, e.g. "UniProtKB/Swiss-Prot Release 2025_01 of 05-Feb-2025"
+RELEASE_PATTERN = re.compile(r"Release (\S+)")
+# a target that is not the release the source serves is downloaded again after that, the source may publish it
+REJECTED_RETRY_SECONDS = 3600
+
+# directory is None for the DB the pod was started with, it is not removed when retired
+DbVersion = namedtuple("DbVersion", ["version", "path", "exact_match_index", "directory"])
+
+
+def read_version(path):
+    try:
+        return path.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def write_version(path, version):
+    """Replace the version file atomically, readers see the old or the new version."""
+    partial = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.partial")
+    partial.write_text(f"{version}\n")
+    os.replace(partial, path)
+
+
+class DbRegistry(object):
+    """Target DB versions of the worker, the active one serves the jobs without a version."""
+
+    def __init__(
+        self,
+        root,
+        name,
+        control_dir,
+        source="UniProtKB/Swiss-Prot",
+        mmseqs_bin="mmseqs",
+        exact_match=False,
+        retire_grace_seconds=300,
+        worker_id=None,
+        worker_ttl_seconds=120,
+    ):
+        """
+        Args:
+            root (str): Directory the new versions are prepared in.
+            name (str): Name of the mmseqs DB inside a version directory.
+            control_dir (str): Directory of the target and current version files (the results volume).
+            source (str): Database downloaded with `mmseqs databases` when a version is prepared.
+            mmseqs_bin (str): Command running mmseqs.
+            exact_match (bool): Build the exact-match index of the prepared versions.
+            retire_grace_seconds (float): Time a replaced version is kept after its last job, jobs
+                submitted just before the switch may still be in the queue.
+            worker_id (str): Name of the report of the worker, the host name (the pod) by default.
+            worker_ttl_seconds (float): Age of its report after which a worker is dead.
+        """
+        self.root = Path(root)
+        self.name = name
+        self.control_dir = Path(control_dir)
+        self.source = source
+        self.mmseqs_cmd = shlex.split(mmseqs_bin)
+        self.exact_match = exact_match
+        self.retire_grace_seconds = retire_grace_seconds
+        self.worker_id = worker_id or socket.gethostname()
+        self.worker_ttl_seconds = worker_ttl_seconds
+        self.active = None
+        self._versions = {}
+        self._in_flight = {}
+        self._replaced_at = {}
+        # targets that are not the release the source serves -> time of the download
+        self._rejected = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    @property
+    def target_file(self):
+        return self.control_dir / TARGET_FILE
+
+    @property
+    def current_file(self):
+        return self.control_dir / CURRENT_FILE
+
+    @property
+    def report_file(self):
+        return self.control_dir / WORKERS_DIR / self.worker_id
+
+    def register(self, version, path, exact_match_index=None, directory=None):
+        """Add a prepared version, the first one becomes the active version."""
+        db = DbVersion(version, Path(path), exact_match_index, directory)
+        with self._lock:
+            self._versions[version] = db
+            self._in_flight.setdefault(version, 0)
+        if self.active is None:
+            self.activate(version)
+            # the first pod of a deployment publishes the DB it was started with, unless another version is the target
+            if read_version(self.current_file) is None and read_version(self.target_file) in (None, version):
+                write_version(self.current_file, version)
+        return db
+
+    def versions(self):
+        """Return (version, state, in-flight jobs) of the versions served by the worker."""
+        with self._lock:
+            return [
+                (version, "active" if version == self.active else "retiring", self._in_flight[version])
+                for version in sorted(self._versions)
+            ]
+
+    @contextmanager
+    def acquire(self, version=None):
+        """Hold the version (the active one when None) for the duration of a job.
+
+        Raises:
+            TransientError: The version is not served by the worker (yet).
+        """
+        with self._lock:
+            version = version or self.active
+            db = self._versions.get(version)
+            if db is None:
+                raise TransientError(f"Target DB version {version} is not served by this worker")
+            self._in_flight[version] += 1
+            DB_VERSION_IN_FLIGHT.labels(version=version).set(self._in_flight[version])
+        try:
+            yield db
+        finally:
+            with self._lock:
+                self._in_flight[version] -= 1
+                DB_VERSION_IN_FLIGHT.labels(version=version).set(self._in_flight[version])
+                if version != self.active:
+                    self._replaced_at[version] = time.time()
+
+    def activate(self, version):
+        """Switch the jobs without a version to the version, the previous one is retired once drained."""
+        with self._lock:
+            previous, self.active = self.active, version
+            self._replaced_at.pop(version, None)
+            if previous is not None and previous != version:
+                self._replaced_at[previous] = time.time()
+                DB_VERSION_ACTIVE.labels(version=previous).set(0)
+            DB_VERSION_ACTIVE.labels(version=version).set(1)
+        logging.info("Target DB version %s active, replacing %s", version, previous)
+
+    def report(self):
+        """Write the versions the worker serves, its report is also its heartbeat."""
+        with self._lock:
+            versions = sorted(self._versions)
+        self.report_file.parent.mkdir(parents=True, exist_ok=True)
+        write_version(self.report_file, "\n".join(versions))
+
+    def live_workers(self, now=None):
+        """Return the versions served by each live worker, the reports of the dead workers are removed."""
+        now = time.time() if now is None else now
+        workers = {}
+        reports = self.control_dir / WORKERS_DIR
+        if not reports.is_dir():
+            return workers
+        with os.scandir(reports) as it:
+            for entry in it:
+                if entry.name.endswith(".partial"):
+                    continue
+                try:
+                    if now - entry.stat().st_mtime > self.worker_ttl_seconds:
+                        logging.info("Worker %s reported no target DB versions for %ss, ignoring it", entry.name, self.worker_ttl_seconds)
+                        os.unlink(entry.path)
+                        continue
+                    workers[entry.name] = set(Path(entry.path).read_text().split())
+                except FileNotFoundError:
+                    continue
+        return workers
+
+    def publish(self, version, now=None):
+        """Publish the version as the current version once every live worker serves it, return True once published."""
+        if read_version(self.current_file) == version:
+            return True
+        waiting = sorted(worker for worker, versions in self.live_workers(now).items() if version not in versions)
+        if waiting:
+            logging.info("Target DB version %s not published, waiting for %s", version, ", ".join(waiting))
+            return False
+        write_version(self.current_file, version)
+        logging.info("Published target DB version %s", version)
+        return True
+
+    def check_release(self, version, path):
+        """Check the release `mmseqs databases` downloaded is the version.
+
+        Raises:
+            ValueError: The source serves another release, the version is not prepared again for an hour.
+        """
+        version_file = Path(f"{path}.version")
+        releases = RELEASE_PATTERN.findall(version_file.read_text()) if version_file.exists() else []
+        if not releases:
+            logging.warning("%s reports no release, target DB version %s is not checked", self.source, version)
+            return
+        if version not in releases:
+            self._rejected[version] = time.time()
+            raise ValueError(f"{self.source} serves release {releases[0]}, not the target DB version {version}")
+
+    def prepare(self, version):
+        """Download and warm the version in <root>/<version>, return it once ready."""
+        directory = self.root / version
+        path = directory / self.name
+        if not (directory / READY_MARKER).exists():
+            logging.info("Preparing target DB version %s in %s", version, directory)
+            shutil.rmtree(directory, ignore_errors=True)
+            directory.mkdir(parents=True)
+            self.run_mmseqs("databases", self.source, path, directory / "tmp")
+            shutil.rmtree(directory / "tmp", ignore_errors=True)
+            try:
+                self.check_release(version, path)
+            except ValueError:
+                shutil.rmtree(directory, ignore_errors=True)
+                raise
+            if self.exact_match:
+                build_exact_match_index(
+                    path, f"{path}.exact.sqlite", mmseqs=shlex.join(self.mmseqs_cmd), tmp_dir=directory
+                )
+            (directory / READY_MARKER).touch()
+        # preload the DB into the page cache, the first jobs on the new version do not pay for it
+        self.run_mmseqs("touchdb", path)
+        index_path = Path(f"{path}.exact.sqlite")
+        exact_match_index = ExactMatchIndex(index_path) if index_path.exists() else None
+        return self.register(version, path, exact_match_index, directory)
+
+    def retire_drained(self, now=None):
+        """Remove the replaced versions without in-flight jobs for the grace period, return them."""
+        now = time.time() if now is None else now
+        retired = []
+        with self._lock:
+            for version, replaced_at in list(self._replaced_at.items()):
+                if self._in_flight[version] or now - replaced_at < self.retire_grace_seconds:
+                    continue
+                db = self._versions.pop(version)
+                del self._in_flight[version], self._replaced_at[version]
+                retired.append(db)
+        for db in retired:
+            for gauge in (DB_VERSION_ACTIVE, DB_VERSION_IN_FLIGHT):
+                try:
+                    gauge.remove(db.version)
+                except KeyError:
+                    pass
+            if db.exact_match_index is not None:
+                db.exact_match_index.close()
+            if db.directory is not None:
+                shutil.rmtree(db.directory, ignore_errors=True)
+            logging.info("Retired target DB version %s", db.version)
+        return [db.version for db in retired]
+
+    def sync(self, now=None):
+        """Follow the target version: prepare it if needed, publish it once every worker serves it,
+        switch to the current version and retire drained versions."""
+        now = time.time() if now is None else now
+        target = read_version(self.target_file)
+        rejected = now - self._rejected.get(target, -math.inf) < REJECTED_RETRY_SECONDS
+        if target is not None and target not in self._versions and not rejected:
+            self.prepare(target)
+        self.report()
+        if target is not None and target in self._versions:
+            self.publish(target, now)
+        current = read_version(self.current_file)
+        if current is not None and current != self.active and current in self._versions:
+            self.activate(current)
+        self.retire_drained(now)
+
+    def run_mmseqs(self, step, *args):
+        cmd = [*self.mmseqs_cmd, step, *(str(arg) for arg in args)]
+        logging.info("Running mmseqs command: %s", " ".join(cmd))
+        subprocess.run(cmd, check=True, capture_output=True)
+
+    def start(self, interval):
+        """Follow the target version every interval seconds in a background thread.
+
+        The report is rewritten by a thread of its own, the worker preparing a version stays alive.
+        """
+        self._threads = [
+            threading.Thread(target=self._run, args=(self.sync, interval), name="db-registry", daemon=True),
+            threading.Thread(target=self._run, args=(self.report, interval), name="db-report", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        # a worker shut down does not hold the next switch back
+        self.report_file.unlink(missing_ok=True)
+
+    def _run(self, step, interval):
+        while not self._stop.is_set():
+            try:
+                step()
+            except Exception as e:
+                logging.error("Target DB version %s failed: %s", step.__name__, e, exc_info=True)
+            self._stop.wait(interval)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--control-dir", default=os.getenv("RESULT_DIR", "/results"), help="The results volume")
+    commands = parser.add_subparsers(dest="command", required=True)
+    release_parser = commands.add_parser("release", help="Ask the workers to switch to a target DB version")
+    release_parser.add_argument("version", help="Label of the version, the release the source serves (e.g. 2025_01)")
+    commands.add_parser("status", help="Print the target and the current version")
+    args = parser.parse_args(argv)
+    control_dir = Path(args.control_dir)
+    if args.command == "release":
+        write_version(control_dir / TARGET_FILE, args.version)
+    print(f"target: {read_version(control_dir / TARGET_FILE)}")
+    print(f"current: {read_version(control_dir / CURRENT_FILE)}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
+    main(sys.argv[1:])
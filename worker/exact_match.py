@@ -0,0 +1,174 @@
+"""Exact-match fast path of the search.
+
+A query identical to a target sequence gets the same hits as the target searched against the
+target DB, so these hits can be computed once when the DB is prepared. The index maps the hash of
+every target sequence to the target and stores the hits of each target (an all-vs-all search of
+the target DB) as compressed m8 lines without the query column.
+
+Build the index after downloading the DB:
+
+    python exact_match.py build --db /app/mmseqs_db/swissprot --output /app/mmseqs_db/swissprot.exact.sqlite
+
+By default the all-vs-all search is run with mmseqs, pass --neighbours with the m8 output of an
+earlier run to skip it. The index is written next to the output and renamed when complete.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import zlib
+from pathlib import Path
+
+
+def sequence_digest(sequence):
+    """Hash of the residues, case and the terminal stop codon do not matter."""
+    residues = "".join(sequence.split()).upper().rstrip("*")
+    return hashlib.blake2b(residues.encode(), digest_size=16).digest()
+
+
+def read_fasta(lines):
+    """Yield (id, sequence) of the FASTA lines, the id is the first word of the header as in mmseqs."""
+    header, seq = None, []
+    for line in lines:
+        line = line.strip()
+        if line.startswith(">"):
+            if header is not None:
+                yield header, "".join(seq)
+            header, seq = (line[1:].split() or [""])[0], []
+        elif line:
+            seq.append(line)
+    if header is not None:
+        yield header, "".join(seq)
+
+
+def merge_hits(records, precomputed, search_lines):
+    """Yield the m8 lines of the queries in the submission order.
+
+    Args:
+        records (list): (id, sequence) of the submitted queries.
+        precomputed (dict): Index of the query in records -> hits from the exact-match index.
+        search_lines (iterable): m8 lines of the search of the other queries, grouped by query
+            in the submission order as mmseqs writes them.
+    """
+    search_lines = iter(search_lines)
+    pending = next(search_lines, None)
+    for i, (query_id, _) in enumerate(records):
+        if i in precomputed:
+            for hit in precomputed[i]:
+                yield f"{query_id}\t{hit}\n"
+            continue
+        while pending is not None and pending.split("\t", 1)[0] == query_id:
+            yield pending
+            pending = next(search_lines, None)
+
+
+class ExactMatchIndex(object):
+    """Read-only lookup of the precomputed hits of the target sequences."""
+
+    def __init__(self, path):
+        self.path = path
+        # read-only, shared by the consumer and the background threads
+        self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+
+    def lookup(self, sequence):
+        """Return the hits (m8 lines without the query column) of the identical target, None if there is none."""
+        row = self.connection.execute(
+            "SELECT n.hits FROM sequences s JOIN neighbours n ON n.target = s.target WHERE s.digest = ?",
+            (sequence_digest(sequence),),
+        ).fetchone()
+        if row is None:
+            return None
+        return zlib.decompress(row[0]).decode().splitlines()
+
+    def close(self):
+        self.connection.close()
+
+
+def create_index(path):
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        CREATE TABLE sequences (digest BLOB PRIMARY KEY, target TEXT NOT NULL) WITHOUT ROWID;
+        CREATE TABLE neighbours (target TEXT PRIMARY KEY, hits BLOB NOT NULL) WITHOUT ROWID;
+        """
+    )
+    return connection
+
+
+def add_sequences(connection, fasta_lines):
+    """Index the target sequences, identical sequences share the hits of the first target."""
+    rows = ((sequence_digest(seq), target) for target, seq in read_fasta(fasta_lines))
+    connection.executemany("INSERT OR IGNORE INTO sequences VALUES (?, ?)", rows)
+
+
+def add_neighbours(connection, m8_lines):
+    """Store the hits of each target of the all-vs-all m8 output (grouped by query)."""
+
+    def rows():
+        target, hits = None, []
+        for line in m8_lines:
+            query, hit = line.rstrip("\n").split("\t", 1)
+            if query != target and hits:
+                yield target, zlib.compress("\n".join(hits).encode())
+                hits = []
+            target = query
+            hits.append(hit)
+        if hits:
+            yield target, zlib.compress("\n".join(hits).encode())
+
+    connection.executemany("INSERT OR REPLACE INTO neighbours VALUES (?, ?)", rows())
+
+
+def run_mmseqs(mmseqs, *args):
+    cmd = [*mmseqs.split(), *(str(arg) for arg in args)]
+    logging.info("Running mmseqs command: %s", " ".join(cmd))
+    subprocess.run(cmd, check=True)
+
+
+def build(db, output, neighbours=None, fasta=None, mmseqs="mmseqs", tmp_dir=None):
+    """Build the exact-match index of the target DB."""
+    partial = f"{output}.partial"
+    if os.path.exists(partial):
+        os.remove(partial)
+    with tempfile.TemporaryDirectory(dir=tmp_dir) as tmp:
+        tmp = Path(tmp)
+        if fasta is None:
+            fasta = tmp / "targets.fasta"
+            run_mmseqs(mmseqs, "convert2fasta", db, fasta)
+        if neighbours is None:
+            neighbours = tmp / "all_vs_all.m8"
+            run_mmseqs(mmseqs, "easy-search", fasta, db, neighbours, tmp / "tmp")
+
+        connection = create_index(partial)
+        with connection:
+            with open(fasta) as f:
+                add_sequences(connection, f)
+            with open(neighbours) as f:
+                add_neighbours(connection, f)
+        connection.close()
+    os.replace(partial, output)
+    logging.info("Exact-match index written to %s", output)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    build_parser = commands.add_parser("build", help="Build the exact-match index of a target DB")
+    build_parser.add_argument("--db", required=True, help="Path to the mmseqs target DB")
+    build_parser.add_argument("--output", required=True, help="Path to the index file")
+    build_parser.add_argument("--neighbours", help="m8 output of the all-vs-all search of the target DB")
+    build_parser.add_argument("--fasta", help="FASTA of the target DB, exported with convert2fasta when missing")
+    build_parser.add_argument("--mmseqs", default=os.getenv("MMSEQS_BIN", "mmseqs"), help="Command running mmseqs")
+    build_parser.add_argument("--tmp-dir", help="Scratch directory")
+    args = parser.parse_args(argv)
+    build(args.db, args.output, args.neighbours, args.fasta, args.mmseqs, args.tmp_dir)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s", stream=sys.stdout)
+    main(sys.argv[1:])
@@ -0,0 +1,112 @@
+"""Incremental results of the large jobs, served while the job is RUNNING.
+
+mmseqs writes the hits of a search only at its end. A job with more query residues than the step
+size is searched in steps of at most PARTIAL_RESULT_RESIDUES residues instead, in the submission
+order, and the hits of each step are appended to <RESULT_DIR>/.partial/<job_id>/hits.m8 as soon as
+the step is done. After each append the progress is replaced atomically in progress.json:
+
+    {"queries_done": 120, "queries_total": 500, "bytes": 5242880}
+
+The api serves the first `bytes` bytes of the hits (whole lines of the steps done) while the job
+runs. Once all the steps are done the result of the job is written as usual and the partial
+result is removed. The alignment DBs of the steps are kept as <job_id>-s<i> and listed in the
+alignment directory of the job, as for the jobs split into chunks.
+"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from chunking import count_residues, split_records
+from mmseqs_service import fsync_path
+from summary import count_queries
+from tracing import tracer
+
+PARTIAL_DIR_NAME = ".partial"
+HITS_FILE = "hits.m8"
+PROGRESS_FILE = "progress.json"
+
+
+def step_id(job_id, index):
+    return f"{job_id}-s{index}"
+
+
+class IncrementalSearch(object):
+    """Searches the large jobs in steps and publishes the hits of each step."""
+
+    def __init__(self, mmseqs_service, max_residues):
+        """
+        Args:
+            mmseqs_service (MMSeqsService): Service running the searches and saving the results.
+            max_residues (int): Maximum number of query residues searched in a step.
+        """
+        self.mmseqs_service = mmseqs_service
+        self.max_residues = max_residues
+        self.partial_path = mmseqs_service.result_path / PARTIAL_DIR_NAME
+
+    def applies(self, job):
+        return count_residues(job.get("fasta") or "") > self.max_residues
+
+    def search(self, job):
+        """Search the job step by step, publishing the hits of each step, and return the result path.
+
+        The exact-match fast path is not used, all the queries are searched.
+        """
+        job_id, fasta_content = self.mmseqs_service.extract_job_id_fasta(job)
+        steps = split_records(fasta_content, self.max_residues)
+        queries_total = count_queries(fasta_content)
+        partial_dir = self.partial_path / job_id
+        # a redelivered job starts over
+        shutil.rmtree(partial_dir, ignore_errors=True)
+        partial_dir.mkdir(parents=True)
+        try:
+            with self.mmseqs_service.target_db(job.get("db_version")) as db, tempfile.TemporaryDirectory(
+                dir=self.mmseqs_service.workspace_path
+            ) as tmpdirname:
+                temp_dir = Path(tmpdirname)
+                with open(partial_dir / HITS_FILE, "wb") as hits:
+                    queries_done = 0
+                    for index, step in enumerate(steps):
+                        step_dir = temp_dir / str(index)
+                        step_dir.mkdir()
+                        query_file = step_dir / "input.fasta"
+                        query_file.write_text(step)
+                        step_file = step_dir / "step.m8"
+                        with tracer.start_span("worker.search_step", job_id=job_id, step=index):
+                            self.mmseqs_service.run_search(
+                                job_id, query_file, db.path, step_dir / step_id(job_id, index), step_file, step_dir / "tmp"
+                            )
+                        with open(step_file, "rb") as f:
+                            shutil.copyfileobj(f, hits)
+                        hits.flush()
+                        os.fsync(hits.fileno())
+                        queries_done += count_queries(step)
+                        self.write_progress(partial_dir, queries_done, queries_total, hits.tell())
+                        logging.info("Job %s: %s of %s queries searched", job_id, queries_done, queries_total)
+
+                # the result is saved from the partial hits, the api serves them until the result is there
+                result_file = temp_dir / f"{job_id}.m8"
+                result_file.symlink_to(partial_dir / HITS_FILE)
+                final_result_file = self.mmseqs_service.save_result(job_id, result_file)
+                for index in range(len(steps)):
+                    self.mmseqs_service.keep_alignment(
+                        step_id(job_id, index), temp_dir / str(index) / step_id(job_id, index), db.version
+                    )
+                self.mmseqs_service.link_alignments(job_id, [step_id(job_id, index) for index in range(len(steps))])
+                return final_result_file
+        finally:
+            # a failed job leaves no partial result behind
+            shutil.rmtree(partial_dir, ignore_errors=True)
+
+    def write_progress(self, partial_dir, queries_done, queries_total, size):
+        """Replace the progress of the partial result, readers see the previous or the new progress."""
+        progress_file = partial_dir / PROGRESS_FILE
+        staging_file = partial_dir / f"{PROGRESS_FILE}.partial"
+        staging_file.write_text(
+            json.dumps({"queries_done": queries_done, "queries_total": queries_total, "bytes": size})
+        )
+        fsync_path(staging_file)
+        os.replace(staging_file, progress_file)
@@ -1,6 +1,17 @@
-import json
 import logging
 import requests
+from logs import Payload
+from retry import TransientError
+from tracing import TRACEPARENT_HEADER, tracer
+
+
+class StatusConflict(Exception):
+    """The metadata database refused the update, the job is in a status it cannot go from (e.g. CANCELLED)."""
+
+    def __init__(self, job_id, status):
+        super().__init__(f"Job {job_id} is {status}")
+        self.job_id = job_id
+        self.status = status
 
 
 class JobStatusUpdater:
@@ -9,20 +20,98 @@ class JobStatusUpdater:
     def __init__(self, api_base_url):
         self.api_base_url = api_base_url
 
-    def update_job_status(self, job_id, job_status, timestamp=None):
+    def update_job_status(self, job_id, job_status, timestamp=None, summary=None, error=None):
         api_url = f"{self.api_base_url}/job/{job_id}"
-        logging.info(f"Updating job {job_id} status to {job_status} at {api_url}")
+        logging.info("Updating job %s status to %s at %s", job_id, job_status, api_url)
 
         if timestamp is None:
             payload = {"status": job_status}
         else:
             payload = {"status": job_status, "completed_at": timestamp}
+        if summary is not None:
+            # hit counts and best hits of the result, listed without reading the result file
+            payload["summary"] = summary
+        if error is not None:
+            # reason of a FAILED job, shown with its status
+            payload["error"] = error
+
+        try:
+            logging.info("Sending to %s payload: %s", api_url, Payload(payload))
+            with tracer.start_span("metadb.update_job_status", job_id=job_id, status=job_status) as span:
+                response = requests.patch(
+                    api_url, json=payload, headers={TRACEPARENT_HEADER: span.traceparent}
+                )
+                self.raise_for_conflict(job_id, response)
+                response.raise_for_status()
+            logging.info("Updated job %s status to %s", job_id, job_status)
+        except requests.RequestException as e:
+            self.raise_request_error(f"Failed to update job status for {job_id}", e)
+
+    def get_job_status(self, job_id):
+        """Return the status of the job, None if the job is not in the database."""
+        api_url = f"{self.api_base_url}/job/{job_id}"
+        try:
+            with tracer.start_span("metadb.get_job_status", job_id=job_id) as span:
+                response = requests.get(api_url, headers={TRACEPARENT_HEADER: span.traceparent})
+                if response.status_code == 404:
+                    return None
+                response.raise_for_status()
+            return response.json().get("status")
+        except requests.RequestException as e:
+            self.raise_request_error(f"Failed to read job status for {job_id}", e)
 
+    def create_job(self, job_id, parent_id=None):
+        """Register the job as QUEUED unless it already exists, e.g. a chunk of a job split by the worker."""
+        api_url = f"{self.api_base_url}/job/{job_id}"
+        payload = {"parent_id": parent_id}
+        try:
+            logging.info("Sending to %s payload: %s", api_url, Payload(payload))
+            with tracer.start_span("metadb.create_job", job_id=job_id) as span:
+                response = requests.put(api_url, json=payload, headers={TRACEPARENT_HEADER: span.traceparent})
+                response.raise_for_status()
+            logging.info("Registered job %s", job_id)
+        except requests.RequestException as e:
+            self.raise_request_error(f"Failed to register job {job_id}", e)
+
+    def claim_job(self, job_id, owner, lease_seconds):
+        """Set the job RUNNING for the owner until the lease expires, renewed by claiming it again.
+
+        Raises StatusConflict if the job is not QUEUED nor RUNNING without another owner holding its lease.
+        """
+        api_url = f"{self.api_base_url}/job/{job_id}/claim"
+        payload = {"owner": owner, "lease_seconds": lease_seconds}
         try:
-            logging.info(f"Sending to {api_url} payload: {json.dumps(payload)}")
-            response = requests.patch(api_url, json=payload)
-            response.raise_for_status()
-            logging.info(f"Updated job {job_id} status to {job_status}")
+            with tracer.start_span("metadb.claim_job", job_id=job_id) as span:
+                response = requests.post(api_url, json=payload, headers={TRACEPARENT_HEADER: span.traceparent})
+                self.raise_for_conflict(job_id, response)
+                response.raise_for_status()
         except requests.RequestException as e:
-            logging.error(f"Failed to update job status for {job_id}: {e}")
-            raise Exception(f"Failed to update job status for {job_id}: {e}")
+            self.raise_request_error(f"Failed to claim job {job_id}", e)
+
+    def release_job(self, job_id, owner):
+        """Give up the claim of the job, any worker may claim it again."""
+        api_url = f"{self.api_base_url}/job/{job_id}/claim"
+        try:
+            with tracer.start_span("metadb.release_job", job_id=job_id) as span:
+                response = requests.delete(
+                    api_url, params={"owner": owner}, headers={TRACEPARENT_HEADER: span.traceparent}
+                )
+                self.raise_for_conflict(job_id, response)
+                response.raise_for_status()
+        except requests.RequestException as e:
+            self.raise_request_error(f"Failed to release job {job_id}", e)
+
+    @staticmethod
+    def raise_for_conflict(job_id, response):
+        # the job changed meanwhile, the metadb tells which status it is in
+        if response.status_code == 409:
+            raise StatusConflict(job_id, response.json()["detail"]["status"])
+
+    @staticmethod
+    def raise_request_error(message, e):
+        logging.error("%s: %s", message, e)
+        # the metadb being down or overloaded is worth a retry, a rejected update is not
+        status_code = e.response.status_code if e.response is not None else None
+        if status_code is None or status_code >= 500:
+            raise TransientError(f"{message}: {e}")
+        raise Exception(f"{message}: {e}")
@@ -0,0 +1,86 @@
+"""Per-job limits of the mmseqs runs.
+
+A pathological query must not hold a worker (and the queue behind it) forever. While mmseqs runs
+the worker checks the wall time of the job since its delivery and the size of the scratch
+workspace, the mmseqs process is killed once a limit is exceeded and the job fails with the reason
+(no retry, the same query would exceed it again). The memory of the search is bounded by mmseqs
+itself with --split-memory-limit, the target DB is then searched in splits that fit.
+"""
+
+import os
+import threading
+import time
+
+
+class LimitExceeded(Exception):
+    """The job exceeded one of its limits, it is marked FAILED with the reason."""
+
+    def __init__(self, limit, reason):
+        super().__init__(reason)
+        self.limit = limit
+
+
+def directory_size(path):
+    """Return the bytes used by the files under path, the files removed meanwhile are skipped."""
+    total = 0
+    try:
+        with os.scandir(path) as it:
+            entries = list(it)
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += directory_size(entry.path)
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except FileNotFoundError:
+            continue
+    return total
+
+
+class JobLimits(object):
+    """Wall time and scratch disk limits of the job being searched."""
+
+    def __init__(self, wall_time_seconds=0, scratch_bytes=0, scratch_check_seconds=5.0, clock=time.monotonic):
+        """
+        Args:
+            wall_time_seconds (float): Time a job may take from its delivery, 0 for no limit.
+            scratch_bytes (int): Bytes the job may use in the workspace, 0 for no limit.
+            scratch_check_seconds (float): Seconds between two measures of the workspace, walking it is not free.
+            clock (callable): Monotonic clock, in seconds.
+        """
+        self.wall_time_seconds = wall_time_seconds
+        self.scratch_bytes = scratch_bytes
+        self.scratch_check_seconds = scratch_check_seconds
+        self.clock = clock
+        # the job searched by the thread, the benchmarks run several consumers in threads
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.wall_time_seconds or self.scratch_bytes)
+
+    def start(self):
+        """Start the clock of the job delivered to the thread."""
+        now = self.clock()
+        self._local.deadline = now + self.wall_time_seconds if self.wall_time_seconds else None
+        self._local.next_scratch_check = now
+
+    def stop(self):
+        self._local.deadline = None
+
+    def exceeded(self, workspace_path):
+        """Return the LimitExceeded of the job, None while it is within its limits."""
+        deadline = getattr(self._local, "deadline", None)
+        now = self.clock()
+        if deadline is not None and now > deadline:
+            return LimitExceeded("wall_time", f"Job exceeded the wall time limit of {self.wall_time_seconds:g}s")
+        if self.scratch_bytes and now >= getattr(self._local, "next_scratch_check", now):
+            self._local.next_scratch_check = now + self.scratch_check_seconds
+            used = directory_size(workspace_path)
+            if used > self.scratch_bytes:
+                return LimitExceeded(
+                    "scratch", f"Job exceeded the scratch disk limit of {self.scratch_bytes} bytes ({used} bytes used)"
+                )
+        return None
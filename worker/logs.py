@@ -0,0 +1,150 @@
+"""Logging of the worker, cheap on the hot path of the jobs.
+
+A job carries its whole FASTA, logging the job as is writes megabytes per job and formats them on
+the thread searching it. The records are handed to a background thread through a bounded queue:
+the message is formatted there, never on the thread logging it, and a record that does not fit in
+the full queue is dropped (and counted) instead of blocking the search. Repetitive messages are
+sampled, a burst of each message template is logged per interval, the rest are counted and the
+count is appended to the next one logged. The jobs are logged through Payload, the FASTA as a
+number of queries and bytes.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from metrics import LOG_RECORDS_DROPPED
+
+FORMAT = "%(asctime)s %(levelname)s %(message)s"
+# characters of a value logged with truncate
+MAX_LENGTH = 200
+REDACTED = "***"
+
+
+def truncate(value, limit=MAX_LENGTH):
+    """Return str(value) cut to limit characters, with the number of characters cut."""
+    text = str(value)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}...({len(text) - limit} more characters)"
+
+
+class Payload(object):
+    """Job message or request payload as logged, formatted only when the record is written.
+
+    The FASTA is summarized as its number of queries and bytes, the other fields are truncated.
+    """
+
+    __slots__ = ("payload",)
+
+    def __init__(self, payload):
+        self.payload = payload
+
+    def __str__(self):
+        fields = []
+        for key, value in self.payload.items():
+            if key == "fasta" and isinstance(value, str):
+                fields.append(f"fasta=<{value.count('>')} queries, {len(value.encode())} bytes>")
+            else:
+                fields.append(f"{key}={truncate(value)}")
+        return "{" + ", ".join(fields) + "}"
+
+
+class SamplingFilter(logging.Filter):
+    """Logs a burst of each message template per interval, the records above max_level always pass."""
+
+    def __init__(self, burst=20, interval=10.0, max_level=logging.INFO, clock=time.monotonic):
+        """
+        Args:
+            burst (int): Records of a message template logged per interval.
+            interval (float): Seconds of a sampling window, 0 to log everything.
+            max_level (int): Level up to which the records are sampled.
+            clock (callable): Monotonic clock, in seconds.
+        """
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_level = max_level
+        self.clock = clock
+        # (template, level) -> [window start, records logged, records suppressed]
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not self.interval or record.levelno > self.max_level:
+            return True
+        # the template, not the formatted message: the same message with other arguments is the same message
+        key = (record.msg, record.levelno)
+        now = self.clock()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if len(self._windows) > 10000:
+                    # the messages of other libraries may be formatted before logging, keep the table bounded
+                    self._windows = {key: self._windows[key]}
+            elif window[1] < self.burst:
+                window[1] += 1
+                suppressed = 0
+            else:
+                window[2] += 1
+                return False
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """Hands the records to the listener thread, drops them when the queue is full."""
+
+    def __init__(self, queue):
+        super().__init__(queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # the stdlib handler formats the message here, on the logging thread, the listener formats it instead
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+
+def setup_logging(level=logging.INFO, queue_size=10000, sample_burst=20, sample_interval=10.0, stream=None):
+    """Configure the root logger, returning the listener of the queue (None when the queue is off).
+
+    Args:
+        level (int or str): Level of the root logger.
+        queue_size (int): Records waiting for the listener thread, 0 to write them on the logging thread.
+        sample_burst (int): Records of a message template logged per sampling window.
+        sample_interval (float): Seconds of a sampling window, 0 to log everything.
+        stream (file): Stream the records are written to, stdout by default.
+    """
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(logging.Formatter(FORMAT))
+    listener = None
+    if queue_size > 0:
+        listener = logging.handlers.QueueListener(queue.Queue(queue_size), output)
+        handler = BoundedQueueHandler(listener.queue)
+    else:
+        handler = output
+    handler.addFilter(SamplingFilter(sample_burst, sample_interval))
+
+    root = logging.getLogger()
+    for previous in root.handlers[:]:
+        root.removeHandler(previous)
+    root.addHandler(handler)
+    root.setLevel(level)
+    if listener is not None:
+        listener.start()
+        # the records still queued are written on exit
+        atexit.register(listener.stop)
+    return listener
@@ -0,0 +1,64 @@
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+# Jobs run for seconds up to hours, the default prometheus buckets stop at 10s.
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400, float("inf"))
+SIZE_BUCKETS = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8, 1e9, float("inf"))
+
+JOB_QUEUE_WAIT = Histogram(
+    "worker_job_queue_wait_seconds",
+    "Time between publishing the job by the api and the worker picking it up.",
+    buckets=DURATION_BUCKETS,
+)
+MMSEQS_DURATION = Histogram(
+    "worker_mmseqs_duration_seconds",
+    "Wall time of the mmseqs search.",
+    buckets=DURATION_BUCKETS,
+)
+RESULT_SIZE = Histogram(
+    "worker_result_size_bytes",
+    "Size of the result file written by the mmseqs search.",
+    buckets=SIZE_BUCKETS,
+)
+JOBS_FINISHED = Counter("worker_jobs_finished", "Number of jobs processed successfully.")
+JOBS_FAILED = Counter("worker_jobs_failed", "Number of jobs that failed to process and were dead-lettered.")
+JOBS_CANCELLED = Counter("worker_jobs_cancelled", "Number of cancelled jobs skipped on delivery or stopped while searched.")
+JOBS_CLAIM_CONFLICTS = Counter(
+    "worker_jobs_claim_conflicts",
+    "Number of jobs not searched as another worker claimed them, by the status they were in.",
+    labelnames=["status"],
+)
+JOBS_LIMIT_EXCEEDED = Counter(
+    "worker_jobs_limit_exceeded", "Number of jobs killed for exceeding a limit.", labelnames=["limit"]
+)
+JOBS_RETRIED = Counter("worker_jobs_retried", "Number of transient job failures sent to a delay queue.")
+RESULTS_REUSED = Counter(
+    "worker_results_reused",
+    "Number of jobs finished with the result already on the results volume, e.g. after a redelivery.",
+)
+JOBS_CHUNKED = Counter("worker_jobs_chunked", "Number of large jobs split into chunks by the worker.")
+SHARD_PARTS = Counter("worker_shard_parts", "Number of shard searches of sharded jobs run by the worker.")
+RESULTS_EVICTED = Counter(
+    "worker_results_evicted",
+    "Number of results evicted from the results volume.",
+    labelnames=["reason"],
+)
+EXACT_MATCH_QUERIES = Counter(
+    "worker_exact_match_queries",
+    "Number of queries looked up in the exact-match index, by hit or miss.",
+    labelnames=["result"],
+)
+DB_VERSION_ACTIVE = Gauge(
+    "worker_db_version_active",
+    "Target DB versions served by the worker, 1 for the version new jobs use, 0 for the retiring ones.",
+    labelnames=["version"],
+)
+DB_VERSION_IN_FLIGHT = Gauge("worker_db_version_in_flight", "Jobs in flight per target DB version.", labelnames=["version"])
+LOG_RECORDS_DROPPED = Counter(
+    "worker_log_records_dropped", "Number of log records dropped as the queue of the log writer was full."
+)
+RESULTS_BYTES = Gauge("worker_results_bytes", "Size of the results kept on the results volume after the last sweep.")
+
+
+def start_metrics_server(port):
+    """Expose the metrics on http://0.0.0.0:{port}/metrics in a background thread."""
+    start_http_server(port)
@@ -1,19 +1,155 @@
-import json
+import hashlib
+import os
+import shlex
+import signal
+import uuid
+import zlib
+from contextlib import contextmanager
 from pathlib import Path
 import subprocess
 import logging
 import tempfile
+import threading
 import shutil
+from cancellation import JobCancelled
+from claim import ClaimLost
+from db_registry import DbVersion
+from exact_match import merge_hits, read_fasta
+from metrics import EXACT_MATCH_QUERIES
+from tracing import tracer
+
+ALIGNMENT_DIR_NAME = "alignments"
+# results are written there first, on the results volume so the final rename is atomic
+STAGING_DIR_NAME = ".staging"
+# sha256sum style marker written next to a complete result
+CHECKSUM_SUFFIX = ".sha256"
+# target DB version of the search, kept in the alignment directory for convertalis
+DB_VERSION_FILE = "db_version"
+# chunk ids of a job split into chunks, the only file in the alignment directory of the job
+CHUNKS_FILE = "chunks"
+# seconds between two checks for a cancellation while mmseqs runs
+WAIT_STEP_SECONDS = 0.5
+# seconds mmseqs gets to exit after SIGTERM before it is killed
+TERMINATE_GRACE_SECONDS = 10
+# bytes of the output of mmseqs kept for the error messages, mmseqs logs every step of a long search
+OUTPUT_TAIL_BYTES = 64 * 1024
+
+
+def gzip_file(src, dst, level=6, chunk_size=0):
+    """Gzip compress src into dst.
+
+    With a chunk size the compressor is fully flushed every chunk_size input bytes (at a line
+    boundary), a reader can start decompressing at any of these block boundaries. The output is a
+    single gzip member either way, so any gzip client can decompress it.
+    """
+    # wbits 31: gzip container, header mtime 0 so the same result gives the same bytes
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    read_size = chunk_size or 1024 * 1024
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        while block := fin.read(read_size):
+            if chunk_size:
+                block += fin.readline()
+            fout.write(compressor.compress(block))
+            if chunk_size:
+                fout.write(compressor.flush(zlib.Z_FULL_FLUSH))
+        fout.write(compressor.flush())
+
+
+def file_checksum(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(chunk_size):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def fsync_path(path):
+    """Flush the file, or the directory entries, at path to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def checksum_marker(result_file):
+    return result_file.with_name(result_file.name + CHECKSUM_SUFFIX)
+
+
+class OutputTail(object):
+    """Drains a pipe of a process in a background thread, keeping only its last bytes."""
+
+    def __init__(self, pipe, max_bytes=OUTPUT_TAIL_BYTES):
+        self.max_bytes = max_bytes
+        self.buffer = bytearray()
+        self.thread = threading.Thread(target=self._drain, args=(pipe,), daemon=True)
+        self.thread.start()
+
+    def _drain(self, pipe):
+        with pipe:
+            while chunk := pipe.read1(64 * 1024):
+                self.buffer += chunk
+                if len(self.buffer) > self.max_bytes:
+                    del self.buffer[: len(self.buffer) - self.max_bytes]
+
+    def text(self):
+        """Return the kept output once the pipe is closed."""
+        self.thread.join()
+        return self.buffer.decode(errors="replace")
 
 
 class MMSeqsService(object):
-    def __init__(self, db_dir, workspace_dir, result_dir):
+    def __init__(
+        self,
+        db_dir,
+        workspace_dir,
+        result_dir,
+        mmseqs_bin="mmseqs",
+        compression="gzip",
+        compression_level=6,
+        compression_chunk_size=0,
+        exact_match_index=None,
+        db_registry=None,
+        cancellation=None,
+        limits=None,
+        split_memory_limit="",
+        claim=None,
+    ):
         """Initialize paths for MMseqs2 service.
         Args:
             db_dir (str): Path to MMseqs2 database directory.
             workspace_dir (str): Path to temporary workspace directory(scratch).
             result_dir (str): Path to results directory in PVC.
+            mmseqs_bin (str): Command running mmseqs, may include arguments (e.g. a simulated mmseqs).
+            compression (str): "gzip" to store the results compressed ({job_id}.m8.gz), "none" for plain .m8.
+            compression_level (int): zlib compression level.
+            compression_chunk_size (int): Input bytes between the flush points of the compressed
+                results, 0 for a plain gzip stream.
+            exact_match_index (ExactMatchIndex): Precomputed hits of the target sequences, the queries
+                identical to a target are answered from it without searching. None to search all queries.
+            db_registry (DbRegistry): Versions of the target DB, the jobs are searched against the version
+                they were submitted for. None to search db_dir (with exact_match_index) for all jobs.
+            cancellation (CancellationWatch): Watch of the jobs being searched, mmseqs is terminated when
+                one is cancelled. None to let mmseqs run to the end.
+            limits (JobLimits): Wall time and scratch disk limits of the job, mmseqs is killed when one
+                is exceeded. None for no limit.
+            split_memory_limit (str): Memory the mmseqs search may use (e.g. "8G"), the target DB is
+                searched in splits that fit. Empty to let mmseqs size the splits from the free memory.
+            claim (JobClaim): Claim of the job being searched, its lease is renewed while mmseqs runs and
+                mmseqs is terminated if another worker took the job over. None to leave the claim as it is.
         """
+        if compression not in ("gzip", "none"):
+            raise ValueError(f"Unsupported result compression: {compression}")
+        self.mmseqs_cmd = shlex.split(mmseqs_bin)
+        self.compression = compression
+        self.compression_level = compression_level
+        self.compression_chunk_size = compression_chunk_size
+        self.exact_match_index = exact_match_index
+        self.db_registry = db_registry
+        self.cancellation = cancellation
+        self.limits = limits
+        self.split_memory_limit = split_memory_limit
+        self.claim = claim
         # directory initialised by init pod
         self.db_path = Path(db_dir)
         # local temp workspace
@@ -21,67 +157,331 @@ class MMSeqsService(object):
         self.workspace_path.mkdir(parents=True, exist_ok=True)
         # pvc
         self.result_path = Path(result_dir)
+        # query and alignment DBs of the searched jobs, the api looks for them there too
+        self.alignment_path = self.result_path / ALIGNMENT_DIR_NAME
 
     def mmseqs2_search(self, job):
-        """Run mmseqs easy-search on a FASTA sequence from the job."""
+        """Run the mmseqs search on a FASTA sequence from the job and return the result path.
 
-        logging.info(f"Starting mmseqs2_search with job: {json.dumps(job)}")
-        job_id, fasta_content = self.extract_job_id_fasta(job)
+        The search runs as createdb, search and convertalis, the query and alignment DBs are kept
+        in the alignment directory so other output formats can be generated without searching again.
+        """
 
-        logging.info(f"job_id: {job_id} and fasta_content: {fasta_content}")
+        job_id, fasta_content = self.extract_job_id_fasta(job)
+        logging.info("Starting mmseqs2_search of job %s", job_id)
 
-        with tempfile.TemporaryDirectory(dir=self.workspace_path) as tmpdirname:
+        with self.target_db(job.get("db_version")) as db, tempfile.TemporaryDirectory(dir=self.workspace_path) as tmpdirname:
             temp_dir = Path(tmpdirname)
             query_file = temp_dir / "input.fasta"
+            result_file = temp_dir / f"{job_id}.m8"
+
+            records, precomputed = self.lookup_exact_matches(job_id, fasta_content, db.exact_match_index)
+            if precomputed and len(precomputed) == len(records):
+                logging.info("All %s queries of job %s answered from the exact-match index", len(records), job_id)
+                with open(result_file, "w") as out:
+                    out.writelines(merge_hits(records, precomputed, []))
+                return self.save_result(job_id, result_file)
 
-            # write FASTA to temp file
+            # write FASTA to temp file, only the queries without an exact match are searched
             with open(query_file, "w") as f:
-                f.write(fasta_content)
+                if precomputed:
+                    f.writelines(f">{q}\n{seq}\n" for i, (q, seq) in enumerate(records) if i not in precomputed)
+                else:
+                    f.write(fasta_content)
 
-            result_file = temp_dir / f"{job_id}.m8"
-            cmd = self.prepare_mmseqs_cmd(result_file, temp_dir, query_file)
-            logging.info(f"Running mmseqs command: {' '.join(cmd)}")
+            job_db_dir = temp_dir / job_id
+            search_file = temp_dir / "search.m8" if precomputed else result_file
+            self.run_search(job_id, query_file, db.path, job_db_dir, search_file, temp_dir / "tmp")
+            if precomputed:
+                with open(search_file) as search_lines, open(result_file, "w") as out:
+                    out.writelines(merge_hits(records, precomputed, search_lines))
+
+            final_result_file = self.save_result(job_id, result_file)
+
+            if precomputed:
+                # the alignment DB misses the exact matches, other output formats need a full search
+                shutil.rmtree(self.alignment_path / job_id, ignore_errors=True)
+                return final_result_file
+            self.keep_alignment(job_id, job_db_dir, db.version)
+            return final_result_file
+
+    def keep_alignment(self, job_id, job_db_dir, db_version=None):
+        """Move the query and alignment DBs of the search to the alignment directory of the job.
+
+        The DBs are kept on the PVC, any worker can run convertalis for the job. The copy goes to
+        the staging directory first, a crash during the copy leaves no partial alignment DB.
+        """
+        job_alignment_dir = self.alignment_path / job_id
+        shutil.rmtree(job_alignment_dir, ignore_errors=True)
+        if db_version is not None:
+            (job_db_dir / DB_VERSION_FILE).write_text(db_version)
+        logging.info("Moving alignment DB from %s to %s", job_db_dir, job_alignment_dir)
+        self.alignment_path.mkdir(parents=True, exist_ok=True)
+        staging_dir = self.staging_path(job_alignment_dir.name)
+        shutil.move(str(job_db_dir), staging_dir)
+        os.replace(staging_dir, job_alignment_dir)
+
+    def link_alignments(self, job_id, chunk_ids):
+        """List the alignment DBs of the chunks of the job in its alignment directory, in order.
+
+        convert_format converts the job chunk by chunk. The list is written once, a list written by
+        another worker in the meantime is kept.
+        """
+        job_alignment_dir = self.alignment_path / job_id
+        if job_alignment_dir.exists():
+            return
+        staging_dir = self.staging_path(job_id)
+        staging_dir.mkdir()
+        (staging_dir / CHUNKS_FILE).write_text("".join(f"{chunk_id}\n" for chunk_id in chunk_ids))
+        self.alignment_path.mkdir(parents=True, exist_ok=True)
+        try:
+            os.replace(staging_dir, job_alignment_dir)
+        except OSError:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def search_part(self, job, part_file):
+        """Search the job against the target DB of the worker (a shard of the full DB) into part_file.
+
+        Only the m8 hits are written, the caller merges them with the hits of the other shards.
+        """
+        job_id, fasta_content = self.extract_job_id_fasta(job)
+        with self.target_db(job.get("db_version")) as db, tempfile.TemporaryDirectory(dir=self.workspace_path) as tmpdirname:
+            temp_dir = Path(tmpdirname)
+            query_file = temp_dir / "input.fasta"
+            query_file.write_text(fasta_content)
+            self.run_search(job_id, query_file, db.path, temp_dir / job_id, part_file, temp_dir / "tmp")
+
+    def run_search(self, job_id, query_file, db_path, job_db_dir, result_file, tmp_dir, format_output=None):
+        """Run createdb, search and convertalis, the query and alignment DBs are written to job_db_dir.
+
+        The hits are written in the default m8 columns, or in the convertalis columns of format_output.
+        """
+        job_db_dir.mkdir()
+        query_db = job_db_dir / "query"
+        alignment_db = job_db_dir / "aln"
+        self.run_mmseqs(job_id, "createdb", query_file, query_db)
+        # the tmp dir will be created and populated by mmseqs
+        search_options = ("--split-memory-limit", self.split_memory_limit) if self.split_memory_limit else ()
+        self.run_mmseqs(job_id, "search", query_db, db_path, alignment_db, tmp_dir, *search_options)
+        options = ("--format-output", format_output) if format_output else ()
+        self.run_mmseqs(job_id, "convertalis", query_db, db_path, alignment_db, result_file, *options)
+
+    @contextmanager
+    def target_db(self, version=None):
+        """Hold the target DB version of the job, the active version of the registry when None."""
+        if self.db_registry is None:
+            yield DbVersion(None, self.db_path, self.exact_match_index, None)
+            return
+        with self.db_registry.acquire(version) as db:
+            yield db
+
+    def lookup_exact_matches(self, job_id, fasta_content, exact_match_index):
+        """Return the (id, sequence) of the queries and the precomputed hits of those identical to a target."""
+        if exact_match_index is None:
+            return [], {}
+        with tracer.start_span("worker.exact_match", job_id=job_id) as span:
+            records = list(read_fasta(fasta_content.splitlines()))
+            precomputed = {}
+            for i, (_, sequence) in enumerate(records):
+                hits = exact_match_index.lookup(sequence)
+                if hits is not None:
+                    precomputed[i] = hits
+            span.attributes["matched"] = len(precomputed)
+        EXACT_MATCH_QUERIES.labels(result="hit").inc(len(precomputed))
+        EXACT_MATCH_QUERIES.labels(result="miss").inc(len(records) - len(precomputed))
+        return records, precomputed
+
+    def convert_format(self, task):
+        """Write the results of a searched job in other output columns and return the result path.
+
+        Only convertalis runs, on the alignment DB kept by mmseqs2_search.
+        """
+        job_id = task.get("job_id")
+        format_output = task.get("format_output")
+        format_id = task.get("format_id")
+        if not job_id or not format_output or not format_id:
+            raise ValueError("Task must contain a job_id, a format_output and a format_id")
+
+        final_result_file = self.find_result(f"{job_id}.{format_id}")
+        if final_result_file is not None:
+            # the api publishes the task again when the result is late
+            logging.info("Result %s already exists", final_result_file)
+            return final_result_file
+
+        alignment_dirs = self.alignment_dirs(job_id)
+        if alignment_dirs is None:
+            raise ValueError(f"Alignment DB of job {job_id} not found")
+        with self.target_db(self.alignment_db_version(alignment_dirs)) as db, tempfile.TemporaryDirectory(dir=self.workspace_path) as tmpdirname:
+            result_file = Path(tmpdirname) / f"{job_id}.{format_id}.m8"
+            with open(result_file, "wb") as out:
+                for index, alignment_dir in enumerate(alignment_dirs):
+                    part_file = Path(tmpdirname) / f"{index}.m8"
+                    self.run_mmseqs(
+                        job_id,
+                        "convertalis",
+                        alignment_dir / "query",
+                        db.path,
+                        alignment_dir / "aln",
+                        part_file,
+                        "--format-output",
+                        format_output,
+                    )
+                    with open(part_file, "rb") as part:
+                        shutil.copyfileobj(part, out)
+            return self.save_result(job_id, result_file)
+
+    def alignment_dirs(self, job_id):
+        """Return the directories of the query and alignment DBs of the job, in order, None if they expired.
+
+        A job split into chunks (or searched in steps) has one directory per chunk.
+        """
+        job_alignment_dir = self.alignment_path / job_id
+        if not job_alignment_dir.is_dir():
+            return None
+        chunks_file = job_alignment_dir / CHUNKS_FILE
+        if not chunks_file.exists():
+            return [job_alignment_dir]
+        alignment_dirs = [self.alignment_path / chunk_id for chunk_id in chunks_file.read_text().split()]
+        if not all(alignment_dir.is_dir() for alignment_dir in alignment_dirs):
+            raise ValueError(f"Alignment DB of a chunk of job {job_id} not found")
+        return alignment_dirs
+
+    @staticmethod
+    def alignment_db_version(alignment_dirs):
+        """Return the target DB version the alignment DBs were searched against, None if not versioned.
+
+        The headers and sequences of convertalis must come from that version.
+        """
+        db_version_file = alignment_dirs[0] / DB_VERSION_FILE
+        return db_version_file.read_text().strip() if db_version_file.exists() else None
+
+    def result_name(self, stem):
+        return f"{stem}.m8.gz" if self.compression == "gzip" else f"{stem}.m8"
+
+    def find_result(self, stem):
+        """Return the result file if it is complete, None if it is missing or does not match its marker.
+
+        Args:
+            stem (str): {job_id} for the search result, {job_id}.{format_id} for other output formats.
+        """
+        result_file = self.result_path / self.result_name(stem)
+        try:
+            expected = checksum_marker(result_file).read_text().split()[0]
+            if file_checksum(result_file) == expected:
+                return result_file
+        except (OSError, IndexError):
+            pass
+        return None
+
+    def staging_path(self, name):
+        """Return a unique path in the staging directory of the results volume."""
+        staging_dir = self.result_path / STAGING_DIR_NAME
+        staging_dir.mkdir(parents=True, exist_ok=True)
+        return staging_dir / f"{name}.{uuid.uuid4().hex}"
+
+    def save_result(self, job_id, result_file):
+        """Write the result to the results folder, compressed if configured, and return its path.
+
+        The result is written to a staging file on the results volume, fsynced and renamed to its
+        final name, so the api never sees a partial result. The checksum marker is written the same
+        way after the rename, a result is complete when its marker matches.
+        """
+        final_result_file = self.result_path / self.result_name(result_file.name.removesuffix(".m8"))
+        staging_file = self.staging_path(final_result_file.name)
+        logging.info("Writing result from %s to %s", result_file, final_result_file)
+        try:
+            with tracer.start_span("worker.write_result", job_id=job_id, compression=self.compression):
+                if self.compression == "gzip":
+                    gzip_file(result_file, staging_file, self.compression_level, self.compression_chunk_size)
+                else:
+                    shutil.copyfile(result_file, staging_file)
+                checksum = file_checksum(staging_file)
+                fsync_path(staging_file)
+                os.replace(staging_file, final_result_file)
+
+                staging_marker = self.staging_path(checksum_marker(final_result_file).name)
+                staging_marker.write_text(f"{checksum}  {final_result_file.name}\n")
+                fsync_path(staging_marker)
+                os.replace(staging_marker, checksum_marker(final_result_file))
+                fsync_path(self.result_path)
+        finally:
+            staging_file.unlink(missing_ok=True)
+        logging.info("Result saved to %s", final_result_file)
+        return final_result_file
+
+    def run_mmseqs(self, job_id, step, *args):
+        cmd = self.prepare_mmseqs_cmd(step, *args)
+        logging.info("Running mmseqs command: %s", " ".join(cmd))
+        with tracer.start_span(f"mmseqs.{step}", job_id=job_id):
+            # the output is drained into bounded buffers, a long search logs a lot. mmseqs runs in its own
+            # process group, the steps of its workflows are stopped with it
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
+            stdout, stderr = OutputTail(process.stdout), OutputTail(process.stderr)
+            try:
+                self.wait(process)
+            finally:
+                output = stderr.text() or stdout.text()
+        if process.returncode != 0:
+            logging.error("mmseqs %s failed: %s", step, output)
+            raise RuntimeError(f"mmseqs {step} failed: {output}")
+
+    def wait(self, process):
+        """Wait for the mmseqs process, terminate it if the job is cancelled, exceeds its limits or was taken over."""
+        if self.cancellation is None and self.claim is None and (self.limits is None or not self.limits.enabled):
+            process.wait()
+            return
+        while True:
             try:
-                subprocess.run(cmd, check=True, capture_output=True)
-            except subprocess.CalledProcessError as e:
-                logging.error(f"mmseqs easy-search failed: {e.stderr.decode()}")
-                raise RuntimeError(f"mmseqs easy-search failed: {e.stderr.decode()}")
+                process.wait(timeout=WAIT_STEP_SECONDS)
+                return
+            except subprocess.TimeoutExpired:
+                job_id = self.cancellation.requested() if self.cancellation is not None else None
+                if job_id is not None:
+                    logging.info("Job %s cancelled, terminating mmseqs", job_id)
+                    self.terminate(process)
+                    raise JobCancelled(job_id)
+                exceeded = self.limits.exceeded(self.workspace_path) if self.limits is not None else None
+                if exceeded is not None:
+                    logging.error("%s, killing mmseqs", exceeded)
+                    self.terminate(process)
+                    raise exceeded
+                try:
+                    if self.claim is not None:
+                        self.claim.renew()
+                except ClaimLost as e:
+                    logging.warning("Claim of job %s lost to another worker, terminating mmseqs", e.job_id)
+                    self.terminate(process)
+                    raise
 
-            # Move the result to results folder
-            final_result_file = self.result_path / f"{job_id}.m8"
-            logging.info(f"Moving result from {result_file} to {final_result_file}")
-            shutil.move(str(result_file), final_result_file)
-            logging.info(f"Result saved to {final_result_file}")
+    @staticmethod
+    def terminate(process):
+        os.killpg(process.pid, signal.SIGTERM)
+        try:
+            process.wait(timeout=TERMINATE_GRACE_SECONDS)
+        except subprocess.TimeoutExpired:
+            pass
+        # the children of mmseqs may outlive it, they hold its output pipes open
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        process.wait()
 
     def extract_job_id_fasta(self, job):
         job_id = job.get("job_id")
         if not job_id:
             raise ValueError("Job must contain a job_id")
 
-        logging.info(f"Got job with job_id: {job_id}")
+        logging.info("Got job with job_id: %s", job_id)
 
         fasta_content = job.get("fasta")
 
         if not fasta_content:
             raise ValueError("No FASTA content in job")
 
-        logging.info(f"FASTA content length: {len(fasta_content)} characters")
+        logging.info("FASTA content length: %d characters", len(fasta_content))
         return job_id, fasta_content
 
-    def prepare_mmseqs_cmd(self, result_file, temp_dir, query_file):
-        # This will be created and populated by mmseqs
-        mmseqs_tmp_dir = temp_dir / "tmp"
-
-        logging.info(f"mmseqs tmp dir: {mmseqs_tmp_dir}")
-
-        # build mmseqs easy-search command
-        cmd = [
-            "mmseqs",
-            "easy-search",
-            str(query_file),
-            str(self.db_path),
-            str(result_file),
-            str(mmseqs_tmp_dir),
-        ]
-
-        return cmd
+    def prepare_mmseqs_cmd(self, step, *args):
+        # build mmseqs <step> command
+        return [*self.mmseqs_cmd, step, *(str(arg) for arg in args)]
@@ -0,0 +1,184 @@
+"""Pairwise alignments of selected hits, rendered on request and cached per pair.
+
+The m8 results carry no alignment strings, writing them for every hit would make the results
+several times larger. The api asks for the alignments of a few query/target pairs with an
+{"task": "align", "job_id": ..., "pairs": [{"query": ..., "target": ...}]} message. The worker
+runs convertalis with the alignment columns on a sub-DB of the alignment DB kept for the job,
+holding only the requested queries. Once the alignment DB has expired, the api sends the submitted
+FASTA with the task and only the requested queries are searched again.
+
+Each pair is written to <RESULT_DIR>/.pair_alignments/<job_id>/<pair_id>.json, a pair that is not
+a hit of the job is written too (with "found": false), so the api stops asking for it.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from exact_match import read_fasta
+
+PAIR_DIR_NAME = ".pair_alignments"
+ALIGNMENT_COLUMNS = "query,target,fident,alnlen,qstart,qend,tstart,tend,evalue,bits,qaln,taln"
+INT_COLUMNS = ("alnlen", "qstart", "qend", "tstart", "tend")
+FLOAT_COLUMNS = ("fident", "evalue", "bits")
+# residues per line of the rendered alignment
+LINE_WIDTH = 60
+
+
+def pair_id(query, target):
+    """File name of the cached alignment of the pair, the same in the api."""
+    return hashlib.md5(f"{query}\t{target}".encode()).hexdigest()[:16]
+
+
+def render(hit, width=LINE_WIDTH):
+    """Render the alignment in blocks of query, match and target lines, BLAST style.
+
+    The match line shows the identical residues, the positions are those of the first and last
+    residue of each line.
+    """
+    qaln, taln = hit["qaln"], hit["taln"]
+    label_width = len(str(max(hit["qend"], hit["tend"])))
+    qpos, tpos = hit["qstart"], hit["tstart"]
+    blocks = []
+    for start in range(0, len(qaln), width):
+        qpart, tpart = qaln[start : start + width], taln[start : start + width]
+        qresidues, tresidues = len(qpart) - qpart.count("-"), len(tpart) - tpart.count("-")
+        match = "".join(q if q == t and q != "-" else " " for q, t in zip(qpart, tpart))
+        blocks.append(
+            "\n".join(
+                (
+                    f"Query  {qpos:<{label_width}}  {qpart}  {qpos + qresidues - 1}",
+                    f"       {'':<{label_width}}  {match}",
+                    f"Sbjct  {tpos:<{label_width}}  {tpart}  {tpos + tresidues - 1}",
+                )
+            )
+        )
+        qpos += qresidues
+        tpos += tresidues
+    return "\n\n".join(blocks) + "\n"
+
+
+def parse_hit(line):
+    hit = dict(zip(ALIGNMENT_COLUMNS.split(","), line.rstrip("\n").split("\t")))
+    for column in INT_COLUMNS:
+        hit[column] = int(hit[column])
+    for column in FLOAT_COLUMNS:
+        hit[column] = float(hit[column])
+    return hit
+
+
+class PairAligner(object):
+    """Writes the alignments of the requested query/target pairs of a job to the pair cache."""
+
+    def __init__(self, mmseqs_service):
+        """
+        Args:
+            mmseqs_service (MMSeqsService): Service running mmseqs, its results volume holds the cache.
+        """
+        self.mmseqs_service = mmseqs_service
+        self.pair_path = mmseqs_service.result_path / PAIR_DIR_NAME
+
+    def cache_file(self, job_id, query, target):
+        return self.pair_path / job_id / f"{pair_id(query, target)}.json"
+
+    def align(self, task):
+        """Write the alignments of the pairs of the task not cached yet, return the number written."""
+        job_id = task.get("job_id")
+        pairs = [(pair["query"], pair["target"]) for pair in task.get("pairs") or []]
+        if not job_id or not pairs:
+            raise ValueError("Task must contain a job_id and pairs")
+        # the api publishes the task until all the pairs are cached
+        missing = list(dict.fromkeys(pair for pair in pairs if not self.cache_file(job_id, *pair).exists()))
+        if not missing:
+            logging.info("Alignments of the %s pairs of job %s already cached", len(pairs), job_id)
+            return 0
+
+        queries = {query for query, _ in missing}
+        with tempfile.TemporaryDirectory(dir=self.mmseqs_service.workspace_path) as tmpdirname:
+            temp_dir = Path(tmpdirname)
+            alignment_dirs = self.mmseqs_service.alignment_dirs(job_id)
+            if alignment_dirs is not None:
+                hits_file = self.extract(job_id, alignment_dirs, queries, temp_dir)
+            elif task.get("fasta"):
+                hits_file = self.realign(job_id, task["fasta"], task.get("db_version"), queries, temp_dir)
+            else:
+                raise ValueError(f"Alignment DB of job {job_id} not found and no FASTA to realign")
+            found = {}
+            with open(hits_file) as f:
+                for line in f:
+                    hit = parse_hit(line)
+                    # the best alignment of a pair comes first
+                    found.setdefault((hit["query"], hit["target"]), hit)
+
+        for query, target in missing:
+            hit = found.get((query, target))
+            entry = {"query": query, "target": target, "found": hit is not None}
+            if hit is not None:
+                entry.update(hit, rendered=render(hit))
+            self.write(job_id, query, target, entry)
+        logging.info("Cached %s pair alignments of job %s, %s hits", len(missing), job_id, len(found))
+        return len(missing)
+
+    def extract(self, job_id, alignment_dirs, queries, temp_dir):
+        """Convert the hits of the queries from the kept alignment DBs, only their entries are read."""
+        hits_file = temp_dir / "hits.m8"
+        with self.mmseqs_service.target_db(self.mmseqs_service.alignment_db_version(alignment_dirs)) as db, open(
+            hits_file, "wb"
+        ) as out:
+            for index, alignment_dir in enumerate(alignment_dirs):
+                keys = self.query_keys(alignment_dir / "query.lookup", queries)
+                if not keys:
+                    continue
+                key_file = temp_dir / f"{index}.keys"
+                key_file.write_text("".join(f"{key}\n" for key in keys))
+                sub_alignment_db = temp_dir / f"{index}.aln"
+                part_file = temp_dir / f"{index}.m8"
+                self.mmseqs_service.run_mmseqs(job_id, "createsubdb", key_file, alignment_dir / "aln", sub_alignment_db)
+                self.mmseqs_service.run_mmseqs(
+                    job_id,
+                    "convertalis",
+                    alignment_dir / "query",
+                    db.path,
+                    sub_alignment_db,
+                    part_file,
+                    "--format-output",
+                    ALIGNMENT_COLUMNS,
+                )
+                with open(part_file, "rb") as part:
+                    shutil.copyfileobj(part, out)
+        return hits_file
+
+    def realign(self, job_id, fasta_content, db_version, queries, temp_dir):
+        """Search the queries again, for a job whose alignment DB has expired."""
+        query_file = temp_dir / "input.fasta"
+        records = read_fasta(fasta_content.splitlines())
+        with open(query_file, "w") as f:
+            f.writelines(f">{query}\n{sequence}\n" for query, sequence in records if query in queries)
+        hits_file = temp_dir / "hits.m8"
+        with self.mmseqs_service.target_db(db_version) as db:
+            self.mmseqs_service.run_search(
+                job_id, query_file, db.path, temp_dir / job_id, hits_file, temp_dir / "tmp", ALIGNMENT_COLUMNS
+            )
+        return hits_file
+
+    @staticmethod
+    def query_keys(lookup_file, queries):
+        keys = []
+        with open(lookup_file) as f:
+            for line in f:
+                key, name, *_ = line.rstrip("\n").split("\t")
+                if name in queries:
+                    keys.append(key)
+        return keys
+
+    def write(self, job_id, query, target, entry):
+        """Write the cached alignment through the staging directory, readers never see a partial file."""
+        cache_file = self.cache_file(job_id, query, target)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        staging_file = self.mmseqs_service.staging_path(cache_file.name)
+        staging_file.write_text(json.dumps(entry))
+        os.replace(staging_file, cache_file)
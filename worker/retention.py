@@ -0,0 +1,250 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from metrics import RESULTS_BYTES, RESULTS_EVICTED
+from mmseqs_service import STAGING_DIR_NAME, checksum_marker
+from incremental import PARTIAL_DIR_NAME
+from pair_alignment import PAIR_DIR_NAME
+from sharding import SHARDS_DIR_NAME
+
+# markers of the tasks published by the api to the workers, one directory per job
+PENDING_DIR_NAME = ".pending"
+
+# plain results were written before the results were compressed
+RESULT_SUFFIXES = (".m8.gz", ".m8")
+
+ResultEntry = namedtuple("ResultEntry", ["job_id", "path", "size", "last_access", "primary"])
+
+
+class ResultRetentionManager(object):
+    """Keeps the results volume within a size budget and a time to live.
+
+    Results older than the TTL are evicted first, then the least recently used ones until the
+    volume is back under the low watermark of the size budget. Jobs whose search result is evicted
+    are marked EXPIRED in the metadata database, submitting them again re-queues the search.
+    The results in other output formats ({job_id}.{format_id}.m8.gz) are evicted the same way
+    without changing the job status, the alignment DBs (and the shard hits of the sharded jobs never
+    merged, the partial results of the searches never finished, the cached pair alignments, the markers of
+    the tasks the api published) are removed after their own TTL. Staging files left behind by a worker
+    that died while writing a result are removed once they are older than the staging TTL.
+    """
+
+    def __init__(
+        self,
+        result_dir,
+        job_status_updater,
+        max_bytes=0,
+        ttl_seconds=0,
+        low_watermark=0.9,
+        alignment_dir=None,
+        alignment_ttl_seconds=0,
+        staging_ttl_seconds=3600,
+    ):
+        """
+        Args:
+            result_dir (str): Path to results directory in PVC.
+            job_status_updater (JobStatusUpdater): Client of the metadata database.
+            max_bytes (int): Size budget of the results, 0 for no budget.
+            ttl_seconds (float): Time to live of a result since its last access, 0 for no TTL.
+            low_watermark (float): Fraction of the budget the size eviction goes down to, so the
+                volume is not swept again on each new result.
+            alignment_dir (str): Path to the directory of the per job alignment DBs.
+            alignment_ttl_seconds (float): Time to live of an alignment DB since the search, 0 for no TTL.
+            staging_ttl_seconds (float): Age after which a staging file is considered abandoned,
+                it must be longer than writing a result takes.
+        """
+        self.result_path = Path(result_dir)
+        self.job_status_updater = job_status_updater
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.low_watermark = low_watermark
+        self.alignment_path = Path(alignment_dir) if alignment_dir else None
+        self.alignment_ttl_seconds = alignment_ttl_seconds
+        self.staging_path = self.result_path / STAGING_DIR_NAME
+        self.staging_ttl_seconds = staging_ttl_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.max_bytes or self.ttl_seconds or (self.alignment_path and self.alignment_ttl_seconds))
+
+    def scan(self):
+        """Return the result files on the volume."""
+        entries = []
+        with os.scandir(self.result_path) as it:
+            for entry in it:
+                if not entry.is_file() or not entry.name.endswith(RESULT_SUFFIXES):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    # evicted by another worker in the meantime
+                    continue
+                # the volume may be mounted with noatime, the write counts as an access
+                last_access = max(st.st_atime, st.st_mtime)
+                job_id, suffix = entry.name.split(".", 1)
+                primary = suffix in ("m8", "m8.gz")
+                entries.append(ResultEntry(job_id, Path(entry.path), st.st_size, last_access, primary))
+        return entries
+
+    def select_evictions(self, entries, now):
+        """Return (entry, reason) pairs to evict, expired results first then the least recently used ones."""
+        evictions = []
+        kept = []
+        for entry in entries:
+            if self.ttl_seconds and now - entry.last_access > self.ttl_seconds:
+                evictions.append((entry, "ttl"))
+            else:
+                kept.append(entry)
+
+        total = sum(entry.size for entry in kept)
+        if self.max_bytes and total > self.max_bytes:
+            target = self.max_bytes * self.low_watermark
+            for entry in sorted(kept, key=lambda e: e.last_access):
+                if total <= target:
+                    break
+                evictions.append((entry, "size"))
+                total -= entry.size
+        return evictions
+
+    def sweep(self, now=None):
+        """Evict the results over the TTL or the size budget, return the ids of the jobs marked expired."""
+        now = time.time() if now is None else now
+        entries = self.scan()
+        evicted = []
+        evicted_bytes = 0
+        for entry, reason in self.select_evictions(entries, now):
+            try:
+                entry.path.unlink()
+            except FileNotFoundError:
+                continue
+            checksum_marker(entry.path).unlink(missing_ok=True)
+            evicted_bytes += entry.size
+            logging.info("Evicted result of job %s (%s bytes, %s)", entry.job_id, entry.size, reason)
+            RESULTS_EVICTED.labels(reason=reason).inc()
+            if not entry.primary:
+                continue
+            try:
+                self.job_status_updater.update_job_status(entry.job_id, "EXPIRED")
+            except Exception as e:
+                # the api also treats a FINISHED job without a result file as expired
+                logging.error("Failed to mark job %s as expired: %s", entry.job_id, e)
+            evicted.append(entry.job_id)
+        RESULTS_BYTES.set(sum(entry.size for entry in entries) - evicted_bytes)
+        self.sweep_alignments(now)
+        self.sweep_shards(now)
+        self.sweep_partials(now)
+        self.sweep_pair_alignments(now)
+        self.sweep_pending(now)
+        self.sweep_staging(now)
+        return evicted
+
+    def sweep_alignments(self, now):
+        """Remove the alignment DBs older than their TTL, return the job ids."""
+        if not self.alignment_path or not self.alignment_ttl_seconds:
+            return []
+        removed = self._sweep_job_dirs(self.alignment_path, self.alignment_ttl_seconds, now)
+        for job_id in removed:
+            logging.info("Removed alignment DB of job %s", job_id)
+            RESULTS_EVICTED.labels(reason="alignment_ttl").inc()
+        return removed
+
+    def sweep_shards(self, now):
+        """Remove the shard hits of the sharded jobs never merged (a shard failed), return the job ids.
+
+        The alignment TTL applies, the parts of a job still running are newer than that.
+        """
+        if not self.alignment_ttl_seconds:
+            return []
+        removed = self._sweep_job_dirs(self.result_path / SHARDS_DIR_NAME, self.alignment_ttl_seconds, now)
+        for job_id in removed:
+            logging.info("Removed shard hits of job %s", job_id)
+        return removed
+
+    def sweep_partials(self, now):
+        """Remove the partial results left by a worker that died during the search, return the job ids.
+
+        The alignment TTL applies, the partial result of a running job is updated after each step.
+        """
+        if not self.alignment_ttl_seconds:
+            return []
+        removed = self._sweep_job_dirs(self.result_path / PARTIAL_DIR_NAME, self.alignment_ttl_seconds, now)
+        for job_id in removed:
+            logging.info("Removed partial result of job %s", job_id)
+        return removed
+
+    def sweep_pair_alignments(self, now):
+        """Remove the cached pair alignments of the jobs with no pair aligned within the alignment TTL, return the job ids."""
+        if not self.alignment_ttl_seconds:
+            return []
+        removed = self._sweep_job_dirs(self.result_path / PAIR_DIR_NAME, self.alignment_ttl_seconds, now)
+        for job_id in removed:
+            logging.info("Removed cached pair alignments of job %s", job_id)
+        return removed
+
+    def sweep_pending(self, now):
+        """Remove the markers of the tasks the api published for the jobs with no task published within the alignment TTL, return the job ids."""
+        if not self.alignment_ttl_seconds:
+            return []
+        return self._sweep_job_dirs(self.result_path / PENDING_DIR_NAME, self.alignment_ttl_seconds, now)
+
+    @staticmethod
+    def _sweep_job_dirs(path, ttl_seconds, now):
+        if not path.is_dir():
+            return []
+        removed = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    expired = now - entry.stat().st_mtime > ttl_seconds
+                except FileNotFoundError:
+                    continue
+                if expired and entry.is_dir():
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    removed.append(entry.name)
+        return removed
+
+    def sweep_staging(self, now):
+        """Remove the abandoned staging files and directories, return their names."""
+        if not self.staging_ttl_seconds or not self.staging_path.is_dir():
+            return []
+        removed = []
+        with os.scandir(self.staging_path) as it:
+            for entry in it:
+                try:
+                    abandoned = now - entry.stat(follow_symlinks=False).st_mtime > self.staging_ttl_seconds
+                except FileNotFoundError:
+                    continue
+                if not abandoned:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    Path(entry.path).unlink(missing_ok=True)
+                logging.info("Removed abandoned staging entry %s", entry.name)
+                removed.append(entry.name)
+        return removed
+
+    def start(self, interval):
+        """Sweep the results volume every interval seconds in a background thread."""
+        self._thread = threading.Thread(target=self._run, args=(interval,), name="result-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self, interval):
+        while not self._stop.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error("Result retention sweep failed: %s", e, exc_info=True)
+            self._stop.wait(interval)
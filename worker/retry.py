@@ -0,0 +1,117 @@
+import logging
+
+import pika
+import requests
+
+# number of times the message was sent to a delay queue, set by the worker
+RETRY_COUNT_HEADER = "x-retry-count"
+# repr of the error the message was dead-lettered with
+ERROR_HEADER = "x-error"
+
+
+class TransientError(Exception):
+    """Failure expected to go away on its own, e.g. the metadata database is unreachable."""
+
+
+def is_transient(error):
+    """Tell whether the job may succeed when retried later.
+
+    Network and metadata database failures are transient. Invalid messages and mmseqs failures
+    (RuntimeError, ValueError) are permanent, retrying them gives the same result.
+    """
+    return isinstance(error, (TransientError, requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError))
+
+
+class RetryPolicy(object):
+    """Retries of the failed jobs through delay queues, with a dead-letter queue for the exhausted ones.
+
+    A delay queue holds the messages for its TTL and then dead-letters them back to the job queue
+    through the default exchange. There is one delay queue per backoff step, messages of a queue
+    all expire in order, so a long delay never holds back a shorter one.
+
+    The job queue itself is declared by the api without arguments, the policy only declares its
+    own queues and publishes to them explicitly, the job queue declaration is left as it is.
+    """
+
+    def __init__(self, queue_name, max_retries=5, base_delay=5, max_delay=600, defer_delay=0):
+        """
+        Args:
+            queue_name (str): Name of the job queue.
+            max_retries (int): Number of retries of a job before it is dead-lettered, 0 to never retry.
+            base_delay (int): Delay in seconds of the first retry, doubled on each following retry.
+            max_delay (int): Upper bound of the delay in seconds.
+            defer_delay (int): Delay in seconds of the deferred messages (not retries), 0 if none are deferred.
+        """
+        self.queue_name = queue_name
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.defer_delay = defer_delay
+
+    @property
+    def dead_letter_queue(self):
+        return f"{self.queue_name}.dead"
+
+    def delay(self, attempt):
+        """Delay in seconds before the retry following the attempt (0 for the first delivery)."""
+        return int(min(self.base_delay * 2**attempt, self.max_delay))
+
+    def delay_queue(self, delay):
+        return f"{self.queue_name}.retry.{delay}s"
+
+    @staticmethod
+    def attempts(properties):
+        """Number of retries the message already went through."""
+        return int((properties.headers or {}).get(RETRY_COUNT_HEADER, 0))
+
+    def declare(self, channel):
+        """Declare the dead-letter queue and the delay queues of every backoff step."""
+        channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+        delays = {self.delay(attempt) for attempt in range(self.max_retries)}
+        if self.defer_delay:
+            delays.add(self.defer_delay)
+        for delay in sorted(delays):
+            channel.queue_declare(
+                queue=self.delay_queue(delay),
+                durable=True,
+                arguments={
+                    "x-message-ttl": delay * 1000,
+                    "x-dead-letter-exchange": "",
+                    "x-dead-letter-routing-key": self.queue_name,
+                },
+            )
+
+    def should_retry(self, properties, error):
+        return is_transient(error) and self.attempts(properties) < self.max_retries
+
+    def retry(self, channel, body, properties):
+        """Publish the message to the delay queue of its next attempt, return the delay."""
+        attempt = self.attempts(properties)
+        delay = self.delay(attempt)
+        headers = dict(properties.headers or {}, **{RETRY_COUNT_HEADER: attempt + 1})
+        self._publish(channel, self.delay_queue(delay), body, properties, headers)
+        return delay
+
+    def defer(self, channel, body, properties):
+        """Publish the message to the delay queue of the deferred messages, its retries are left as they are."""
+        self._publish(channel, self.delay_queue(self.defer_delay), body, properties, dict(properties.headers or {}))
+        return self.defer_delay
+
+    def dead_letter(self, channel, body, properties, error):
+        """Publish the message to the dead-letter queue with the error that made it fail."""
+        headers = dict(properties.headers or {}, **{ERROR_HEADER: repr(error)})
+        self._publish(channel, self.dead_letter_queue, body, properties, headers)
+        logging.info("Message dead-lettered to %s", self.dead_letter_queue)
+
+    def _publish(self, channel, routing_key, body, properties, headers):
+        channel.basic_publish(
+            exchange="",
+            routing_key=routing_key,
+            body=body,
+            properties=pika.BasicProperties(
+                delivery_mode=2,
+                # keep the publish time of the api, the queue wait covers the whole life of the job
+                timestamp=properties.timestamp,
+                headers=headers,
+            ),
+        )
@@ -0,0 +1,166 @@
+"""Scatter-gather search over a target DB split into shards.
+
+The target DB is split into N shards, each served by its own worker pool
+consuming <QUEUE_NAME>.shard.<i>. The workers consuming the job queue do not search: they
+publish one sub-task per shard. Each shard worker writes the hits of its shard to
+<RESULT_DIR>/.shards/<job_id>/<i>.m8, the worker writing the last part merges the parts into the
+result of the job. The merge is idempotent, two workers finishing the last parts at the same
+time write the same result.
+
+The shard DBs are made from the FASTA of the full DB, record i going to shard i mod N:
+
+    mmseqs convert2fasta swissprot swissprot.fasta
+    python sharding.py split --fasta swissprot.fasta --shards 4 --index 0 --output shard.fasta
+    mmseqs createdb shard.fasta swissprot_shard
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from collections import defaultdict
+from pathlib import Path
+
+import pika
+
+from exact_match import read_fasta
+from metrics import SHARD_PARTS
+from tracing import TRACEPARENT_HEADER, tracer
+
+SHARDS_DIR_NAME = ".shards"
+# columns of the default m8 output
+EVALUE_COLUMN = 10
+BITS_COLUMN = 11
+
+
+def shard_queue(queue_name, index):
+    return f"{queue_name}.shard.{index}"
+
+
+def merge_parts(query_ids, part_files, out, shard_count):
+    """Write the hits of the shards grouped by query in the submission order, best bit score first.
+
+    The bit score does not depend on the DB size, the hits of different shards are ranked by it.
+    The e-values of a shard are computed for the size of the shard, they are scaled by the number
+    of shards (the records are dealt evenly to the shards) to be comparable to a search of the full DB.
+    """
+    hits = defaultdict(list)
+    for part_file in part_files:
+        with open(part_file) as f:
+            for line in f:
+                columns = line.rstrip("\n").split("\t")
+                hits[columns[0]].append(columns)
+    for query_id in [*dict.fromkeys(query_ids), *hits]:
+        for columns in sorted(hits.pop(query_id, []), key=lambda c: (-float(c[BITS_COLUMN]), float(c[EVALUE_COLUMN]))):
+            columns[EVALUE_COLUMN] = f"{float(columns[EVALUE_COLUMN]) * shard_count:.3E}"
+            out.write("\t".join(columns) + "\n")
+
+
+def split_fasta(lines, shard_count, index):
+    """Yield the lines of the records of the shard, the records are dealt round-robin."""
+    record = -1
+    for line in lines:
+        if line.startswith(">"):
+            record += 1
+        if record % shard_count == index:
+            yield line
+
+
+class ShardedSearch(object):
+    """Fans the jobs out to the shard queues and gathers the hits of the shards."""
+
+    def __init__(self, mmseqs_service, queue_name, shard_count):
+        """
+        Args:
+            mmseqs_service (MMSeqsService): Service searching the shard of the worker and saving the results.
+            queue_name (str): Name of the job queue, the shard queues are named after it.
+            shard_count (int): Number of shards of the target DB.
+        """
+        self.mmseqs_service = mmseqs_service
+        self.queue_name = queue_name
+        self.shard_count = shard_count
+        self.shards_path = mmseqs_service.result_path / SHARDS_DIR_NAME
+
+    def declare(self, channel):
+        for index in range(self.shard_count):
+            channel.queue_declare(queue=shard_queue(self.queue_name, index), durable=True)
+
+    def scatter(self, channel, job, properties):
+        """Publish one sub-task of the job per shard."""
+        with tracer.start_span("worker.scatter", job_id=job["job_id"], shards=self.shard_count) as span:
+            for index in range(self.shard_count):
+                channel.basic_publish(
+                    exchange="",
+                    routing_key=shard_queue(self.queue_name, index),
+                    body=json.dumps({**job, "shard": index, "shards": self.shard_count}).encode(),
+                    properties=pika.BasicProperties(
+                        delivery_mode=2,
+                        timestamp=properties.timestamp,
+                        headers={TRACEPARENT_HEADER: span.traceparent},
+                    ),
+                )
+        logging.info("Job %s sent to %s shards", job["job_id"], self.shard_count)
+
+    def part_path(self, job_id, index):
+        return self.shards_path / job_id / f"{index}.m8"
+
+    def search(self, job):
+        """Search the shard of the sub-task, return the merged result once all the shards are done, None before."""
+        job_id, index, shard_count = job["job_id"], job["shard"], job["shards"]
+        part_file = self.part_path(job_id, index)
+        if not part_file.exists():
+            # the part appears complete or not at all, a redelivered sub-task does not search again
+            part_file.parent.mkdir(parents=True, exist_ok=True)
+            partial = part_file.with_name(f"{part_file.name}.{uuid.uuid4().hex}.partial")
+            try:
+                self.mmseqs_service.search_part(job, partial)
+                os.replace(partial, part_file)
+            finally:
+                partial.unlink(missing_ok=True)
+            SHARD_PARTS.inc()
+        part_files = [self.part_path(job_id, i) for i in range(shard_count)]
+        if not all(path.exists() for path in part_files):
+            logging.info("Shard %s of job %s done, waiting for the other shards", index, job_id)
+            return None
+        try:
+            result_file = self.gather(job, part_files)
+        except FileNotFoundError:
+            # another worker merged the parts and removed them in the meantime
+            result_file = self.mmseqs_service.find_result(job_id)
+            if result_file is None:
+                raise
+            return result_file
+        shutil.rmtree(self.shards_path / job_id, ignore_errors=True)
+        return result_file
+
+    def gather(self, job, part_files):
+        """Merge the parts of the shards into the result of the job."""
+        job_id = job["job_id"]
+        query_ids = [query_id for query_id, _ in read_fasta(job["fasta"].splitlines())]
+        with tracer.start_span("worker.gather", job_id=job_id, shards=len(part_files)):
+            with tempfile.TemporaryDirectory(dir=self.mmseqs_service.workspace_path) as tmpdirname:
+                result_file = Path(tmpdirname) / f"{job_id}.m8"
+                with open(result_file, "w") as out:
+                    merge_parts(query_ids, part_files, out, len(part_files))
+                return self.mmseqs_service.save_result(job_id, result_file)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    split_parser = commands.add_parser("split", help="Write the FASTA records of one shard")
+    split_parser.add_argument("--fasta", required=True, help="FASTA of the full target DB")
+    split_parser.add_argument("--shards", type=int, required=True, help="Number of shards")
+    split_parser.add_argument("--index", type=int, required=True, help="Index of the shard, from 0")
+    split_parser.add_argument("--output", required=True, help="FASTA of the shard")
+    args = parser.parse_args(argv)
+    with open(args.fasta) as fin, open(args.output, "w") as fout:
+        fout.writelines(split_fasta(fin, args.shards, args.index))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,99 @@
+"""Compact summary of a search result, stored with the job in the metadata database.
+
+Listings show the number of hits and the best hit of each query without reading the result
+files. The summary is computed in one pass over the m8 lines when the job finishes:
+
+    {
+        "queries": 3,
+        "hits": 150,
+        "per_query": {"q1": {"hits": 100, "best": {"target": "P12345", "evalue": 1e-50, "bits": 230.0, "identity": 0.98}}},
+        "per_query_truncated": false,
+        "evalue": {"<=1e-50": 20, "<=1e-10": 80, ...},
+        "identity": {"0.9-1.0": 12, ...}
+    }
+
+The queries are counted in the submitted FASTA, the queries without hits are not in per_query.
+per_query keeps the MAX_PER_QUERY queries with the best hits (highest bit score), the summary of
+a job of many thousand queries stays small enough for the listings. The distributions count the
+hits per bucket, the e-value buckets are upper bounds, the identity buckets are tenths of the
+fraction of identical residues.
+"""
+
+import gzip
+import heapq
+import math
+
+# columns of the default m8 output
+TARGET_COLUMN = 1
+IDENTITY_COLUMN = 2
+EVALUE_COLUMN = 10
+BITS_COLUMN = 11
+EVALUE_BOUNDS = (1e-100, 1e-50, 1e-20, 1e-10, 1e-5, 1e-3, 1.0)
+# queries listed in per_query, the ones with the best hits
+MAX_PER_QUERY = 1000
+
+
+def count_queries(fasta):
+    return sum(1 for line in fasta.splitlines() if line.startswith(">"))
+
+
+def evalue_bucket(evalue):
+    for bound in EVALUE_BOUNDS:
+        if evalue <= bound:
+            return f"<={bound:g}"
+    return f">{EVALUE_BOUNDS[-1]:g}"
+
+
+def identity_bucket(identity):
+    # mmseqs writes the identity as a fraction, blast style percentages are scaled down
+    if identity > 1:
+        identity /= 100
+    tenth = min(int(identity * 10), 9)
+    return f"{tenth / 10:.1f}-{(tenth + 1) / 10:.1f}"
+
+
+def summarize_lines(lines, queries=None, max_per_query=MAX_PER_QUERY):
+    """Return the summary of the m8 lines, the queries are listed in the order of the result.
+
+    Args:
+        lines (Iterable[str]): The m8 lines.
+        queries (int): The number of queries of the job, the queries with hits when None.
+        max_per_query (int): The queries listed in per_query, the ones with the best hits.
+    """
+    per_query = {}
+    evalues = {evalue_bucket(evalue): 0 for evalue in (*EVALUE_BOUNDS, math.inf)}
+    identities = {identity_bucket(tenth / 10): 0 for tenth in range(10)}
+    hits = 0
+    for line in lines:
+        columns = line.rstrip("\n").split("\t")
+        if len(columns) <= BITS_COLUMN:
+            continue
+        hits += 1
+        evalue, bits, identity = float(columns[EVALUE_COLUMN]), float(columns[BITS_COLUMN]), float(columns[IDENTITY_COLUMN])
+        evalues[evalue_bucket(evalue)] += 1
+        identities[identity_bucket(identity)] += 1
+        query = per_query.setdefault(columns[0], {"hits": 0, "best": None})
+        query["hits"] += 1
+        if query["best"] is None or bits > query["best"]["bits"]:
+            query["best"] = {"target": columns[TARGET_COLUMN], "evalue": evalue, "bits": bits, "identity": identity}
+    if queries is None:
+        queries = len(per_query)
+    truncated = len(per_query) > max_per_query
+    if truncated:
+        kept = set(heapq.nlargest(max_per_query, per_query, key=lambda query: per_query[query]["best"]["bits"]))
+        per_query = {query: summary for query, summary in per_query.items() if query in kept}
+    return {
+        "queries": queries,
+        "hits": hits,
+        "per_query": per_query,
+        "per_query_truncated": truncated,
+        "evalue": evalues,
+        "identity": identities,
+    }
+
+
+def summarize(result_file, queries=None):
+    """Return the summary of the result file, gzip compressed or plain, of a job of the given number of queries."""
+    opener = gzip.open if result_file.name.endswith(".gz") else open
+    with opener(result_file, "rt") as f:
+        return summarize_lines(f, queries)
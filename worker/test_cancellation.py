@@ -0,0 +1,45 @@
+import sys
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from cancellation import CancellationWatch, JobCancelled
+from mmseqs_service import MMSeqsService
+
+
+def test_watch_polls_the_status_once_per_interval():
+    updater = MagicMock()
+    updater.get_job_status.side_effect = lambda job_id: "CANCELLED" if job_id == "job1" else "RUNNING"
+    now = [0.0]
+    watch = CancellationWatch(updater, interval=5, clock=lambda: now[0])
+
+    watch.start("job1-0", "job1")
+    assert watch.requested() is None
+    now[0] = 6
+    assert watch.requested() == "job1"
+    assert watch.requested() is None
+    watch.stop()
+    now[0] = 20
+    assert watch.requested() is None
+    assert updater.get_job_status.call_count == 2
+
+
+def test_unreachable_metadb_does_not_cancel():
+    updater = MagicMock()
+    updater.get_job_status.side_effect = ConnectionError("metadb down")
+
+    assert CancellationWatch(updater).cancelled("job1") is None
+
+
+def test_cancelled_job_terminates_mmseqs(tmp_path):
+    updater = MagicMock()
+    updater.get_job_status.return_value = "CANCELLED"
+    watch = CancellationWatch(updater, interval=0)
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", sys.executable, cancellation=watch)
+
+    watch.start("job1")
+    start = time.monotonic()
+    with pytest.raises(JobCancelled):
+        service.run_mmseqs("job1", "-c", "import time; time.sleep(30)")
+    assert time.monotonic() - start < 5
@@ -0,0 +1,68 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from chunking import ChunkedSearch, split_records
+from mmseqs_service import MMSeqsService
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+
+
+def test_split_records_bounds_the_residues_of_a_chunk():
+    fasta = ">q1 first\nMKTA\nYIAK\n>q2\nMKV\n>q3\nMKTAYIAKQRQ\n>q4\nMK"
+
+    chunks = split_records(fasta, 10)
+
+    assert chunks == [">q1 first\nMKTA\nYIAK\n", ">q2\nMKV\n", ">q3\nMKTAYIAKQRQ\n", ">q4\nMK\n"]
+    assert split_records(fasta, 100) == [">q1 first\nMKTA\nYIAK\n>q2\nMKV\n>q3\nMKTAYIAKQRQ\n>q4\nMK\n"]
+
+
+def test_split_registers_and_publishes_the_chunks(tmp_path):
+    channel = MagicMock()
+    updater = MagicMock()
+    chunked = ChunkedSearch(SimpleNamespace(result_path=tmp_path), updater, "jobs", 5)
+    job = {"job_id": "job1", "fasta": ">q1\nMKTA\n>q2\nMKV\n", "db_version": "2025_01"}
+
+    assert chunked.should_split(job)
+    assert chunked.split(channel, job, SimpleNamespace(timestamp=1)) == 2
+
+    assert [c.args for c in updater.create_job.call_args_list] == [("job1-0",), ("job1-1",)]
+    assert {c.kwargs["parent_id"] for c in updater.create_job.call_args_list} == {"job1"}
+    published = [json.loads(c.kwargs["body"]) for c in channel.basic_publish.call_args_list]
+    assert published == [
+        {"job_id": "job1-0", "fasta": ">q1\nMKTA\n", "db_version": "2025_01", "parent_id": "job1", "chunks": 2, "parent_queries": 2},
+        {"job_id": "job1-1", "fasta": ">q2\nMKV\n", "db_version": "2025_01", "parent_id": "job1", "chunks": 2, "parent_queries": 2},
+    ]
+    # chunks are never split again
+    assert not chunked.should_split(published[0])
+
+
+def test_last_chunk_concatenates_the_results(tmp_path):
+    (tmp_path / "results").mkdir()
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", FAKE_MMSEQS)
+    chunked = ChunkedSearch(service, MagicMock(), "jobs", 10)
+    chunks = [
+        {"job_id": "job1-0", "fasta": ">q1\nMKTAYIAKQR\n", "parent_id": "job1", "chunks": 2, "parent_queries": 2},
+        {"job_id": "job1-1", "fasta": ">q2\nMKV\n", "parent_id": "job1", "chunks": 2, "parent_queries": 2},
+    ]
+
+    service.mmseqs2_search(chunks[1])
+    assert chunked.complete(chunks[1]) is None
+    service.mmseqs2_search(chunks[0])
+    result_file = chunked.complete(chunks[0])
+
+    assert result_file == tmp_path / "results" / "job1.m8.gz"
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    queries = [line.split("\t")[0] for line in lines]
+    assert queries == sorted(queries) and set(queries) == {"q1", "q2"}
+    assert not (tmp_path / "results" / "job1-0.m8.gz").exists()
+    # a chunk delivered again after the concatenation gets the result of the job
+    assert chunked.complete(chunks[0]) == result_file
+
+    # the other output formats are converted from the alignment DBs of the chunks
+    converted = service.convert_format({"job_id": "job1", "format_output": "query,target", "format_id": "f1"})
+    lines = gzip.decompress(converted.read_bytes()).decode().splitlines()
+    assert [line.split("\t")[0] for line in lines] == queries
@@ -0,0 +1,42 @@
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+
+from claim import ClaimLost, JobClaim
+from job_status_updater import StatusConflict
+from mmseqs_service import MMSeqsService
+
+
+def test_claim_returns_the_status_of_a_job_claimed_elsewhere():
+    updater = MagicMock()
+    updater.claim_job.side_effect = StatusConflict("job1", "RUNNING")
+
+    assert JobClaim(updater, owner="worker-1").claim("job1") == "RUNNING"
+
+
+def test_lease_is_renewed_once_per_third_of_it():
+    updater = MagicMock()
+    now = [0.0]
+    job_claim = JobClaim(updater, lease_seconds=30, owner="worker-1", clock=lambda: now[0])
+
+    assert job_claim.claim("job1") is None
+    job_claim.renew()
+    now[0] = 11
+    job_claim.renew()
+    job_claim.renew()
+    assert updater.claim_job.call_count == 2
+    job_claim.release("job2")
+    job_claim.release("job1")
+    updater.release_job.assert_called_once_with("job1", "worker-1")
+
+
+def test_lost_claim_terminates_mmseqs(tmp_path):
+    updater = MagicMock()
+    job_claim = JobClaim(updater, lease_seconds=0.1, owner="worker-1")
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", sys.executable, claim=job_claim)
+
+    job_claim.claim("job1")
+    updater.claim_job.side_effect = StatusConflict("job1", "RUNNING")
+    with pytest.raises(ClaimLost):
+        service.run_mmseqs("job1", "-c", "import time; time.sleep(30)")
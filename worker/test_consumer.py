@@ -1,10 +1,20 @@
-
 import json
-import pytest
+import os
+import tempfile
+from types import SimpleNamespace
 from unittest.mock import MagicMock, patch
 
-import consumer
-from consumer import *
+import pytest
+
+# consumer reads its configuration at import time
+os.environ.setdefault("WORKSPACE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("RESULT_DIR", tempfile.mkdtemp())
+
+import consumer  # noqa: E402
+from cancellation import JobCancelled  # noqa: E402
+from job_status_updater import StatusConflict  # noqa: E402
+from limits import LimitExceeded  # noqa: E402
+from retry import ERROR_HEADER, RETRY_COUNT_HEADER, TransientError  # noqa: E402
 
 
 @pytest.fixture
@@ -13,45 +23,277 @@ def mock_channel():
 
 
 @pytest.fixture
-def sample_message():
-    return {"job_id": 123, "payload": "hello"}
+def method():
+    return SimpleNamespace(delivery_tag=42)
+
+
+@pytest.fixture
+def job():
+    return {"job_id": "job1", "fasta": ">q1\nMKTAYIAKQRQISFVKSHFSRQDILDLWIYHTQGYFPQ\n"}
+
+
+def properties(retries=None):
+    headers = {} if retries is None else {RETRY_COUNT_HEADER: retries}
+    return SimpleNamespace(timestamp=None, headers=headers)
+
+
+@pytest.fixture
+def service():
+    with patch.object(consumer, "mmseqs_service") as service:
+        service.find_result.return_value = None
+        service.mmseqs2_search.return_value = MagicMock(**{"stat.return_value.st_size": 10})
+        yield service
+
+
+@pytest.fixture(autouse=True)
+def cancellation():
+    with patch.object(consumer, "cancellation") as cancellation:
+        cancellation.cancelled.return_value = None
+        yield cancellation
+
+
+@pytest.fixture(autouse=True)
+def job_claim():
+    with patch.object(consumer, "job_claim") as job_claim:
+        job_claim.claim.return_value = None
+        yield job_claim
+
+
+@pytest.fixture
+def updater():
+    with patch.object(consumer, "job_status_updater") as updater:
+        yield updater
+
+
+def published(mock_channel):
+    return [(c.kwargs["routing_key"], c.kwargs["properties"].headers) for c in mock_channel.basic_publish.call_args_list]
+
+
+def test_handle_message_success(mock_channel, method, job, service, updater, job_claim):
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    job_claim.claim.assert_called_once_with("job1")
+    service.mmseqs2_search.assert_called_once_with(job)
+    assert [c.args[1] for c in updater.update_job_status.call_args_list] == ["FINISHED"]
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+    mock_channel.basic_publish.assert_not_called()
+
+
+def test_handle_message_skips_search_when_result_exists(mock_channel, method, job, service, updater):
+    service.find_result.return_value = MagicMock()
+
+    consumer.handle_message(mock_channel, method, properties(1), json.dumps(job).encode())
+
+    service.mmseqs2_search.assert_not_called()
+    assert [c.args[1] for c in updater.update_job_status.call_args_list] == ["FINISHED"]
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_transient_failure_goes_to_delay_queue(mock_channel, method, job, service, updater):
+    updater.update_job_status.side_effect = TransientError("metadb down")
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    assert published(mock_channel) == [("task_queue.retry.5s", {RETRY_COUNT_HEADER: 1})]
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_retry_backs_off_exponentially(mock_channel, method, job, service, updater):
+    updater.update_job_status.side_effect = TransientError("metadb down")
+
+    consumer.handle_message(mock_channel, method, properties(3), json.dumps(job).encode())
+
+    assert published(mock_channel) == [("task_queue.retry.40s", {RETRY_COUNT_HEADER: 4})]
+
+
+def test_permanent_failure_is_dead_lettered_and_marked_failed(mock_channel, method, job, service, updater):
+    service.mmseqs2_search.side_effect = RuntimeError("mmseqs search failed")
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    assert updater.update_job_status.call_args.args == ("job1", "FAILED")
+    [(routing_key, headers)] = published(mock_channel)
+    assert routing_key == "task_queue.dead"
+    assert headers[ERROR_HEADER] == "RuntimeError('mmseqs search failed')"
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_exhausted_retries_are_dead_lettered(mock_channel, method, job, service, updater):
+    updater.update_job_status.side_effect = [TransientError("metadb down"), None]
+
+    consumer.handle_message(mock_channel, method, properties(consumer.MAX_RETRIES), json.dumps(job).encode())
+
+    assert published(mock_channel)[0][0] == "task_queue.dead"
+    assert updater.update_job_status.call_args.args == ("job1", "FAILED")
+
+
+def test_invalid_message_is_dead_lettered(mock_channel, method, updater):
+    consumer.handle_message(mock_channel, method, properties(), b"not json")
+
+    assert published(mock_channel)[0][0] == "task_queue.dead"
+    updater.update_job_status.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_message_is_requeued_when_broker_publish_fails(mock_channel, method, job, service, updater):
+    service.mmseqs2_search.side_effect = RuntimeError("mmseqs search failed")
+    mock_channel.basic_publish.side_effect = Exception("channel closed")
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    mock_channel.basic_ack.assert_not_called()
+    mock_channel.basic_nack.assert_called_once_with(delivery_tag=42, requeue=True)
+
+
+def test_sharded_job_is_scattered(mock_channel, method, job, service, updater):
+    with patch.object(consumer, "sharded_search") as sharded_search:
+        consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    sharded_search.scatter.assert_called_once()
+    service.mmseqs2_search.assert_not_called()
+    updater.update_job_status.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_shard_sub_task_finishes_job_once_merged(mock_channel, method, job, service, updater, job_claim):
+    with patch.object(consumer, "sharded_search") as sharded_search:
+        sharded_search.search.return_value = None
+        consumer.handle_message(mock_channel, method, properties(), json.dumps({**job, "shard": 0, "shards": 2}).encode())
+        updater.update_job_status.assert_not_called()
+
+        sharded_search.search.return_value = MagicMock(**{"stat.return_value.st_size": 10})
+        consumer.handle_message(mock_channel, method, properties(), json.dumps({**job, "shard": 1, "shards": 2}).encode())
+
+    assert [c.args[1] for c in updater.update_job_status.call_args_list] == ["FINISHED"]
+    assert mock_channel.basic_ack.call_count == 2
+    # the job was claimed by the worker fanning it out
+    job_claim.claim.assert_not_called()
+
+
+def test_large_job_is_split_into_chunks(mock_channel, method, job, service, updater):
+    with patch.object(consumer, "chunked_search") as chunked_search:
+        chunked_search.should_split.return_value = True
+        consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    chunked_search.split.assert_called_once()
+    service.mmseqs2_search.assert_not_called()
+    updater.update_job_status.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_last_chunk_finishes_the_parent_job(mock_channel, method, job, service, updater):
+    chunk = {**job, "job_id": "job1-1", "parent_id": "job1", "chunks": 2}
+    with patch.object(consumer, "chunked_search") as chunked_search:
+        chunked_search.should_split.return_value = False
+        chunked_search.complete.return_value = MagicMock()
+        consumer.handle_message(mock_channel, method, properties(), json.dumps(chunk).encode())
+
+    assert [c.args[:2] for c in updater.update_job_status.call_args_list] == [
+        ("job1-1", "FINISHED"),
+        ("job1", "FINISHED"),
+    ]
+
+
+def test_failed_chunk_fails_the_parent_job(mock_channel, method, job, service, updater):
+    service.mmseqs2_search.side_effect = RuntimeError("mmseqs search failed")
+    chunk = {**job, "job_id": "job1-1", "parent_id": "job1", "chunks": 2}
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(chunk).encode())
+
+    assert [c.args for c in updater.update_job_status.call_args_list[-2:]] == [("job1-1", "FAILED"), ("job1", "FAILED")]
+
+
+def test_finished_job_is_stored_with_its_summary(mock_channel, method, job, service, updater, tmp_path):
+    result_file = tmp_path / "job1.m8"
+    result_file.write_text("q1\tt1\t0.9\t10\t1\t0\t1\t10\t1\t10\t1E-30\t100\n")
+    service.mmseqs2_search.return_value = result_file
+    job = {**job, "fasta": job["fasta"] + ">q2\nMKV\n"}
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    summary = updater.update_job_status.call_args.kwargs["summary"]
+    assert summary["per_query"]["q1"]["best"]["target"] == "t1"
+    # the query without hits is counted
+    assert summary["queries"] == 2
+
+
+def test_align_task_leaves_the_job_status(mock_channel, method, service, updater):
+    task = {"job_id": "job1", "task": "align", "pairs": [{"query": "q1", "target": "t1"}]}
+    with patch.object(consumer, "pair_aligner") as aligner:
+        consumer.handle_message(mock_channel, method, properties(), json.dumps(task).encode())
+
+    aligner.align.assert_called_once_with(task)
+    updater.update_job_status.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_cancelled_job_is_skipped_on_delivery(mock_channel, method, job, service, updater, cancellation):
+    cancellation.cancelled.return_value = "job1"
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    service.mmseqs2_search.assert_not_called()
+    updater.update_job_status.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_chunk_of_job_cancelled_while_searched_is_marked_cancelled(mock_channel, method, job, service, updater):
+    chunk = {**job, "job_id": "job1-0", "parent_id": "job1"}
+    service.mmseqs2_search.side_effect = JobCancelled("job1")
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(chunk).encode())
+
+    assert [c.args for c in updater.update_job_status.call_args_list] == [("job1-0", "CANCELLED")]
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+    mock_channel.basic_publish.assert_not_called()
+
+
+def test_job_exceeding_a_limit_is_failed_with_the_reason(mock_channel, method, job, service, updater):
+    service.mmseqs2_search.side_effect = LimitExceeded("wall_time", "Job exceeded the wall time limit of 60s")
+
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
+
+    assert updater.update_job_status.call_args.args == ("job1", "FAILED")
+    assert updater.update_job_status.call_args.kwargs["error"] == "Job exceeded the wall time limit of 60s"
+    assert published(mock_channel)[0][0] == "task_queue.dead"
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
+
+
+def test_job_claimed_by_a_running_worker_is_deferred(mock_channel, method, job, service, updater, job_claim):
+    job_claim.claim.return_value = "RUNNING"
+
+    consumer.handle_message(mock_channel, method, properties(1), json.dumps(job).encode())
 
+    service.mmseqs2_search.assert_not_called()
+    updater.update_job_status.assert_not_called()
+    # not counted as a retry
+    assert published(mock_channel) == [(f"task_queue.retry.{consumer.CLAIM_LEASE_SECONDS}s", {RETRY_COUNT_HEADER: 1})]
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
 
-def test_handle_message_success(mock_channel, sample_message):
-    body = json.dumps(sample_message).encode()
 
-    with patch("consumer.mmseqs2_search", return_value={"status": "ok"}) as mock_mmseqs2_search, \
-         patch("consumer.save_result") as mock_save:
+def test_finished_job_is_skipped_on_redelivery(mock_channel, method, job, service, updater, job_claim):
+    job_claim.claim.return_value = "FINISHED"
 
-        consumer.handle_message(mock_channel, MagicMock(), MagicMock(), body)
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
 
-        # Verify processor was called
-        mock_mmseqs2_search.assert_called_once_with(sample_message)
+    service.mmseqs2_search.assert_not_called()
+    mock_channel.basic_publish.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
 
-        # Verify db save was called
-        mock_save.assert_called_once_with(sample_message["job_id"], {"status": "ok"})
 
-        # Verify ack
-        mock_channel.basic_ack.assert_called_once()
+def test_retried_job_is_released(mock_channel, method, job, service, updater, job_claim):
+    service.mmseqs2_search.side_effect = TransientError("metadb down")
 
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
 
-def test_handle_message_failure(mock_channel, sample_message):
-    body = json.dumps(sample_message).encode()
-    
-    # Mock method with a delivery_tag
-    mock_method = MagicMock()
-    mock_method.delivery_tag = 42
+    job_claim.release.assert_called_once_with("job1")
+    assert published(mock_channel)[0][0] == "task_queue.retry.5s"
 
-    with patch("consumer.mmseqs2_search", side_effect=Exception("fail")), \
-         patch("consumer.save_result") as mock_save:
 
-        consumer.handle_message(mock_channel, mock_method, MagicMock(), body)
+def test_job_cancelled_before_it_finished_is_left_cancelled(mock_channel, method, job, service, updater):
+    updater.update_job_status.side_effect = StatusConflict("job1", "CANCELLED")
 
-        # DB should not be called
-        mock_save.assert_not_called()
+    consumer.handle_message(mock_channel, method, properties(), json.dumps(job).encode())
 
-        # basic_nack should be called with the correct delivery_tag
-        mock_channel.basic_nack.assert_called_once_with(
-            delivery_tag=42,
-            requeue=False  # or True if your consumer requeues failed messages
-        )
\ No newline at end of file
+    mock_channel.basic_publish.assert_not_called()
+    mock_channel.basic_ack.assert_called_once_with(delivery_tag=42)
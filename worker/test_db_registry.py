@@ -0,0 +1,132 @@
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from db_registry import DbRegistry, main, read_version
+from mmseqs_service import MMSeqsService
+from retry import TransientError
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+
+
+@pytest.fixture
+def control_dir(tmp_path):
+    path = tmp_path / "results"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def registry(tmp_path, control_dir):
+    registry = DbRegistry(tmp_path / "versions", "swissprot", control_dir, mmseqs_bin=FAKE_MMSEQS, retire_grace_seconds=0)
+    registry.register("2024_06", tmp_path / "swissprot")
+    return registry
+
+
+def test_first_version_is_active_and_published(registry, control_dir):
+    assert registry.active == "2024_06"
+    assert read_version(control_dir / ".db_version") == "2024_06"
+    with registry.acquire() as db:
+        assert db.version == "2024_06"
+        assert registry.versions() == [("2024_06", "active", 1)]
+
+
+def test_sync_prepares_target_and_switches_new_jobs(registry, control_dir, tmp_path):
+    main(["--control-dir", str(control_dir), "release", "2025_01"])
+
+    with registry.acquire() as old:
+        registry.sync()
+        # the job on the old version keeps it until it is done
+        assert registry.versions() == [("2024_06", "retiring", 1), ("2025_01", "active", 0)]
+        assert old.version == "2024_06"
+    assert (tmp_path / "versions" / "2025_01" / "swissprot").is_file()
+    assert read_version(control_dir / ".db_version") == "2025_01"
+    with registry.acquire() as db:
+        assert db.path == tmp_path / "versions" / "2025_01" / "swissprot"
+
+    assert registry.retire_drained() == ["2024_06"]
+    assert registry.versions() == [("2025_01", "active", 0)]
+
+
+def test_target_is_published_once_every_live_worker_serves_it(registry, control_dir, tmp_path):
+    registry.worker_id = "worker-1"
+    other = DbRegistry(tmp_path / "versions-2", "swissprot", control_dir, mmseqs_bin=FAKE_MMSEQS, worker_id="worker-2")
+    other.register("2024_06", tmp_path / "swissprot")
+    other.report()
+    main(["--control-dir", str(control_dir), "release", "2025_01"])
+
+    registry.sync()
+    # the other worker would fail the jobs of the new version
+    assert read_version(control_dir / ".db_version") == "2024_06"
+    assert registry.active == "2024_06"
+
+    other.sync()
+    assert read_version(control_dir / ".db_version") == "2025_01"
+    assert other.active == "2025_01"
+    registry.sync()
+    assert registry.active == "2025_01"
+
+    other.stop()
+    assert not (control_dir / ".db_workers" / "worker-2").exists()
+
+
+def test_dead_workers_do_not_hold_the_switch_back(registry, control_dir):
+    registry.worker_id = "worker-1"
+    workers = control_dir / ".db_workers"
+    workers.mkdir()
+    (workers / "worker-2").write_text("2024_06\n")
+    os.utime(workers / "worker-2", (0, 0))
+    main(["--control-dir", str(control_dir), "release", "2025_01"])
+
+    registry.sync()
+
+    assert read_version(control_dir / ".db_version") == "2025_01"
+    assert [path.name for path in workers.iterdir()] == ["worker-1"]
+
+
+def test_target_that_is_not_the_release_of_the_source_is_not_prepared(registry, control_dir, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_MMSEQS_RELEASE", "2025_02")
+    main(["--control-dir", str(control_dir), "release", "2025_01"])
+
+    with pytest.raises(ValueError, match="serves release 2025_02"):
+        registry.sync()
+    assert not (tmp_path / "versions" / "2025_01").exists()
+    # not downloaded again within the hour
+    registry.sync()
+    assert read_version(control_dir / ".db_version") == "2024_06"
+
+    monkeypatch.setenv("FAKE_MMSEQS_RELEASE", "2025_01")
+    registry.sync(now=time.time() + 3601)
+    assert read_version(control_dir / ".db_version") == "2025_01"
+
+
+def test_jobs_for_unknown_versions_are_transient_failures(registry):
+    with pytest.raises(TransientError, match="2030_01"):
+        with registry.acquire("2030_01"):
+            pass
+
+
+def test_pod_started_with_an_older_version_does_not_publish_it(tmp_path, control_dir):
+    main(["--control-dir", str(control_dir), "release", "2025_01"])
+    (control_dir / ".db_version").write_text("2025_01\n")
+    registry = DbRegistry(tmp_path / "versions", "swissprot", control_dir, mmseqs_bin=FAKE_MMSEQS)
+
+    registry.register("2024_06", tmp_path / "swissprot")
+
+    assert read_version(control_dir / ".db_version") == "2025_01"
+
+
+def test_search_uses_the_version_of_the_job(registry, control_dir, tmp_path):
+    main(["--control-dir", str(control_dir), "release", "2025_01"])
+    registry.retire_grace_seconds = 300
+    registry.sync()
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", control_dir, FAKE_MMSEQS, db_registry=registry)
+
+    service.mmseqs2_search({"job_id": "job1", "fasta": ">q1\nMKTAYIAKQR\n", "db_version": "2024_06"})
+
+    assert (control_dir / "alignments" / "job1" / "db_version").read_text() == "2024_06"
+    task = {"job_id": "job1", "task": "convertalis", "format_output": "query,target", "format_id": "abc"}
+    assert service.convert_format(task).is_file()
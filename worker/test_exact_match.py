@@ -0,0 +1,85 @@
+import gzip
+import sys
+from pathlib import Path
+
+import pytest
+
+from exact_match import ExactMatchIndex, build, merge_hits, read_fasta
+from mmseqs_service import MMSeqsService
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+
+TARGETS = ">sp|P1|A\nMKTAYIAKQR\n>sp|P2|B\nQISFVKSHFS\n>sp|P3|C\nmktayiakqr\n"
+NEIGHBOURS = (
+    "sp|P1|A\tsp|P1|A\t1.000\t10\t0\t0\t1\t10\t1\t10\t1.0E-10\t50\n"
+    "sp|P1|A\tsp|P3|C\t1.000\t10\t0\t0\t1\t10\t1\t10\t1.0E-10\t50\n"
+    "sp|P2|B\tsp|P2|B\t1.000\t10\t0\t0\t1\t10\t1\t10\t1.0E-10\t50\n"
+)
+
+
+@pytest.fixture
+def index_path(tmp_path):
+    (tmp_path / "targets.fasta").write_text(TARGETS)
+    (tmp_path / "neighbours.m8").write_text(NEIGHBOURS)
+    path = tmp_path / "targets.exact.sqlite"
+    build("db", path, neighbours=tmp_path / "neighbours.m8", fasta=tmp_path / "targets.fasta")
+    return path
+
+
+def test_lookup_identical_sequences(index_path):
+    index = ExactMatchIndex(index_path)
+
+    hits = index.lookup("MKTAYIAKQR*")
+    assert [hit.split("\t")[0] for hit in hits] == ["sp|P1|A", "sp|P3|C"]
+    # identical sequences share the hits of the first target
+    assert index.lookup("mktay iakqr") == hits
+    assert index.lookup("MKTAYIAKQ") is None
+
+
+def test_merge_hits_keeps_submission_order():
+    records = [("q1", "A"), ("q2", "B"), ("q3", "C"), ("q4", "D")]
+    precomputed = {1: ["t1\t1.0"], 3: ["t2\t1.0", "t3\t0.9"]}
+    search_lines = ["q1\tt9\t0.5\n", "q3\tt8\t0.4\n"]
+
+    assert list(merge_hits(records, precomputed, search_lines)) == [
+        "q1\tt9\t0.5\n",
+        "q2\tt1\t1.0\n",
+        "q3\tt8\t0.4\n",
+        "q4\tt2\t1.0\n",
+        "q4\tt3\t0.9\n",
+    ]
+
+
+def test_search_answers_exact_matches_without_mmseqs(tmp_path, index_path):
+    (tmp_path / "results").mkdir()
+    # any mmseqs run fails the job
+    index = ExactMatchIndex(index_path)
+    service = MMSeqsService(
+        tmp_path / "db", tmp_path / "workspace", tmp_path / "results", "false", exact_match_index=index
+    )
+
+    result_file = service.mmseqs2_search({"job_id": "job1", "fasta": ">query\nMKTAYIAKQR\n"})
+
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    assert [line.split("\t")[:2] for line in lines] == [["query", "sp|P1|A"], ["query", "sp|P3|C"]]
+    assert not (tmp_path / "results" / "alignments" / "job1").exists()
+
+
+def test_search_only_searches_the_other_queries(tmp_path, index_path):
+    (tmp_path / "results").mkdir()
+    index = ExactMatchIndex(index_path)
+    service = MMSeqsService(
+        tmp_path / "db", tmp_path / "workspace", tmp_path / "results", FAKE_MMSEQS, exact_match_index=index
+    )
+    fasta = ">q1\nMKTAYIAKQRQISFVKSHFSRQD\n>q2\nQISFVKSHFS\n>q3\nMKTAYIAKQRQ\n"
+
+    result_file = service.mmseqs2_search({"job_id": "job1", "fasta": fasta})
+
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    queries = [line.split("\t")[0] for line in lines]
+    assert queries == ["q1"] * 50 + ["q2"] + ["q3"] * 50
+    assert lines[50].split("\t")[1] == "sp|P2|B"
+
+
+def test_read_fasta_uses_the_first_word_of_the_header():
+    assert list(read_fasta([">sp|P1|A desc", "MKT", "AYI", "", ">q2", "QIS"])) == [("sp|P1|A", "MKTAYI"), ("q2", "QIS")]
@@ -0,0 +1,57 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from incremental import HITS_FILE, PROGRESS_FILE, IncrementalSearch
+from mmseqs_service import MMSeqsService
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+
+
+@pytest.fixture
+def service(tmp_path):
+    (tmp_path / "results").mkdir()
+    return MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", FAKE_MMSEQS)
+
+
+def test_hits_of_each_step_are_published(service):
+    incremental = IncrementalSearch(service, 10)
+    job = {"job_id": "job1", "fasta": ">q1\nMKTAYIAKQR\n>q2\nMKV\n>q3\nMKTAYIAKQR\n"}
+    partial_dir = service.result_path / ".partial" / "job1"
+    seen = []
+    run_search = service.run_search
+
+    def search_step(*args):
+        if (partial_dir / PROGRESS_FILE).exists():
+            progress = json.loads((partial_dir / PROGRESS_FILE).read_text())
+            hits = (partial_dir / HITS_FILE).read_bytes()[: progress["bytes"]].decode()
+            seen.append((progress["queries_done"], progress["queries_total"], {line.split("\t")[0] for line in hits.splitlines()}))
+        run_search(*args)
+
+    assert incremental.applies(job)
+    with patch.object(service, "run_search", side_effect=search_step):
+        result_file = incremental.search(job)
+
+    # q1 alone, then q2 and q3 together (13 residues) in two steps
+    assert seen == [(1, 3, {"q1"}), (2, 3, {"q1", "q2"})]
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    assert [line.split("\t")[0] for line in lines] == sorted(line.split("\t")[0] for line in lines)
+    assert not partial_dir.exists()
+    # the other output formats are converted from the alignment DBs of the steps
+    converted = service.convert_format({"job_id": "job1", "format_output": "query,target", "format_id": "f1"})
+    assert len(gzip.decompress(converted.read_bytes()).decode().splitlines()) == len(lines)
+
+
+def test_failed_search_leaves_no_partial_result(service):
+    incremental = IncrementalSearch(service, 3)
+    job = {"job_id": "job1", "fasta": ">q1\nMKV\n>q2\nMKV\n"}
+
+    with patch.object(service, "run_search", side_effect=RuntimeError("mmseqs search failed")):
+        with pytest.raises(RuntimeError):
+            incremental.search(job)
+
+    assert not (service.result_path / ".partial" / "job1").exists()
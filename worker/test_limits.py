@@ -0,0 +1,42 @@
+import sys
+import time
+
+import pytest
+
+from limits import JobLimits, LimitExceeded, directory_size
+from mmseqs_service import MMSeqsService
+
+
+def test_wall_time_limit_kills_mmseqs(tmp_path):
+    limits = JobLimits(wall_time_seconds=1)
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", sys.executable, limits=limits)
+
+    limits.start()
+    start = time.monotonic()
+    with pytest.raises(LimitExceeded) as excinfo:
+        service.run_mmseqs("job1", "-c", "import time; time.sleep(30)")
+    assert excinfo.value.limit == "wall_time"
+    assert time.monotonic() - start < 5
+
+
+def test_scratch_limit_is_checked_once_per_interval(tmp_path):
+    (tmp_path / "tmp").mkdir()
+    (tmp_path / "tmp" / "prefilter").write_bytes(b"x" * 100)
+    now = [0.0]
+    limits = JobLimits(scratch_bytes=50, scratch_check_seconds=5, clock=lambda: now[0])
+
+    limits.start()
+    assert directory_size(tmp_path) == 100
+    assert limits.exceeded(tmp_path).limit == "scratch"
+    assert limits.exceeded(tmp_path) is None
+    now[0] = 5
+    assert "100 bytes used" in str(limits.exceeded(tmp_path))
+
+
+def test_output_of_mmseqs_is_bounded(tmp_path):
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", sys.executable)
+
+    with pytest.raises(RuntimeError) as excinfo:
+        service.run_mmseqs("job1", "-c", "import sys; sys.stderr.write('x' * 200000 + 'the end'); sys.exit(1)")
+    assert len(str(excinfo.value)) < 70 * 1024
+    assert str(excinfo.value).endswith("the end")
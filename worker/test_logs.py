@@ -0,0 +1,47 @@
+import logging
+import queue
+
+from logs import BoundedQueueHandler, Payload, SamplingFilter, truncate
+
+
+def record(msg, *args, level=logging.INFO):
+    return logging.LogRecord("worker", level, __file__, 1, msg, args, None)
+
+
+def test_payload_summarizes_the_fasta():
+    fasta = ">q1\n" + "M" * 5000 + "\n>q2\nMKT\n"
+    logged = str(Payload({"job_id": "job1", "fasta": fasta, "note": "x" * 1000}))
+
+    assert "job_id=job1" in logged
+    assert f"fasta=<2 queries, {len(fasta)} bytes>" in logged
+    assert "MMMM" not in logged
+    assert "(800 more characters)" in logged
+    assert truncate("short") == "short"
+
+
+def test_sampling_filter_logs_a_burst_per_interval():
+    now = [0.0]
+    sampling = SamplingFilter(burst=2, interval=10, clock=lambda: now[0])
+
+    passed = [sampling.filter(record("Job %s done", i)) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    # warnings are never sampled
+    assert sampling.filter(record("Job %s done", 6, level=logging.WARNING))
+
+    now[0] = 10
+    next_record = record("Job %s done", 7)
+    assert sampling.filter(next_record)
+    assert next_record.getMessage() == "Job 7 done (3 similar messages suppressed)"
+
+
+def test_queue_handler_drops_records_without_formatting_them():
+    class Unformattable(object):
+        def __str__(self):
+            raise AssertionError("formatted on the logging thread")
+
+    handler = BoundedQueueHandler(queue.Queue(1))
+
+    handler.handle(record("Received job: %s", Unformattable()))
+    handler.handle(record("Received job: %s", Unformattable()))
+    assert handler.queue.qsize() == 1
+    assert handler.dropped == 1
@@ -0,0 +1,106 @@
+import gzip
+import hashlib
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+from mmseqs_service import MMSeqsService, gzip_file
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+
+
+@pytest.fixture
+def job():
+    return {"job_id": "job1", "fasta": ">q1\nMKTAYIAKQRQISFVKSHFSRQDILDLWIYHTQGYFPQ\n"}
+
+
+def make_service(tmp_path, **kwargs):
+    (tmp_path / "results").mkdir()
+    return MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", FAKE_MMSEQS, **kwargs)
+
+
+def test_search_writes_compressed_result(tmp_path, job):
+    service = make_service(tmp_path)
+
+    result_file = service.mmseqs2_search(job)
+
+    assert result_file == tmp_path / "results" / "job1.m8.gz"
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    assert len(lines) == 50
+    assert lines[0].startswith("q1\t")
+    assert len(lines[0].split("\t")) == 12
+    # the query and alignment DBs are kept for other output formats
+    assert (tmp_path / "results" / "alignments" / "job1" / "aln").is_file()
+
+
+def test_search_writes_result_atomically_with_checksum_marker(tmp_path, job):
+    service = make_service(tmp_path)
+
+    result_file = service.mmseqs2_search(job)
+
+    marker = tmp_path / "results" / "job1.m8.gz.sha256"
+    assert marker.read_text() == f"{hashlib.sha256(result_file.read_bytes()).hexdigest()}  job1.m8.gz\n"
+    assert list((tmp_path / "results" / ".staging").iterdir()) == []
+    assert service.find_result("job1") == result_file
+
+
+def test_find_result_rejects_incomplete_results(tmp_path, job):
+    service = make_service(tmp_path)
+    assert service.find_result("job1") is None
+
+    result_file = service.mmseqs2_search(job)
+    # a result written before the markers existed, or truncated, is searched again
+    result_file.write_bytes(result_file.read_bytes()[:-10])
+    assert service.find_result("job1") is None
+    (tmp_path / "results" / "job1.m8.gz.sha256").unlink()
+    assert service.find_result("job1") is None
+
+
+def test_convert_format_reuses_alignment_db(tmp_path, job):
+    service = make_service(tmp_path)
+    service.mmseqs2_search(job)
+    task = {"job_id": "job1", "task": "convertalis", "format_output": "query,target,qlen", "format_id": "abc"}
+
+    result_file = service.convert_format(task)
+
+    assert result_file == tmp_path / "results" / "job1.abc.m8.gz"
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    assert len(lines) == 50
+    assert lines[0].split("\t")[::2] == ["q1", "38"]
+    assert service.convert_format(task) == result_file
+
+
+def test_convert_format_without_alignment_db_fails(tmp_path):
+    service = make_service(tmp_path)
+    task = {"job_id": "job1", "task": "convertalis", "format_output": "query", "format_id": "abc"}
+
+    with pytest.raises(ValueError, match="Alignment DB of job job1 not found"):
+        service.convert_format(task)
+
+
+def test_search_without_compression_writes_plain_result(tmp_path, job):
+    service = make_service(tmp_path, compression="none")
+
+    result_file = service.mmseqs2_search(job)
+
+    assert result_file == tmp_path / "results" / "job1.m8"
+    assert len(result_file.read_text().splitlines()) == 50
+
+
+def test_gzip_file_chunked_layout_is_restartable(tmp_path):
+    src = tmp_path / "result.m8"
+    content = b"".join(f"q{i}\tt{i}\t1.000\n".encode() for i in range(1000))
+    src.write_bytes(content)
+    dst = tmp_path / "result.m8.gz"
+
+    gzip_file(src, dst, chunk_size=1000)
+
+    compressed = dst.read_bytes()
+    assert gzip.decompress(compressed) == content
+    # a full flush ends with an empty stored block, decompression can restart right after it
+    boundary = compressed.index(b"\x00\x00\xff\xff") + 4
+    tail = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed[boundary:])
+    assert content.endswith(tail)
+    assert tail.startswith(b"q")
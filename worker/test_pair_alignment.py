@@ -0,0 +1,62 @@
+import gzip
+import json
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from mmseqs_service import MMSeqsService
+from pair_alignment import PairAligner, render
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+FASTA = ">q1\nMKTAYIAKQRQISFVKSHFSRQDILDLWIYHTQGYFPQ\n>q2\nMSKGEELFTGVVPILVELDGDVNGHKFSVSGEGEGDATYGKLTLKFICTT\n"
+
+
+@pytest.fixture
+def service(tmp_path):
+    (tmp_path / "results").mkdir()
+    return MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", FAKE_MMSEQS)
+
+
+def first_hit(service, query):
+    result_file = service.find_result("job1")
+    for line in gzip.decompress(result_file.read_bytes()).decode().splitlines():
+        if line.startswith(f"{query}\t"):
+            return line.split("\t")[1]
+
+
+def test_render_blocks_alignment_with_positions():
+    hit = {"qaln": "MKT-AY", "taln": "MRTLAY", "qstart": 5, "qend": 9, "tstart": 1, "tend": 6}
+
+    assert render(hit, width=4) == "Query  5  MKT-  7\n          M T \nSbjct  1  MRTL  4\n\nQuery  8  AY  9\n          AY\nSbjct  5  AY  6\n"
+
+
+def test_pairs_are_extracted_from_the_alignment_db_and_cached(service):
+    service.mmseqs2_search({"job_id": "job1", "fasta": FASTA})
+    aligner = PairAligner(service)
+    target = first_hit(service, "q2")
+    task = {"job_id": "job1", "task": "align", "pairs": [{"query": "q2", "target": target}, {"query": "q1", "target": "nope"}]}
+
+    assert aligner.align(task) == 2
+
+    entry = json.loads(aligner.cache_file("job1", "q2", target).read_text())
+    assert entry["found"] and entry["qstart"] == 1 and entry["qaln"].startswith("MSKGE")
+    assert entry["rendered"].startswith("Query  1")
+    assert json.loads(aligner.cache_file("job1", "q1", "nope").read_text()) == {"query": "q1", "target": "nope", "found": False}
+    # cached pairs are not aligned again
+    with patch.object(service, "run_mmseqs") as run_mmseqs:
+        assert aligner.align(task) == 0
+    run_mmseqs.assert_not_called()
+
+
+def test_expired_alignment_db_realigns_the_queries_of_the_pairs(service):
+    service.mmseqs2_search({"job_id": "job1", "fasta": FASTA})
+    target = first_hit(service, "q1")
+    service.alignment_path.joinpath("job1").rename(service.alignment_path / "gone")
+    aligner = PairAligner(service)
+
+    with pytest.raises(ValueError):
+        aligner.align({"job_id": "job1", "pairs": [{"query": "q1", "target": target}]})
+    assert aligner.align({"job_id": "job1", "pairs": [{"query": "q1", "target": target}], "fasta": FASTA}) == 1
+    assert json.loads(aligner.cache_file("job1", "q1", target).read_text())["found"]
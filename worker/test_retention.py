@@ -0,0 +1,120 @@
+import os
+from unittest.mock import MagicMock
+
+import pytest
+
+from retention import ResultRetentionManager
+
+
+@pytest.fixture
+def result_dir(tmp_path):
+    return tmp_path
+
+
+def write_result(result_dir, job_id, size, last_access):
+    path = result_dir / f"{job_id}.m8"
+    path.write_bytes(b"x" * size)
+    os.utime(path, (last_access, last_access))
+    return path
+
+
+def test_sweep_evicts_expired_results(result_dir):
+    updater = MagicMock()
+    write_result(result_dir, "old", 10, 1000)
+    write_result(result_dir, "new", 10, 1900)
+    manager = ResultRetentionManager(result_dir, updater, ttl_seconds=500)
+
+    assert manager.sweep(now=2000) == ["old"]
+    assert not (result_dir / "old.m8").exists()
+    assert (result_dir / "new.m8").exists()
+    updater.update_job_status.assert_called_once_with("old", "EXPIRED")
+
+
+def test_sweep_evicts_least_recently_used_down_to_low_watermark(result_dir):
+    updater = MagicMock()
+    write_result(result_dir, "a", 40, 1000)
+    write_result(result_dir, "b", 40, 1100)
+    write_result(result_dir, "c", 40, 1200)
+    manager = ResultRetentionManager(result_dir, updater, max_bytes=100, low_watermark=0.5)
+
+    assert manager.sweep(now=2000) == ["a", "b"]
+    assert [p.name for p in result_dir.iterdir()] == ["c.m8"]
+
+
+def test_sweep_within_budget_keeps_results(result_dir):
+    updater = MagicMock()
+    write_result(result_dir, "a", 40, 1000)
+    manager = ResultRetentionManager(result_dir, updater, max_bytes=100, ttl_seconds=5000)
+
+    assert manager.sweep(now=2000) == []
+    updater.update_job_status.assert_not_called()
+
+
+def test_sweep_keeps_going_when_status_update_fails(result_dir):
+    updater = MagicMock()
+    updater.update_job_status.side_effect = Exception("metadb down")
+    write_result(result_dir, "a", 10, 1000)
+    write_result(result_dir, "b", 10, 1000)
+    manager = ResultRetentionManager(result_dir, updater, ttl_seconds=1)
+
+    assert sorted(manager.sweep(now=2000)) == ["a", "b"]
+    assert list(result_dir.iterdir()) == []
+
+
+def test_sweep_keeps_status_of_jobs_with_evicted_output_formats(result_dir):
+    updater = MagicMock()
+    write_result(result_dir, "job", 10, 1900)
+    write_result(result_dir, "job.0123456789ab", 10, 1000)
+    manager = ResultRetentionManager(result_dir, updater, ttl_seconds=500)
+
+    assert manager.sweep(now=2000) == []
+    assert [p.name for p in result_dir.iterdir()] == ["job.m8"]
+    updater.update_job_status.assert_not_called()
+
+
+def test_sweep_removes_expired_alignment_dbs(result_dir):
+    alignments = result_dir / "alignments"
+    for job_id, mtime in (("old", 1000), ("new", 1900)):
+        (alignments / job_id).mkdir(parents=True)
+        (alignments / job_id / "aln").write_text("x")
+        os.utime(alignments / job_id, (mtime, mtime))
+    manager = ResultRetentionManager(result_dir, MagicMock(), alignment_dir=alignments, alignment_ttl_seconds=500)
+
+    assert manager.enabled
+    manager.sweep(now=2000)
+    assert [p.name for p in alignments.iterdir()] == ["new"]
+
+
+def test_sweep_removes_stale_pending_markers(result_dir):
+    pending = result_dir / ".pending"
+    for job_id, mtime in (("old", 1000), ("new", 1900)):
+        (pending / job_id).mkdir(parents=True)
+        (pending / job_id / "abc").touch()
+        os.utime(pending / job_id, (mtime, mtime))
+    manager = ResultRetentionManager(result_dir, MagicMock(), alignment_ttl_seconds=500)
+
+    assert manager.sweep_pending(now=2000) == ["old"]
+    assert [p.name for p in pending.iterdir()] == ["new"]
+
+
+def test_sweep_removes_checksum_markers_of_evicted_results(result_dir):
+    write_result(result_dir, "old", 10, 1000)
+    (result_dir / "old.m8.sha256").write_text("0  old.m8\n")
+    manager = ResultRetentionManager(result_dir, MagicMock(), ttl_seconds=500)
+
+    assert manager.sweep(now=2000) == ["old"]
+    assert list(result_dir.iterdir()) == []
+
+
+def test_sweep_removes_abandoned_staging_files(result_dir):
+    staging = result_dir / ".staging"
+    staging.mkdir()
+    for name, mtime in (("old.m8.gz.1", 1000), ("new.m8.gz.2", 1900)):
+        (staging / name).write_text("x")
+        os.utime(staging / name, (mtime, mtime))
+    (staging / "job.3").mkdir()
+    os.utime(staging / "job.3", (1000, 1000))
+    manager = ResultRetentionManager(result_dir, MagicMock(), staging_ttl_seconds=500)
+
+    assert sorted(manager.sweep_staging(now=2000)) == ["job.3", "old.m8.gz.1"]
+    assert [p.name for p in staging.iterdir()] == ["new.m8.gz.2"]
@@ -0,0 +1,32 @@
+from unittest.mock import MagicMock
+
+import requests
+
+from retry import RetryPolicy, TransientError, is_transient
+
+
+def test_delay_doubles_up_to_the_max_delay():
+    policy = RetryPolicy("jobs", max_retries=6, base_delay=5, max_delay=60)
+
+    assert [policy.delay(attempt) for attempt in range(6)] == [5, 10, 20, 40, 60, 60]
+
+
+def test_declare_creates_one_delay_queue_per_backoff_step():
+    channel = MagicMock()
+    policy = RetryPolicy("jobs", max_retries=3, base_delay=5, max_delay=10)
+
+    policy.declare(channel)
+
+    declared = {c.kwargs["queue"]: c.kwargs.get("arguments") for c in channel.queue_declare.call_args_list}
+    assert declared == {
+        "jobs.dead": None,
+        "jobs.retry.5s": {"x-message-ttl": 5000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "jobs"},
+        "jobs.retry.10s": {"x-message-ttl": 10000, "x-dead-letter-exchange": "", "x-dead-letter-routing-key": "jobs"},
+    }
+
+
+def test_network_and_metadb_failures_are_transient():
+    assert is_transient(TransientError("metadb down"))
+    assert is_transient(requests.ConnectionError("refused"))
+    assert not is_transient(RuntimeError("mmseqs search failed"))
+    assert not is_transient(ValueError("No FASTA content in job"))
@@ -0,0 +1,66 @@
+import gzip
+import io
+import json
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from mmseqs_service import MMSeqsService
+from sharding import ShardedSearch, merge_parts, split_fasta
+
+FAKE_MMSEQS = f"{sys.executable} {Path(__file__).parent / 'benchmarks' / 'fake_mmseqs.py'}"
+
+
+def hit(query, target, evalue, bits):
+    return f"{query}\t{target}\t0.9\t10\t1\t0\t1\t10\t1\t10\t{evalue}\t{bits}\n"
+
+
+def test_merge_parts_ranks_hits_by_bit_score_per_query(tmp_path):
+    (tmp_path / "0.m8").write_text(hit("q2", "a", "1.0E-10", 50) + hit("q1", "b", "1.0E-20", 80))
+    (tmp_path / "1.m8").write_text(hit("q1", "c", "1.0E-30", 90) + hit("q2", "d", "1.0E-05", 30))
+    out = io.StringIO()
+
+    merge_parts(["q1", "q2"], [tmp_path / "0.m8", tmp_path / "1.m8"], out, 2)
+
+    lines = [line.split("\t") for line in out.getvalue().splitlines()]
+    assert [(c[0], c[1]) for c in lines] == [("q1", "c"), ("q1", "b"), ("q2", "a"), ("q2", "d")]
+    # e-values of a shard scaled to the full DB
+    assert lines[0][10] == "2.000E-30"
+
+
+def test_scatter_publishes_one_sub_task_per_shard(tmp_path):
+    channel = MagicMock()
+    service = SimpleNamespace(result_path=tmp_path)
+    sharded = ShardedSearch(service, "jobs", 3)
+
+    sharded.scatter(channel, {"job_id": "job1", "fasta": ">q1\nMK\n"}, SimpleNamespace(timestamp=1))
+
+    published = [(c.kwargs["routing_key"], json.loads(c.kwargs["body"])) for c in channel.basic_publish.call_args_list]
+    assert [key for key, _ in published] == ["jobs.shard.0", "jobs.shard.1", "jobs.shard.2"]
+    assert [(task["shard"], task["shards"]) for _, task in published] == [(0, 3), (1, 3), (2, 3)]
+
+
+def test_last_shard_merges_the_result(tmp_path):
+    (tmp_path / "results").mkdir()
+    service = MMSeqsService(tmp_path / "db", tmp_path / "workspace", tmp_path / "results", FAKE_MMSEQS)
+    sharded = ShardedSearch(service, "jobs", 2)
+    job = {"job_id": "job1", "fasta": ">q1\nMKTAYIAKQR\n>q2\nMKV\n", "shards": 2}
+
+    assert sharded.search({**job, "shard": 1}) is None
+    # a redelivered shard does not search again
+    assert sharded.search({**job, "shard": 1}) is None
+    result_file = sharded.search({**job, "shard": 0})
+
+    assert result_file == tmp_path / "results" / "job1.m8.gz"
+    lines = gzip.decompress(result_file.read_bytes()).decode().splitlines()
+    assert len(lines) == 200
+    assert [line.split("\t")[0] for line in lines] == ["q1"] * 100 + ["q2"] * 100
+    assert not (tmp_path / "results" / ".shards" / "job1").exists()
+
+
+def test_split_fasta_deals_records_round_robin():
+    lines = [">a desc\n", "MK\n", "TA\n", ">b\n", "MV\n", ">c\n", "MA\n"]
+
+    assert list(split_fasta(lines, 2, 0)) == [">a desc\n", "MK\n", "TA\n", ">c\n", "MA\n"]
+    assert list(split_fasta(lines, 2, 1)) == [">b\n", "MV\n"]
@@ -0,0 +1,43 @@
+import gzip
+
+from summary import summarize, summarize_lines
+
+
+def hit(query, target, identity, evalue, bits):
+    return f"{query}\t{target}\t{identity}\t10\t1\t0\t1\t10\t1\t10\t{evalue}\t{bits}\n"
+
+
+def test_summary_counts_hits_and_keeps_best_hit_per_query():
+    lines = [hit("q1", "a", 0.95, "1E-60", 200), hit("q1", "b", 0.5, "2.0", 20), hit("q2", "c", 0.35, "1E-7", 50)]
+
+    summary = summarize_lines(lines)
+
+    assert (summary["queries"], summary["hits"]) == (2, 3)
+    assert summary["per_query"]["q1"] == {
+        "hits": 2,
+        "best": {"target": "a", "evalue": 1e-60, "bits": 200.0, "identity": 0.95},
+    }
+    assert summary["per_query"]["q2"]["best"]["target"] == "c"
+    assert {k: v for k, v in summary["evalue"].items() if v} == {"<=1e-50": 1, "<=1e-05": 1, ">1": 1}
+    assert {k: v for k, v in summary["identity"].items() if v} == {"0.9-1.0": 1, "0.5-0.6": 1, "0.3-0.4": 1}
+
+
+def test_summary_counts_the_queries_of_the_job_and_keeps_the_best_queries():
+    lines = [hit("q1", "a", 0.5, "1E-5", 40), hit("q2", "b", 0.9, "1E-60", 200), hit("q3", "c", 0.7, "1E-20", 90)]
+
+    summary = summarize_lines(lines, queries=5, max_per_query=2)
+
+    assert (summary["queries"], summary["hits"]) == (5, 3)
+    assert list(summary["per_query"]) == ["q2", "q3"]
+    assert summary["per_query_truncated"]
+    assert not summarize_lines(lines)["per_query_truncated"]
+
+
+def test_summarize_reads_compressed_results(tmp_path):
+    result_file = tmp_path / "job.m8.gz"
+    result_file.write_bytes(gzip.compress(hit("q1", "a", 100, "0", 300).encode()))
+
+    summary = summarize(result_file)
+
+    assert summary["hits"] == 1
+    assert summary["identity"]["0.9-1.0"] == 1
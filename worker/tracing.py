@@ -0,0 +1,108 @@
+import json
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Same header the api uses to propagate the trace of the submission.
+TRACEPARENT_HEADER = "traceparent"
+
+_current_span = ContextVar("current_span", default=None)
+
+
+class Span(object):
+    """Single timed operation within a trace, identified with W3C trace context ids."""
+
+    def __init__(self, name, service, trace_id, span_id, parent_id=None, attributes=None):
+        self.name = name
+        self.service = service
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.parent_id = parent_id
+        self.start_time = time.time()
+        self.end_time = None
+        self.attributes = attributes or {}
+
+    @property
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "service": self.service,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration": None if self.end_time is None else self.end_time - self.start_time,
+            "attributes": self.attributes,
+        }
+
+
+def parse_traceparent(traceparent):
+    """Return (trace_id, parent_span_id) from the traceparent header, None if missing or malformed."""
+    if not traceparent:
+        return None
+    parts = traceparent.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2]
+
+
+class SpanExporter(object):
+    """Base class for the span exporters, the default implementation drops the spans."""
+
+    def export(self, span):
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Appends finished spans as JSON lines to a local file for offline analysis."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        line = json.dumps(span.to_dict(), default=str) + "\n"
+        with self._lock, open(self.path, "a") as f:
+            f.write(line)
+
+
+class Tracer(object):
+    def __init__(self, service, exporter=None):
+        self.service = service
+        self.exporter = exporter or SpanExporter()
+
+    @contextmanager
+    def start_span(self, name, traceparent=None, **attributes):
+        """Start a span as a child of the traceparent, the current span or as a new trace."""
+        parent = _current_span.get()
+        remote = parse_traceparent(traceparent)
+        if remote is not None:
+            trace_id, parent_id = remote
+        elif parent is not None:
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = secrets.token_hex(16), None
+        span = Span(name, self.service, trace_id, secrets.token_hex(8), parent_id, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.attributes["error"] = repr(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_time = time.time()
+            self.exporter.export(span)
+
+
+def current_span():
+    return _current_span.get()
+
+
+tracer = Tracer("worker")